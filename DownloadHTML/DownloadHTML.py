@@ -1,17 +1,28 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from utils import make_request, get_request_stats, get_timestamp, TokenBucket, AdaptiveThrottle, ValidatorCache
+from DownloadHTML.Manifest import Manifest
+from DownloadHTML.Journal import Journal
+from DownloadHTML.Metrics import Metrics
+from storage import open_storage, decode_page, FileStorage, ArchiveStorage
 from bs4 import BeautifulSoup as bs
-from signal import signal, SIGINT
-from utils import make_request
+from signal import signal, SIGINT, SIG_IGN
 from datetime import datetime
-from time import sleep
-import hashlib
+from time import sleep, monotonic
+import threading
+import shutil
 import cursor
 import json
 import sys
+import re
 import os
 
 
+# Returned by _retrieve_html when the server answers 304 to a conditional request (the local page is up to date)
+NOT_MODIFIED = object()
+
+
 class BTC_Downloader:
-    def __init__(self, base_uri=None, base_path='BitcoinTalk-Forum/'):
+    def __init__(self, base_uri=None, base_path='BitcoinTalk-Forum/', rate=2, max_workers=8, storage=None, quiet=False):
         if not base_uri:
             raise Exception("Missing keyword argument 'base_uri'")
         self._base_path = base_path
@@ -27,6 +38,28 @@ class BTC_Downloader:
         self._dl_start = None
         self._check_end = None
         self._failures = 0
+        # Global rate limit (requests per second) shared by all download threads, and max number of concurrent requests
+        # The throttle slows the rate down when errors pile up, and honours `Retry-After` headers
+        self._throttle = AdaptiveThrottle(TokenBucket(rate))
+        self._max_workers = max_workers
+        self._lock = threading.Lock()
+        # Pages that still fail after all retries are not written, they are kept here to be downloaded later
+        self._retry_queue = []
+        # Nb of pages left to download for each topic of the current jobs, the manifest counts of a topic are committed when it reaches 0
+        self._pages_left = {}
+        # ETag / Last-Modified of downloaded pages, so refreshing a page we already have is a conditional request
+        self._validators = ValidatorCache('./logs/validators.json')
+        # Persistent manifest of downloaded topics and pages, updated as pages are written
+        self._manifest = Manifest(os.path.join(self._base_path, 'manifest.sqlite'))
+        # New high-water marks of the boards, saved once their topics are downloaded
+        self._high_water = {}
+        # Journal of pending / done page jobs, used to resume an interrupted download
+        self._journal = Journal('./logs/journal.jsonl')
+        # Pages are read / written through the storage backend of the mirror (loose html files, or compressed packs)
+        self._storage = open_storage(self._base_path, storage)
+        # Per-request / per-page metrics (logs/events.jsonl + logs/metrics.prom), quiet mode replaces the per-page prints with them
+        self._metrics = Metrics()
+        self._quiet = quiet
         cursor.hide()
 
     def are_pages_missing(self, flag):
@@ -34,63 +67,40 @@ class BTC_Downloader:
         self._start = datetime.now()
         self._check_start = datetime.now()
         # Download the first page in case we need to get global informations about the forum
-        base_page = self._download_base_page()
-        # To avoid encoding problems we first need to decode the content in latin1, then encoding and decoding it in utf-8
-        content = base_page.content.decode('latin1').encode('utf-8').decode('utf-8')
+        content = self._download_base_page()
         # Write the content into a file
-        with open(f'{self._base_path}/Mining.html', 'w', encoding='utf-8') as file:
-            file.write(content)
+        self._storage.write_forum_page(content)
         # Start analyzing https://bitcointalk.org/index.php?board=14.0 (Mining)
+        # A full update walks every listing page, otherwise the crawl of a board stops at its previous high-water mark
+        full_update = flag in ('update', '--update')
         print('------------------------ FETCHING ONLINE DATA ------------------------'.center(200))
-        online_boards = self._get_online_board_list(base_page.content)
+        online_boards = self._get_online_board_list(decode_page(content), incremental=not full_update)
         # Saving results into a json file
         with open('./logs/file_online.json', 'w', encoding='utf-8') as file:
             json.dump(online_boards, file, indent=2)
         print()
         # If the user asks for a full update, we don't need to check what's already downloaded
-        if flag == '--update':
+        if full_update:
             print('------------------------ UPDATING ALL DATA ------------------------'.center(200))
             self._download_list = online_boards
             self._check_end = datetime.now()
             return True
-        # Else, we need to retrieve data about all topics that were already downloaded, in order to compare the list with online topics
+        # Else, we compare the list with the manifest of what's already downloaded
         else:
-            print('------------------------ FETCHING LOCAL DATA ------------------------'.center(200))
-            local_boards = self._get_local_board_list()
-            with open('./logs/file_local.json', 'w', encoding='utf-8') as file:
-                json.dump(local_boards, file, indent=2)
-            # Compare online_boards with local_boards to create a download_list
-            return self._check_missing_pages(online_boards, local_boards)
-
-    def _check_missing_pages(self, online_boards, local_boards):
-        self._download_list = {}
-        # We first need to iterate over the online list which contains all topics present on the forum
-        for boardname, boardinfos in online_boards.items():
-            # We check if current board is present in the local list
-            if boardname in local_boards.keys():
-                # If it is present, we'll have to check topics one by one
-                for topic in boardinfos['topics']:
-                    # We create a "topic_to_compare" in order to get rid of the "boardpage" field (inside the online list but not the local one)
-                    topic_to_cmp = {
-                        'first_page_link': topic['first_page_link'],
-                        'title': topic['title'],
-                        'pages': topic['pages']
-                    }
-                    # If the topic is not present into the local list, then we need to append it into the download list
-                    if topic_to_cmp not in local_boards[boardname]['topics']:
-                        # Create a board object the first time
-                        if boardname not in self._download_list.keys():
-                            self._download_list[boardname] = {
-                                'first_page': boardinfos['first_page'],
-                                'pages': boardinfos['pages'],
-                                'links': boardinfos['links'],
-                                'topics': []
-                            }
-                        # Then we just need to append topics to the board
-                        self._download_list[boardname]['topics'].append(topic)
-            # If the board is not present, just copy it into the download list
-            else:
-                self._download_list[boardname] = boardinfos
+            # Mirrors downloaded before the manifest existed are parsed once, to fill the manifest
+            if self._manifest.is_empty() and self._storage.boards():
+                print('------------------------ FETCHING LOCAL DATA ------------------------'.center(200))
+                local_boards = self._get_local_board_list()
+                with open('./logs/file_local.json', 'w', encoding='utf-8') as file:
+                    json.dump(local_boards, file, indent=2)
+                self._manifest.import_local_boards(local_boards)
+            # Compare online_boards with the manifest to create a download_list
+            return self._check_missing_pages(online_boards)
+
+    def _check_missing_pages(self, online_boards):
+        self._download_list = self._manifest.diff(online_boards)
+        # Boards with nothing to download are already in sync
+        self._save_high_water(exclude=self._download_list.keys())
         # Save the download list into a json file
         with open('./logs/download_list.json', 'w', encoding='utf-8') as file:
             json.dump(self._download_list, file, indent=2)
@@ -99,67 +109,276 @@ class BTC_Downloader:
         # Return False if there is nothing to download, otherwise return True
         return False if len(self._download_list) == 0 else True
 
-    def _retrieve_html(self, uri, retry=1, max_retries=5):
-        # Make a request to get the first page of the board
-        response = make_request(uri)
-        ## To avoid encoding problems we first need to decode the content in latin1, then encoding and decoding it in utf-8
-        content = response.content.decode('latin1').encode('utf-8').decode('utf-8')
-        if response.status_code != 200 or content.count('cf-error') >= 1:
+    def _retrieve_html(self, uri, max_retries=5, conditional=False):
+        for retry in range(1, max_retries + 1):
+            # Wait for the throttle (global rate limit, or pause asked by the server) before making the request
+            waited = self._throttle.wait()
+            start = monotonic()
+            try:
+                response = make_request(uri, verbose=not self._quiet, validators=self._validators, conditional=conditional)
+            except Exception as e:
+                self._report(f'Request to {uri} failed: {e}', 'request_error', uri=uri, error=str(e))
+                response = None
+            self._metrics.record_request(uri, response.status_code if response is not None else None, monotonic() - start,
+                                         len(response.content) if response is not None else 0, retry, waited)
+            if response is not None and response.status_code == 304:
+                self._throttle.record(True)
+                return NOT_MODIFIED
+            ## Raw bytes of the page are returned, they are decoded (latin1) by whoever needs the text
+            if response is not None and response.status_code == 200 and b'cf-error' not in response.content:
+                self._throttle.record(True)
+                return response.content
+            self._throttle.record(False)
             if retry != max_retries:
-                return self._retrieve_html(uri, retry=retry+1)
-            else:
-                print(f'Failed to download {uri} after {retry} attempts')
-                self._failures += 1
-        return content
+                # Exponential backoff with jitter (or the delay asked by the server) before retrying
+                sleep(self._throttle.backoff(retry, response.headers.get('Retry-After') if response is not None else None))
+        self._report(f'Failed to download {uri} after {max_retries} attempts', 'request_failed', uri=uri, attempts=max_retries)
+        return None
 
-    def start_downloading(self):
-        # Setting a delay between requests, to avoid 429 (too many requests) and 503 (service unavailable) error codes
-        delay = 0.5
-        # Start download timer
-        self._dl_start = datetime.now()
+    def _build_jobs(self):
+        jobs = []
         # Iterate over the download list
         for boardname, boardinfos in self._download_list.items():
             boardpages = boardinfos['pages']
-            boardpath = f'{self._base_path}/{boardname}'
-            # Create a directory for the current board if it doesn't exist
-            if not os.path.exists(f'{boardpath}'):
-                os.mkdir(f'{boardpath}')
-                print(f'\nCreated `{boardname}` directory')
-            content = self._retrieve_html(boardinfos['links'][0])
-            # Save the result into a file stored into the board directory
-            with open(f'{boardpath}/{boardname}.html', 'w', encoding='utf-8') as file:
-                file.write(content)
+            # The first page of the board was saved by the discovery (see _get_online_board_list), it is not downloaded again
             # Iterate over all topics of the board
             for topic in boardinfos['topics']:
                 # Get global infos about the topic (nb of pages, base uri, id)
-                topic_pages = topic['pages']
                 base_uri = topic['first_page_link'][:topic['first_page_link'].index('=') + 1]
                 topic_id = topic['first_page_link'][topic['first_page_link'].index('=') + 1:]
-                # Create a directory for the topic (if it doesn't exist), based on its title (encoded with sha1)
-                topic_dir = hashlib.sha1(str.encode(topic['title'])).hexdigest()
-                topic_path = f'{boardpath}/{topic_dir}'
-                if not os.path.exists(topic_path):
-                    os.mkdir(topic_path)
-                    print(f"\nCreated `{topic_dir}` directory for `{topic['title']}`")
-                for page_nb in range(0, topic['pages']):
-                    print(f'\n{datetime.now()}')
-                    print(f"└── {boardname} ({topic['boardpage']}/{boardpages})")
-                    print(f"    └── {topic['title']} ({page_nb + 1}/{topic_pages})")
+                self._manifest.record_topic(boardname, topic)
+                # Pages of a topic are stored under its id (titles change, ids don't)
+                topic_dir = Manifest.topic_id(topic['first_page_link'])
+                # Delta sync: only the pages listed by the manifest diff are downloaded (all pages in update mode)
+                fetch_pages = topic['fetch_pages'] if 'fetch_pages' in topic else range(1, topic['pages'] + 1)
+                for page_nb in fetch_pages:
                     # Build the topic uri with its ID/base uri (the id is a decimal number, and the numbers after the comma are a multiple of 20 in ascending order)
-                    page_id = str(int(float(topic_id))) + f'.{page_nb * 20}'
-                    uri = f'{base_uri}{page_id}'
-                    # Retrieve html of the topic page
-                    content = self._retrieve_html(uri)
-                    # Write the content into a file
-                    with open(f'{topic_path}/{page_nb + 1}.html', 'w', encoding='utf-8') as file:
-                        file.write(content)
-                    print(f"Successfully downloaded `{topic['title']}` ({page_nb + 1}/{topic_pages})!")
-                    # Wait before doing another request
-                    sleep(delay)
+                    page_id = str(int(float(topic_id))) + f'.{(page_nb - 1) * 20}'
+                    jobs.append({
+                        'board': boardname,
+                        'topic_id': topic_dir,
+                        'boardpage': topic['boardpage'],
+                        'boardpages': boardpages,
+                        'title': topic['title'],
+                        'page': page_nb,
+                        'pages': topic['pages'],
+                        'uri': f'{base_uri}{page_id}',
+                        # Key of the page in the journal / retry queue
+                        'path': f'{boardname}/{topic_dir}/{page_nb}.html'
+                    })
+        return jobs
+
+    def _download_page(self, job):
+        # Retrieve html of the page (waiting for the rate limiter if needed), pages already stored are only downloaded if they changed
+        stored = self._storage.has_page(job['board'], job['topic_id'], job['page']) if job['title'] else self._storage.has_board_page(job['board'])
+        content = self._retrieve_html(job['uri'], conditional=stored)
+        if content is NOT_MODIFIED:
+            if job['title']:
+                self._manifest.record_page(job['topic_id'], job['page'])
+                self._metrics.record_page(job['board'], 'not_modified', topic_id=job['topic_id'], page=job['page'])
+                self._page_done(job)
+            self._journal.done(job)
+            return
+        # Error pages are never written to disk, the page goes to the retry queue instead
+        if content is None:
+            with self._lock:
+                self._retry_queue.append(job)
+            if job['title']:
+                self._manifest.forget_page(job['topic_id'], job['page'])
+                self._metrics.record_page(job['board'], 'failed', topic_id=job['topic_id'], page=job['page'])
+            return
+        # Store the page (an interruption never leaves a truncated page, with both backends)
+        if job['title']:
+            self._storage.write_page(job['board'], job['topic_id'], job['page'], content)
+        else:
+            self._storage.write_board_page(job['board'], content)
+        # The new validators go with the stored page: a page refreshed but never written is not seen as up to date next time
+        self._validators.commit(job['uri'])
+        self._journal.done(job)
+        # Topic pages are recorded into the manifest, and displayed with a single print so lines of concurrent threads don't get mixed up
+        if job['title']:
+            self._manifest.record_page(job['topic_id'], job['page'], content)
+            self._metrics.record_page(job['board'], 'downloaded', topic_id=job['topic_id'], page=job['page'], bytes=len(content))
+            self._page_done(job)
+            if not self._quiet:
+                print(f"\n{datetime.now()}\n"
+                      f"└── {job['board']} ({job['boardpage']}/{job['boardpages']})\n"
+                      f"    └── {job['title']} ({job['page']}/{job['pages']})\n"
+                      f"Successfully downloaded `{job['title']}` ({job['page']}/{job['pages']})!")
+
+    def _count_pages(self, jobs):
+        self._pages_left = {}
+        for job in jobs:
+            if job['title']:
+                self._pages_left[job['topic_id']] = self._pages_left.get(job['topic_id'], 0) + 1
+
+    def _page_done(self, job):
+        with self._lock:
+            self._pages_left[job['topic_id']] = self._pages_left.get(job['topic_id'], 1) - 1
+            complete = self._pages_left[job['topic_id']] == 0
+        if complete:
+            self._manifest.commit_topic(job['topic_id'])
+
+    def _run_jobs(self, jobs):
+        self._retry_queue = []
+        # Pages are downloaded concurrently, the global rate limiter replaces the fixed delay between requests
+        executor = ThreadPoolExecutor(max_workers=self._max_workers)
+        try:
+            for _ in executor.map(self._download_page, jobs):
+                pass
+        finally:
+            # Don't wait for queued pages if the download is interrupted
+            executor.shutdown(wait=False, cancel_futures=True)
+        return self._retry_queue
+
+    def _save_retry_queue(self):
+        self._failures = len(self._retry_queue)
+        with open('./logs/retry_queue.json', 'w', encoding='utf-8') as file:
+            json.dump(self._retry_queue, file, indent=2)
+
+    def _save_high_water(self, exclude=()):
+        for boardname, timestamp in list(self._high_water.items()):
+            if boardname not in exclude:
+                self._manifest.set_high_water(boardname, timestamp)
+                del self._high_water[boardname]
+
+    def _merge_pending(self, jobs):
+        paths = {job['path'] for job in jobs}
+        pending = [job for job in self._journal.pending() if job['path'] not in paths]
+        if pending:
+            print(f"{datetime.now()}\t{len(pending)} page{'s' if len(pending) > 1 else ''} left by an interrupted download added to the download")
+        return jobs + pending
+
+    def start_downloading(self, jobs=None, resume=False):
+        # Start download timer
+        self._dl_start = datetime.now()
+        if jobs is None:
+            jobs = self._build_jobs()
+        # Pages left by an interrupted download are not dropped with its journal: they are downloaded with the new jobs
+        if not resume:
+            jobs = self._merge_pending(jobs)
+        self._count_pages(jobs)
+        # Every job is journaled before the first request, a resumed download keeps appending to its journal
+        if resume:
+            self._journal.reopen()
+        else:
+            self._journal.start(jobs)
+        failed = self._run_jobs(jobs)
+        # Failed pages get a second chance at the end, once the throttle has slowed down
+        if failed:
+            print(f"\n{datetime.now()}\tRetrying {len(failed)} failed page{'s' if len(failed) > 1 else ''}...")
+            self._run_jobs(failed)
+        # Pages that still failed are saved, they can be downloaded later with the 'retry' mode
+        self._save_retry_queue()
+        # Boards are in sync once all their pages are downloaded
+        self._save_high_water(exclude={job['board'] for job in self._retry_queue})
+        # The download went to its end: nothing to resume
+        self._journal.close(remove=True)
         self.display_logs()
 
+    def resume(self):
+        self._start = datetime.now()
+        self._check_start = datetime.now()
+        self._check_end = datetime.now()
+        # Continue an interrupted download with the jobs of its journal, without checking online data again
+        jobs = self._journal.pending()
+        if not jobs:
+            print('Nothing to resume')
+            cursor.show()
+            return
+        print(f"{datetime.now()}\tResuming download: {len(jobs)} page{'s' if len(jobs) > 1 else ''} left")
+        self.start_downloading(jobs, resume=True)
+
+    def download_retry_queue(self):
+        self._start = datetime.now()
+        self._check_start = datetime.now()
+        self._check_end = datetime.now()
+        if not os.path.exists('./logs/retry_queue.json'):
+            print('Retry queue is empty')
+            cursor.show()
+            return
+        with open('./logs/retry_queue.json', 'r', encoding='utf-8') as file:
+            jobs = json.load(file)
+        self.start_downloading(jobs)
+
+    def migrate_sha1_dirs(self):
+        # Mirrors downloaded before topics were stored by id have one directory per title (sha1), merge them into `<board>/<topic id>/`
+        sha1_dir = re.compile(r'^[0-9a-f]{40}$')
+        boardnames = [name for name in os.listdir(self._base_path) if os.path.isdir(os.path.join(self._base_path, name))]
+        for boardname in boardnames:
+            board_path = os.path.join(self._base_path, boardname)
+            merged = 0
+            for topic_dir in [name for name in os.listdir(board_path) if sha1_dir.match(name)]:
+                topic_path = os.path.join(board_path, topic_dir)
+                pages = sorted([name for name in os.listdir(topic_path) if name.endswith('.html')], key=lambda x: int(x[:-len('.html')]))
+                if len(pages) == 0:
+                    os.rmdir(topic_path)
+                    continue
+                # The id of the topic is in the link to the previous page, the title is the one it had when it was downloaded
+                with open(os.path.join(topic_path, pages[0]), 'r', encoding='utf-8') as file:
+                    soup = bs(file.read(), 'html.parser')
+                prev_link = soup.find('link', attrs={'rel': 'prev'}).get('href')
+                prev_link = prev_link[:prev_link.index(';')]
+                topic_id = Manifest.topic_id(prev_link)
+                title = soup.title.text.strip().replace(u'\x85', u' ').replace('\n', '')
+                new_path = os.path.join(board_path, str(topic_id))
+                if not os.path.exists(new_path):
+                    os.mkdir(new_path)
+                # When several directories have the same page, the most recent download is kept
+                for page in pages:
+                    src, dst = os.path.join(topic_path, page), os.path.join(new_path, page)
+                    if not os.path.exists(dst) or os.path.getmtime(src) > os.path.getmtime(dst):
+                        os.replace(src, dst)
+                    else:
+                        os.remove(src)
+                # Pages that were never completely written (atomic_write leftovers) are not pages of the topic
+                for name in os.listdir(topic_path):
+                    if name.endswith('.tmp'):
+                        os.remove(os.path.join(topic_path, name))
+                os.rmdir(topic_path)
+                merged += 1
+                # Only the html pages of the merged directory are counted (not the .tmp files of interrupted writes)
+                page_list = FileStorage(self._base_path).pages(boardname, topic_id)
+                self._manifest.import_local_boards({boardname: {'topics': [{
+                    'first_page_link': prev_link[:prev_link.index('=') + 1] + f'{topic_id}.0',
+                    'title': title,
+                    'pages': len(page_list),
+                    'page_list': page_list
+                }]}})
+                print(f'{datetime.now()}\t{boardname}/{topic_dir} -> {boardname}/{topic_id} ({title})')
+            print(f"{datetime.now()}\tMerged {merged} sha1 director{'ies' if merged > 1 else 'y'} of `{boardname}`\n")
+        cursor.show()
+
+    def pack_loose_pages(self):
+        # Move the loose html files of a mirror into the packs of the archive backend (the mirror uses it from now on)
+        self._storage.close()
+        self._storage = open_storage(self._base_path, ArchiveStorage.name, convert=True)
+        loose = FileStorage(self._base_path)
+        for boardname in loose.boards():
+            packed = 0
+            # Directories named with a sha1 must be merged with the 'migrate' mode first
+            topic_ids = [topic for topic in loose.topics(boardname) if isinstance(topic, int)]
+            for topic in loose.topics(boardname):
+                if not isinstance(topic, int):
+                    print(f'{datetime.now()}\tWarning: {boardname}/{topic} is not packed (sha1 directory), run the migrate mode first')
+            for topic_id in topic_ids:
+                for page_nb in loose.pages(boardname, topic_id):
+                    # The pack holds the bytes of the responses, as they were downloaded
+                    if not self._storage.has_page(boardname, topic_id, page_nb):
+                        self._storage.write_page(boardname, topic_id, page_nb, loose.read_raw_page(boardname, topic_id, page_nb))
+                    packed += 1
+            # Files are only removed once the pack is synced to disk
+            self._storage.close()
+            for topic_id in topic_ids:
+                shutil.rmtree(os.path.join(self._base_path, boardname, str(topic_id)))
+            print(f"{datetime.now()}\tPacked {packed} page{'s' if packed > 1 else ''} of `{boardname}`")
+        self._storage.close()
+        cursor.show()
+
     # SIGINT handler
     def display_logs(self, sig=None, frame=None):
+        # Pressing Ctrl+C again while logs are displayed must not run this handler twice
+        signal(SIGINT, SIG_IGN)
         # Stop timers
         self._dl_end = datetime.now()
         self._end = datetime.now()
@@ -173,20 +392,44 @@ class BTC_Downloader:
         print(f"\tDownload duration:\t{self._dl_end - self._dl_start if self._dl_start else 'Undefined'}")
         print(f'\tTotal duration:\t\t{self._end - self._start}')
         print(f'\tFailures:\t\t{self._failures}')
+        stats = get_request_stats()
+        print(f"\tRequests:\t\t{stats['requests']} ({stats['bytes']} bytes)")
+        print(f"\tNot modified (304):\t{stats['hits']}/{stats['conditional']} conditional requests")
+        metrics = self._metrics.summary()
+        print(f"\tStatus codes:\t\t{', '.join(f'{status}: {count}' for status, count in sorted(metrics['statuses'].items()))}")
+        print(f"\tMean latency:\t\t{metrics['mean_latency']:.3f}s ({metrics['retries']} retries, {metrics['throttle_wait']:.1f}s of throttle waits)")
+        for boardname, pages_per_second in metrics['boards'].items():
+            print(f'\t{boardname}:\t{pages_per_second} pages/s')
         print('#-----------------------------------------------------#')
+        self._validators.save()
+        self._metrics.close()
+        self._storage.close()
+        # Flush the journal, an interrupted download can be continued with the 'resume' mode
+        self._journal.close()
         cursor.show()
         exit(0)
 
     def _download_base_page(self):
         print('Downloading `Mining` page...')
-        response = make_request(self._base_uri)
+        content = self._retrieve_html(self._base_uri)
+        if content is None:
+            raise Exception(f'Failed to download {self._base_uri}')
         print()
-        return response
+        return content
 
-    @staticmethod
-    def _progress_bar(topic_nb, max_topics, reset=False):
+    def _report(self, message, event, **fields):
+        # Every message is an event of logs/events.jsonl, it is only printed when the downloader isn't quiet
+        self._metrics.event(event, **fields)
+        if not self._quiet:
+            print(message)
+
+    def _progress_bar(self, topic_nb, max_topics, reset=False):
         if max_topics == 0:
             return
+        # Quiet mode: no terminal writes, the progress is an event
+        if self._quiet:
+            self._metrics.event('local_progress', done=topic_nb, total=max_topics)
+            return
         toolbar_width = 50
         square = u'\u2588'
         percentage = round(100 * topic_nb / max_topics, 2)
@@ -212,25 +455,19 @@ class BTC_Downloader:
     def _get_local_board_list(self):
         boards = {}
         max_topics = 0
-        # If there is no board, return an empty dictionary
-        if not os.path.exists(self._base_path):
-            return boards
-        # Else, get names of the boards
-        boardnames = [name for name in os.listdir(self._base_path) if os.path.isdir(os.path.join(self._base_path, name))]
+        # Get names of the boards (an empty mirror has none)
+        boardnames = self._storage.boards()
         # Get nb of topics in local files
         for boardname in boardnames:
-            max_topics += len([dir for dir in os.listdir(os.path.join(self._base_path, boardname))])
+            max_topics += len(self._storage.topics(boardname))
         # Iterate over all boards
         for name in boardnames:
-            # Append boarname to base path
-            board_path = os.path.join(self._base_path, name)
-            # Get all topic directories inside the board directory
-            topic_hashes = [hash for hash in os.listdir(board_path) if os.path.isdir(f'{board_path}/{hash}')]
+            # Get all topics of the board
+            topic_ids = self._storage.topics(name)
             # Read the first page of the board to get its content
-            with open(f'{board_path}/{name}.html', 'r', encoding='latin1') as file:
-                firstpage = file.read()
-                # Creating a bs4 soup
-                soup = bs(firstpage, 'html.parser')
+            firstpage = self._storage.read_board_page(name)
+            # Creating a bs4 soup
+            soup = bs(firstpage, 'html.parser')
             # Retrieving data about the board (base_uri, id, nb of pages, and links of all its pages)
             board_base_uri = soup.find('link', attrs={'rel': 'index'}).get('href')
             board_uri = board_base_uri[:board_base_uri.index('=') + 1]
@@ -245,92 +482,143 @@ class BTC_Downloader:
                 'topics': []
             }
             # Iterate over all topics of the current board
-            for topic, topic_nb in zip(topic_hashes, range(0, max_topics)):
-                # Getting its path
-                topicpath = os.path.join(board_path, topic)
-                # Getting paths of its pages
-                pagepaths = [os.path.join(topicpath, page) for page in os.listdir(topicpath) if not os.path.isdir(os.path.join(topicpath, page))]
-                if len(pagepaths) == 0:
-                    print(topicpath, 'is empty')
+            for topic, topic_nb in zip(topic_ids, range(0, max_topics)):
+                # Getting its pages, sorted by number
+                page_list = self._storage.pages(name, topic)
+                if len(page_list) == 0:
+                    self._report(f'{name}/{topic} is empty', 'local_topic_empty', board=name, topic_id=topic)
                     continue
-                # Read the first page
-                with open(pagepaths[0], 'r', encoding='utf-8') as file:
-                    # Creating a bs4 soup
-                    soup = bs(file.read(), 'html.parser')
-                    # nb of pages
-                    pages = len(pagepaths)
-                    # Title of the topic without special characters / newlines / trailing spaces
-                    title = soup.title.text.strip().replace(u'\x85', u' ').replace('\n', '')
-                    # Display infos of the topic + progress bar
-                    print(f"| {pagepaths[0]} | {title.center(115)} | {pages} {'pages' if pages > 1 else 'page'}")
-                    self._progress_bar(topic_nb, max_topics)
-                    # Get the link of the topic's page
-                    prev_link = soup.find('link', attrs={'rel': 'prev'}).get('href')
-                    boards[name]['topics'].append({
-                        'first_page_link': prev_link[:prev_link.index(';')],
-                        'title': title,
-                        'pages': pages
-                    })
+                # Read the first page, and create a bs4 soup
+                soup = bs(self._storage.read_page(name, topic, page_list[0]), 'html.parser')
+                # nb of pages
+                pages = len(page_list)
+                # Title of the topic without special characters / newlines / trailing spaces
+                title = soup.title.text.strip().replace(u'\x85', u' ').replace('\n', '')
+                # Display infos of the topic + progress bar
+                self._report(f"| {name}/{topic}/{page_list[0]} | {title.center(115)} | {pages} {'pages' if pages > 1 else 'page'}", 'local_topic', board=name, topic_id=topic, pages=pages)
+                self._progress_bar(topic_nb, max_topics)
+                # Get the link of the topic's page
+                prev_link = soup.find('link', attrs={'rel': 'prev'}).get('href')
+                boards[name]['topics'].append({
+                    'first_page_link': prev_link[:prev_link.index(';')],
+                    'title': title,
+                    'pages': pages,
+                    'page_list': page_list
+                })
         # Reset the progress bar
         self._progress_bar(max_topics, max_topics, reset=True)
         return boards
 
-    def _get_online_board_list(self, html):
+    def _get_online_board_list(self, html, incremental=False):
         boards = {}
-        delay = 0.00001
+        listings = {}
+        start = datetime.now()
+        requests_before = get_request_stats()['requests']
         soup = bs(html, 'html.parser')
         ## Retrieving boards' data from table
         results = [tr for tr in soup.find('table', attrs={'border': '0', 'width': '100%', 'cellspacing': '1', 'cellpadding': '5', 'class': 'bordercolor'}).findAll('tr') if len(tr) == 9]
-        ## Constructing a dict {'board_name': 'board_link'}
-        for tr in results:
-            ## Getting board's name and uri in order to retrieve its data
-            boardname = tr.findAll('a')[1].text.strip()
-            board_base_uri = tr.findAll('a')[1].get('href')
-            ## Making request
-            print(f'{datetime.now()}\tDownloading `{boardname}`...')
-            response = make_request(board_base_uri)
-            print()
-            ## Creating soup
-            soup = bs(response.content, 'html.parser')
-            ## Getting the number of pages to know how many requests we'll have to do
-            page_anchors = soup.find('td', attrs={'class': 'middletext'}).findAll('a', attrs={'class': 'navPages'})
-            pages_nb = int(page_anchors[-2].text) if len(page_anchors) > 1 else 1
-            ## Constructing pages uris based on the board_page's base_uri and id
-            board_uri = board_base_uri[:board_base_uri.index('=') + 1]
-            board_id = board_base_uri[board_base_uri.index('=') + 1:]
-            boardlinks = [f"{board_uri}{str(int(float(board_id))) + f'.{nb * 40}'}" for nb in range(pages_nb)]
-            ## To avoid encoding problems we first need to decode the content in latin1, then encoding and decoding it in utf-8
-            content = response.content.decode('latin1').encode('utf-8').decode('utf-8')
-            ## Storing results inside boards
-            boards[boardname] = {
-                'first_page': content,
-                'pages': pages_nb,
-                'links': boardlinks,
-                'topics': []
-            }
-            print(f"{pages_nb} pages to download:")
-            for boardlink, page in zip(boards[boardname]['links'], range(1, pages_nb + 1)):
-                response = make_request(boardlink)
-                soup = bs(response.content, 'html.parser')
-                table = soup.find('table', attrs={'border': '0', 'width': '100%', 'cellspacing': '1', 'cellpadding': '4', 'class': 'bordercolor'})
-                topics_nb = 0
-                for name, pages, link in self._get_topic_list_from_table(table):
-                    boards[boardname]['topics'].append({
-                        'first_page_link': link,
-                        'title': name,
-                        'pages': pages,
-                        'boardpage': page
-                    })
-                    topics_nb += 1
-                    print(u'\u2588', end='', flush=True)
-                    sleep(delay)
-                print(f"\n{datetime.now()}\tRetrieved data of {topics_nb} topic{'s' if topics_nb > 1 else ''} on page {page}/{pages_nb} of {boardname}!\n")
+        ## Listing pages are fetched by the download threads (same rate limiter / throttle as topic pages),
+        ## while rows are parsed here, in the main thread, as soon as a page arrives
+        executor = ThreadPoolExecutor(max_workers=self._max_workers)
+        futures = {}
+        try:
+            ## First page of every board, all boards at once
+            for tr in results:
+                ## Getting board's name and uri in order to retrieve its data
+                boardname = tr.findAll('a')[1].text.strip()
+                board_base_uri = tr.findAll('a')[1].get('href')
+                futures[executor.submit(self._retrieve_html, board_base_uri)] = (boardname, board_base_uri, 1)
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    boardname, uri, page = futures.pop(future)
+                    content = future.result()
+                    if content is None:
+                        self._report(f'{datetime.now()}\tFailed to retrieve page {page} of `{boardname}`, its topics will be checked next time', 'listing_failed', board=boardname, page=page)
+                        ## The board is incomplete: don't move its high-water mark
+                        self._high_water.pop(boardname, None)
+                        continue
+                    ## The first page of a board is saved into the board directory as it is fetched (the scraper reads the nb of pages in it)
+                    if page == 1:
+                        self._storage.write_board_page(boardname, content)
+                    content = decode_page(content)
+                    soup = bs(content, 'html.parser')
+                    if page == 1:
+                        self._add_board(boards, listings, boardname, uri, content, soup, incremental)
+                    reached = self._parse_listing_page(listings[boardname], boardname, page, soup)
+                    pages_nb = boards[boardname]['pages']
+                    self._report(f"{datetime.now()}\tRetrieved data of {len(listings[boardname]['pages'][page])} topics on page {page}/{pages_nb} of {boardname}",
+                                 'listing', board=boardname, page=page, pages=pages_nb, topics=len(listings[boardname]['pages'][page]))
+                    ## Full crawl: every other listing page at once
+                    if listings[boardname]['high_water'] is None:
+                        next_pages = range(2, pages_nb + 1) if page == 1 else []
+                    ## Incremental crawl: one page at a time, until the high-water mark is reached
+                    elif not reached and page < pages_nb:
+                        next_pages = [page + 1]
+                    else:
+                        if page < pages_nb:
+                            self._report(f'{datetime.now()}\tReached the high-water mark of {boardname}, skipping {pages_nb - page} listing page{"s" if pages_nb - page > 1 else ""}',
+                                         'high_water_reached', board=boardname, page=page, skipped=pages_nb - page)
+                        next_pages = []
+                    for next_page in next_pages:
+                        futures[executor.submit(self._retrieve_html, boards[boardname]['links'][next_page - 1])] = (boardname, uri, next_page)
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+        ## Topics are stored in the listing order, whatever the order pages arrived in
+        for boardname in boards:
+            for page in sorted(listings[boardname]['pages']):
+                boards[boardname]['topics'] += listings[boardname]['pages'][page]
+        print(f"\n{datetime.now()}\tDiscovery done in {datetime.now() - start}: {get_request_stats()['requests'] - requests_before} requests, {sum(len(board['topics']) for board in boards.values())} topics to check\n")
         return boards
 
+    def _add_board(self, boards, listings, boardname, board_base_uri, content, soup, incremental):
+        ## Getting the number of pages to know how many requests we'll have to do
+        page_anchors = soup.find('td', attrs={'class': 'middletext'}).findAll('a', attrs={'class': 'navPages'})
+        pages_nb = int(page_anchors[-2].text) if len(page_anchors) > 1 else 1
+        ## Constructing pages uris based on the board_page's base_uri and id
+        board_uri = board_base_uri[:board_base_uri.index('=') + 1]
+        board_id = board_base_uri[board_base_uri.index('=') + 1:]
+        boardlinks = [f"{board_uri}{str(int(float(board_id))) + f'.{nb * 40}'}" for nb in range(pages_nb)]
+        ## Storing results inside boards
+        boards[boardname] = {
+            'first_page': content,
+            'pages': pages_nb,
+            'links': boardlinks,
+            'topics': []
+        }
+        # Listings are ordered by last post: once we reach a topic older than the previous sync, the next ones didn't change either
+        high_water = self._manifest.get_high_water(boardname) if incremental else None
+        self._high_water[boardname] = high_water or 0
+        listings[boardname] = {'high_water': high_water or None, 'pages': {}}
+
+    def _parse_listing_page(self, listing, boardname, page, soup):
+        reached = False
+        high_water = listing['high_water']
+        listing['pages'][page] = []
+        table = soup.find('table', attrs={'border': '0', 'width': '100%', 'cellspacing': '1', 'cellpadding': '4', 'class': 'bordercolor'})
+        for topic in self._get_topic_list_from_table(table):
+            if topic['last_post'] and boardname in self._high_water and topic['last_post'] > self._high_water[boardname]:
+                self._high_water[boardname] = topic['last_post']
+            # Topics older than the high-water mark didn't change (sticky topics are pinned at the top, they are not ordered)
+            if high_water and topic['last_post'] and topic['last_post'] <= high_water:
+                reached = reached or not topic['sticky']
+                continue
+            listing['pages'][page].append({
+                'first_page_link': topic['first_page_link'],
+                'title': topic['title'],
+                'pages': topic['pages'],
+                'replies': topic['replies'],
+                'last_post': topic['last_post'],
+                'boardpage': page
+            })
+        # Return True once the high-water mark is reached
+        return reached
+
     def _get_topic_list_from_table(self, table):
-        ## Retrieving all topics' title from a table. Skipping the first element corresponding to the header of the table
-        results = [tr.findAll('td')[2] for tr in table.findAll('tr')[1:]]
-        for res in results:
+        ## Retrieving all topics' row from a table. Skipping the first element corresponding to the header of the table
+        for tr in table.findAll('tr')[1:]:
+            tds = tr.findAll('td')
+            res = tds[2]
             ## Getting rid of \xa0 special character (\xa0 is actually non-breaking space in Latin1 (ISO 8859-1)),
             ## and splitting line to get topic's name and nb of pages into different variables
             name, *pages = res.text.strip().replace(u'\xa0', u' ').split('\n')
@@ -341,28 +629,53 @@ class BTC_Downloader:
                 pages = [int(word) for word in ''.join(pages).split() if word.isdigit()]
             else:
                 pages = [1]
+            ## Nb of replies (column after the topic starter), None if the row doesn't have it
+            replies = tds[4].text.strip() if len(tds) > 4 else ''
+            replies = int(replies) if replies.isdigit() else None
             ## Returning elements one by one for processing
-            yield name.strip(), max(pages), link
+            yield {
+                'first_page_link': link,
+                'title': name.strip(),
+                'pages': max(pages),
+                'replies': replies,
+                'last_post': self._get_last_post(tds[-1].text) if len(tds) > 6 else None,
+                'sticky': 'windowbg3' in (res.get('class') or []) or any('sticky' in (img.get('src') or '') for img in tr.findAll('img'))
+            }
+
+    @staticmethod
+    def _get_last_post(text):
+        ## Last post column: "October 17, 2020, 05:43:12 PM by xxx" or "Today at 05:43:12 PM by xxx"
+        match = re.search(r'(Today at|[A-Z][a-z]+ \d{1,2}, \d{4},) \d{1,2}:\d{2}:\d{2} [AP]M', ' '.join(text.split()))
+        return get_timestamp(match.group(0)) if match else None
 
 
-def start_process(flag='standard'):
+def start_process(flag='standard', base_uri='https://bitcointalk.org/index.php?board=14.0', rate=2, max_workers=8, storage=None, quiet=False):
     try:
-        base_uri = 'https://bitcointalk.org/index.php?board=14.0'
-        bts = BTC_Downloader(base_uri)
+        bts = BTC_Downloader(base_uri, rate=rate, max_workers=max_workers, storage=storage, quiet=quiet)
         # Detect Ctrl+C
         signal(SIGINT, bts.display_logs)
-        if bts.are_pages_missing(flag):
+        # Only download pages that failed during the previous runs
+        if flag == 'retry':
+            bts.download_retry_queue()
+        # Continue an interrupted download where it stopped
+        elif flag == 'resume':
+            bts.resume()
+        # Move topics stored by title (sha1) to directories named after their id
+        elif flag == 'migrate':
+            bts.migrate_sha1_dirs()
+        # Move loose html files into compressed packs (archive storage backend)
+        elif flag == 'pack':
+            bts.pack_loose_pages()
+        elif bts.are_pages_missing(flag):
             bts.start_downloading()
     except Exception as e:
         print(e, file=sys.stderr)
 
 if __name__ == '__main__':
-    try:
-        base_uri = 'https://bitcointalk.org/index.php?board=14.0'
-        bts = BTC_Downloader(base_uri)
-        # Detect Ctrl+C
-        signal(SIGINT, bts.display_logs)
-        if bts.are_pages_missing('standard'):
-            bts.start_downloading()
-    except Exception as e:
-        print(e, file=sys.stderr)
\ No newline at end of file
+    # Modes: standard (default) | update | retry | resume | migrate | pack
+    # Storage backend of a new mirror: --storage=files (default) | --storage=archive
+    # --quiet: no per-page prints, follow the download with logs/events.jsonl and logs/metrics.prom
+    storage = next((arg[len('--storage='):] for arg in sys.argv[1:] if arg.startswith('--storage=')), None)
+    quiet = '--quiet' in sys.argv[1:]
+    flags = [arg.lstrip('-') for arg in sys.argv[1:] if not arg.startswith('--storage=') and arg != '--quiet']
+    start_process(flags[0] if flags else 'standard', storage=storage, quiet=quiet)
@@ -0,0 +1,75 @@
+import threading
+import json
+import os
+
+
+class Journal:
+    def __init__(self, path, sync_every=50):
+        # Write-ahead log of page jobs: every planned job is written before the download starts, then each finished job is marked as done
+        self._path = path
+        self._sync_every = sync_every
+        self._file = None
+        self._unsynced = 0
+        # Reentrant: the SIGINT handler closes the journal from the main thread, which may already hold the lock
+        self._lock = threading.RLock()
+
+    def exists(self):
+        return os.path.exists(self._path)
+
+    def start(self, jobs):
+        # A new download replaces the previous journal (its pending jobs are merged into the new ones first, see BTC_Downloader._merge_pending)
+        with self._lock:
+            self._file = open(self._path, 'w', encoding='utf-8')
+            for job in jobs:
+                self._file.write(json.dumps({'op': 'add', 'job': job}) + '\n')
+            self._sync()
+
+    def reopen(self):
+        # Resuming a download: new `done` records are appended to the existing journal
+        with self._lock:
+            self._file = open(self._path, 'a', encoding='utf-8')
+
+    def done(self, job):
+        with self._lock:
+            # Pages finishing after an interruption are not journaled, they will be downloaded again
+            if self._file is None:
+                return
+            self._file.write(json.dumps({'op': 'done', 'key': job['path']}) + '\n')
+            # Flushed at each record (survives a crash of the program), synced to disk from time to time (survives a crash of the host)
+            self._file.flush()
+            self._unsynced += 1
+            if self._unsynced >= self._sync_every:
+                self._sync()
+
+    def pending(self):
+        # Replay the journal: jobs that were planned but never marked as done, in their original order
+        jobs = {}
+        if not self.exists():
+            return []
+        with open(self._path, 'r', encoding='utf-8') as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Last line can be truncated if the program was killed while writing it
+                    continue
+                if record['op'] == 'add':
+                    jobs[record['job']['path']] = record['job']
+                elif record['op'] == 'done':
+                    jobs.pop(record['key'], None)
+        return list(jobs.values())
+
+    def close(self, remove=False):
+        with self._lock:
+            if self._file is not None:
+                self._sync()
+                self._file.close()
+                self._file = None
+            # The journal of a finished download is useless
+            if remove and self.exists():
+                os.remove(self._path)
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
@@ -0,0 +1,193 @@
+from datetime import datetime
+import threading
+import hashlib
+import sqlite3
+
+
+class Manifest:
+    def __init__(self, path):
+        # The connection is shared by all download threads, every access goes through the lock
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.executescript('''
+                PRAGMA journal_mode = WAL;
+                PRAGMA synchronous = NORMAL;
+                CREATE TABLE IF NOT EXISTS topics (
+                    topic_id INTEGER PRIMARY KEY,
+                    board TEXT NOT NULL,
+                    title TEXT NOT NULL,
+                    first_page_link TEXT NOT NULL,
+                    pages INTEGER NOT NULL,
+                    replies INTEGER,
+                    updated_at REAL,
+                    pending_pages INTEGER,
+                    pending_replies INTEGER
+                );
+                CREATE TABLE IF NOT EXISTS pages (
+                    topic_id INTEGER NOT NULL,
+                    page INTEGER NOT NULL,
+                    fetched_at REAL,
+                    sha1 TEXT,
+                    size INTEGER,
+                    PRIMARY KEY (topic_id, page)
+                );
+                CREATE INDEX IF NOT EXISTS topics_board ON topics (board);
+                CREATE TABLE IF NOT EXISTS titles (
+                    topic_id INTEGER NOT NULL,
+                    title TEXT NOT NULL,
+                    first_seen REAL,
+                    PRIMARY KEY (topic_id, title)
+                );
+                CREATE TABLE IF NOT EXISTS boards (
+                    board TEXT PRIMARY KEY,
+                    high_water REAL
+                );
+            ''')
+            # Manifests created before reply counts were tracked
+            columns = [row[1] for row in self._conn.execute('PRAGMA table_info(topics)')]
+            if 'replies' not in columns:
+                self._conn.execute('ALTER TABLE topics ADD COLUMN replies INTEGER')
+            # Manifests created before the counts of the listing were only committed once the pages are downloaded
+            if 'pending_pages' not in columns:
+                self._conn.execute('ALTER TABLE topics ADD COLUMN pending_pages INTEGER')
+                self._conn.execute('ALTER TABLE topics ADD COLUMN pending_replies INTEGER')
+
+    @staticmethod
+    def topic_id(link):
+        # 'https://bitcointalk.org/index.php?topic=5447390.0' -> 5447390
+        return int(float(link[link.index('=') + 1:]))
+
+    def is_empty(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM topics').fetchone()[0] == 0
+
+    def record_topic(self, boardname, topic):
+        # The nb of pages / replies of the listing are pending until every page to fetch is downloaded (see commit_topic):
+        # until then, the diff still sees the topic as changed, and an interrupted download asks for its pages again
+        with self._lock:
+            self._conn.execute('''
+                INSERT INTO topics (topic_id, board, title, first_page_link, pages, replies, updated_at, pending_pages, pending_replies) VALUES (?, ?, ?, ?, 0, NULL, ?, ?, ?)
+                ON CONFLICT (topic_id) DO UPDATE SET
+                    board = excluded.board, title = excluded.title, first_page_link = excluded.first_page_link,
+                    updated_at = excluded.updated_at, pending_pages = excluded.pending_pages, pending_replies = excluded.pending_replies
+            ''', (self.topic_id(topic['first_page_link']), boardname, topic['title'], topic['first_page_link'], datetime.now().timestamp(), topic['pages'], topic.get('replies')))
+            self._record_title(self.topic_id(topic['first_page_link']), topic['title'])
+            self._conn.commit()
+
+    def commit_topic(self, topic_id):
+        # All the pages to fetch of the topic are downloaded
+        with self._lock:
+            self._conn.execute('''
+                UPDATE topics SET pages = pending_pages, replies = pending_replies, pending_pages = NULL, pending_replies = NULL
+                WHERE topic_id = ? AND pending_pages IS NOT NULL
+            ''', (topic_id,))
+            self._conn.commit()
+
+    def _record_title(self, topic_id, title):
+        # Pool threads are renamed all the time (e.g. block counts in the title): every title a topic had is kept
+        self._conn.execute('INSERT OR IGNORE INTO titles (topic_id, title, first_seen) VALUES (?, ?, ?)', (topic_id, title, datetime.now().timestamp()))
+
+    def rename_topic(self, topic_id, title):
+        with self._lock:
+            self._conn.execute('UPDATE topics SET title = ? WHERE topic_id = ?', (title, topic_id))
+            self._record_title(topic_id, title)
+            self._conn.commit()
+
+    def get_titles(self, topic_id):
+        with self._lock:
+            return [row[0] for row in self._conn.execute('SELECT title FROM titles WHERE topic_id = ? ORDER BY first_seen', (topic_id,))]
+
+    def record_page(self, topic_id, page_nb, content=None):
+        # `content` (raw bytes of the page) is None when the page didn't change (304), only the fetch time is updated
+        sha1 = hashlib.sha1(content).hexdigest() if content is not None else None
+        size = len(content) if content is not None else None
+        with self._lock:
+            self._conn.execute('''
+                INSERT INTO pages (topic_id, page, fetched_at, sha1, size) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (topic_id, page) DO UPDATE SET
+                    fetched_at = excluded.fetched_at, sha1 = COALESCE(excluded.sha1, sha1), size = COALESCE(excluded.size, size)
+            ''', (topic_id, page_nb, datetime.now().timestamp(), sha1, size))
+            self._conn.commit()
+
+    def forget_page(self, topic_id, page_nb):
+        # A page that couldn't be refreshed is considered missing, so the next diff downloads it again
+        with self._lock:
+            self._conn.execute('DELETE FROM pages WHERE topic_id = ? AND page = ?', (topic_id, page_nb))
+            self._conn.commit()
+
+    def get_high_water(self, boardname):
+        # Last-post time of the most recent topic of the board, as of the last complete sync
+        with self._lock:
+            row = self._conn.execute('SELECT high_water FROM boards WHERE board = ?', (boardname,)).fetchone()
+        return row[0] if row else None
+
+    def set_high_water(self, boardname, timestamp):
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO boards (board, high_water) VALUES (?, ?)', (boardname, timestamp))
+            self._conn.commit()
+
+    def import_local_boards(self, local_boards):
+        # One-time migration of a mirror downloaded before the manifest existed (pages are known, but not their hash / fetch time)
+        with self._lock:
+            for boardname, boardinfos in local_boards.items():
+                for topic in boardinfos['topics']:
+                    topic_id = self.topic_id(topic['first_page_link'])
+                    self._conn.execute('INSERT OR REPLACE INTO topics VALUES (?, ?, ?, ?, ?, NULL, NULL, NULL, NULL)',
+                                       (topic_id, boardname, topic['title'], topic['first_page_link'], topic['pages']))
+                    self._record_title(topic_id, topic['title'])
+                    self._conn.executemany('INSERT OR IGNORE INTO pages (topic_id, page) VALUES (?, ?)',
+                                           [(topic_id, page_nb) for page_nb in topic.get('page_list', range(1, topic['pages'] + 1))])
+            self._conn.commit()
+
+    def diff(self, online_boards):
+        # Load the whole manifest once: every online topic is then compared with a dict lookup instead of a list scan
+        with self._lock:
+            topics = {row[0]: row[1:] for row in self._conn.execute('SELECT topic_id, title, pages, replies FROM topics')}
+            downloaded = {}
+            for topic_id, page_nb in self._conn.execute('SELECT topic_id, page FROM pages'):
+                downloaded.setdefault(topic_id, set()).add(page_nb)
+        download_list = {}
+        for boardname, boardinfos in online_boards.items():
+            for topic in boardinfos['topics']:
+                topic_id = self.topic_id(topic['first_page_link'])
+                # Topics are stored by id, a renamed topic only needs its new title to be recorded
+                if topic_id in topics and topics[topic_id][0] != topic['title']:
+                    self.rename_topic(topic_id, topic['title'])
+                fetch_pages = self._pages_to_fetch(topic, topics.get(topic_id), downloaded.get(topic_id, set()))
+                if not fetch_pages:
+                    continue
+                # Create a board object the first time
+                if boardname not in download_list:
+                    download_list[boardname] = {
+                        'first_page': boardinfos['first_page'],
+                        'pages': boardinfos['pages'],
+                        'links': boardinfos['links'],
+                        'topics': []
+                    }
+                download_list[boardname]['topics'].append({**topic, 'fetch_pages': fetch_pages})
+        return download_list
+
+    @staticmethod
+    def _pages_to_fetch(topic, local, downloaded):
+        all_pages = list(range(1, topic['pages'] + 1))
+        # Unknown topic: every page is needed
+        if not local:
+            return all_pages
+        _, pages, replies = local
+        missing = [page_nb for page_nb in all_pages if page_nb not in downloaded]
+        # Nothing new since the last download (when the listing didn't give the reply count, or the manifest doesn't have it
+        # because the topic was imported from a mirror, the nb of pages is used instead)
+        unchanged = replies == topic['replies'] if topic.get('replies') is not None and replies is not None else pages == topic['pages']
+        if unchanged:
+            return missing
+        # New replies: they can only be on the last page of the last complete download, or after it
+        # (pages after it that were downloaded by an interrupted run may be incomplete too)
+        last_known = pages or (max(downloaded) if downloaded else None)
+        if last_known:
+            missing += [page_nb for page_nb in all_pages if page_nb >= last_known and page_nb not in missing]
+        return sorted(missing)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,125 @@
+from utils import atomic_write
+from datetime import datetime
+import threading
+import json
+import time
+
+
+class Metrics:
+    # Upper bounds (in seconds) of the request latency histogram
+    LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, events_path='./logs/events.jsonl', prom_path='./logs/metrics.prom', interval=10):
+        # Every request / page is an event of the JSON-lines log, counters are exported in the Prometheus text format every `interval` seconds
+        self._prom_path = prom_path
+        self._interval = interval
+        self._events = open(events_path, 'a', encoding='utf-8')
+        self._lock = threading.RLock()
+        self._start = time.monotonic()
+        self._last_export = self._start
+        self._latency = [0] * (len(self.LATENCY_BUCKETS) + 1)
+        self._latency_sum = 0
+        self._requests = {}
+        self._bytes = 0
+        self._retries = 0
+        self._throttle_wait = 0
+        # Per board: {'downloaded': n, 'not_modified': n, 'failed': n, 'first': t, 'last': t}
+        self._boards = {}
+
+    def event(self, name, **fields):
+        with self._lock:
+            if self._events is None:
+                return
+            self._events.write(json.dumps({'ts': datetime.now().timestamp(), 'event': name, **fields}) + '\n')
+            self._events.flush()
+
+    def record_request(self, uri, status, latency, size, retry, waited):
+        # `status` is None when the request didn't get any answer (timeout, connection error)
+        with self._lock:
+            self._latency[next((i for i, bound in enumerate(self.LATENCY_BUCKETS) if latency <= bound), len(self.LATENCY_BUCKETS))] += 1
+            self._latency_sum += latency
+            self._requests[str(status)] = self._requests.get(str(status), 0) + 1
+            self._bytes += size
+            self._retries += 1 if retry > 1 else 0
+            self._throttle_wait += waited
+            self.event('request', uri=uri, status=status, latency=round(latency, 4), bytes=size, retry=retry, throttle_wait=round(waited, 4))
+            self._export_if_due()
+
+    def record_page(self, board, outcome, **fields):
+        # outcome: downloaded | not_modified | failed
+        with self._lock:
+            now = time.monotonic()
+            stats = self._boards.setdefault(board, {'downloaded': 0, 'not_modified': 0, 'failed': 0, 'first': now, 'last': now})
+            stats[outcome] += 1
+            stats['last'] = now
+            self.event('page', board=board, outcome=outcome, **fields)
+            self._export_if_due()
+
+    def pages_per_second(self, board):
+        stats = self._boards[board]
+        elapsed = stats['last'] - stats['first']
+        done = stats['downloaded'] + stats['not_modified']
+        return done / elapsed if elapsed > 0 else float(done)
+
+    def summary(self):
+        with self._lock:
+            requests = sum(self._requests.values())
+            return {
+                'requests': requests,
+                'statuses': dict(self._requests),
+                'bytes': self._bytes,
+                'retries': self._retries,
+                'throttle_wait': self._throttle_wait,
+                'mean_latency': self._latency_sum / requests if requests else 0,
+                'boards': {board: round(self.pages_per_second(board), 2) for board in self._boards}
+            }
+
+    def _export_if_due(self):
+        if time.monotonic() - self._last_export >= self._interval:
+            self.export()
+
+    def export(self):
+        # Rewritten as a whole (atomically), so a scraper of the file never reads half of it
+        with self._lock:
+            self._last_export = time.monotonic()
+            lines = [
+                '# HELP btc_request_duration_seconds Latency of the requests',
+                '# TYPE btc_request_duration_seconds histogram'
+            ]
+            cumulative = 0
+            for bound, count in zip(self.LATENCY_BUCKETS + ('+Inf',), self._latency):
+                cumulative += count
+                lines.append(f'btc_request_duration_seconds_bucket{{le="{bound}"}} {cumulative}')
+            lines += [
+                f'btc_request_duration_seconds_sum {self._latency_sum}',
+                f'btc_request_duration_seconds_count {cumulative}',
+                '# HELP btc_requests_total Requests by HTTP status (None: no answer)',
+                '# TYPE btc_requests_total counter'
+            ]
+            lines += [f'btc_requests_total{{status="{status}"}} {count}' for status, count in sorted(self._requests.items())]
+            lines += [
+                '# TYPE btc_response_bytes_total counter',
+                f'btc_response_bytes_total {self._bytes}',
+                '# TYPE btc_retries_total counter',
+                f'btc_retries_total {self._retries}',
+                '# TYPE btc_throttle_wait_seconds_total counter',
+                f'btc_throttle_wait_seconds_total {self._throttle_wait}',
+                '# HELP btc_pages_total Topic pages by board and outcome',
+                '# TYPE btc_pages_total counter'
+            ]
+            for board, stats in sorted(self._boards.items()):
+                for outcome in ('downloaded', 'not_modified', 'failed'):
+                    lines.append(f'btc_pages_total{{board={json.dumps(board, ensure_ascii=False)},outcome="{outcome}"}} {stats[outcome]}')
+            lines.append('# TYPE btc_pages_per_second gauge')
+            lines += [f'btc_pages_per_second{{board={json.dumps(board, ensure_ascii=False)}}} {self.pages_per_second(board)}' for board in sorted(self._boards)]
+            lines.append('# TYPE btc_uptime_seconds gauge')
+            lines.append(f'btc_uptime_seconds {time.monotonic() - self._start}')
+            atomic_write(self._prom_path, '\n'.join(lines) + '\n')
+
+    def close(self):
+        with self._lock:
+            if self._events is None:
+                return
+            self.export()
+            self._events.close()
+            self._events = None
@@ -0,0 +1,82 @@
+import gzip
+import json
+
+
+## Streaming output of the scraper: one JSON record per post, written page by page (gzip-compressed if the path ends with .gz) ##
+## {'board', 'topic_id', 'topic', 'link', 'started_by', 'started_at', 'total_pages', 'page', 'post', 'author', 'last_edit', 'html_content', 'raw_content'}
+
+def _open(path, mode):
+    if path.endswith('.gz'):
+        return gzip.open(path, f'{mode}t', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+class JsonLinesWriter:
+    def __init__(self, path):
+        self.path = path
+        self._file = _open(path, 'w')
+        self.posts = 0
+
+    def write_page(self, board, topic_id, title, topic, page_nb, link, posts):
+        for post_nb, post in enumerate(posts):
+            self._file.write(json.dumps({
+                'board': board,
+                'topic_id': topic_id,
+                'topic': title,
+                'link': link,
+                'started_by': topic['started_by'],
+                'started_at': topic['started_at'],
+                'total_pages': topic['total_pages'],
+                'page': page_nb,
+                'post': post_nb,
+                **post.to_json()
+            }) + '\n')
+        self.posts += len(posts)
+        # Every page is flushed (a sync flush for gzip), so readers can follow the file while the scrape is running
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def iter_posts(path):
+    ## Read the records one by one, memory stays flat whatever the size of the file ##
+    with _open(path, 'r') as file:
+        try:
+            for line in file:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # Last line of a file that is still being written (or of an interrupted scrape)
+                    return
+        except EOFError:
+            # Compressed file that is still being written
+            return
+
+
+def load_tree(path):
+    ## Rebuild the structure of the json output (board -> topic title -> {infos, link, 'page nb': {'posts': [...]}}) ##
+    data = {}
+    for record in iter_posts(path):
+        board = data.setdefault(record['board'], {})
+        if record['topic'] not in board or board[record['topic']]['_topic_id'] != record['topic_id']:
+            board[record['topic']] = {
+                '_topic_id': record['topic_id'],
+                'started_by': record['started_by'],
+                'started_at': record['started_at'],
+                'total_pages': record['total_pages'],
+                'link': record['link'],
+                **{str(page_nb): {'posts': []} for page_nb in range(1, record['total_pages'] + 1)}
+            }
+        topic = board[record['topic']]
+        topic['link'] = record['link']
+        # Lazy records (scraper --lazy) have a content_ref instead of the contents
+        topic.setdefault(str(record['page']), {'posts': []})['posts'].append({
+            key: record[key] for key in ('author', 'html_content', 'raw_content', 'content_ref', 'last_edit') if key in record
+        })
+    for board in data.values():
+        for topic in board.values():
+            del topic['_topic_id']
+    return {'available_boards': len(data), **data}
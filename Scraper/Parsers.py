@@ -0,0 +1,324 @@
+from bs4 import BeautifulSoup as bs
+from storage import open_storage
+from itertools import islice
+import sys
+import re
+
+# lxml is optional: without it, pages are parsed with bs4
+try:
+    import lxml.html
+    from lxml.etree import _Comment, _ProcessingInstruction
+except ImportError:
+    lxml = None
+
+
+## A parser backend turns the html of a topic page into:
+## {
+##    'title': str, 'link': str,
+##    'infos': {'started_by': {'name', 'profile'}, 'date': str} (only if asked, it's only needed for the first page of a topic),
+##    'posts': [{'poster_info': str, 'profile': str | None, 'date': str, 'html_content': str, 'raw_content': str}, ...]
+## }
+## Every page is parsed once, the scraper builds its records from this dict.
+## parse_content(html) gives the ('html_content', 'raw_content') of a post body alone (<div class="post">...</div>, see locate_posts).
+
+class BS4Parser:
+    # Reference backend: a bs4 (html.parser) tree of the whole page
+    name = 'bs4'
+
+    def parse_page(self, html, infos=False):
+        soup = bs(html, 'html.parser')
+        form = soup.find('form', attrs={'id': 'quickModForm'})
+        rows = form.find('table').find_all('tr')
+        return {
+            'title': soup.title.text,
+            'link': soup.find('link', attrs={'rel': 'prev'}).get('href').replace(';prev_next=prev', ''),
+            'infos': self._get_infos(form, rows) if infos else None,
+            'posts': [self._get_post(row) for row in rows if self._is_post(row)]
+        }
+
+    @staticmethod
+    def _get_infos(form, rows):
+        posts = [row.find('td') for row in rows if len(row.find('td')) == 5]
+        try:
+            date = form.find('span', attrs={'class': 'edited'}).text
+        except Exception:
+            date = form.find_all('td', attrs={'valign': 'middle'})[1].find_all('div')[1].text
+        try:
+            started_by = {'name': posts[0].find('a').text, 'profile': posts[0].find('a').get('href')}
+        except Exception:
+            started_by = {'name': posts[0].find('b').text, 'profile': 'noprofile'}
+        return {'started_by': started_by, 'date': date}
+
+    @staticmethod
+    def _is_post(row):
+        # Might be an add or something we don't care about
+        return row.find('div', attrs={'class': 'post'}) is not None and len(row) == 5 and len(row.parent.attrs) == 4
+
+    @staticmethod
+    def _get_post(row):
+        try:
+            date = row.find('table').find('span', attrs={'class': 'edited'}).text
+        except Exception:
+            date = row.find('table').find_all('td', attrs={'valign': 'middle'})[1].find_all('div')[1].text
+        profile = row.find('img', attrs={'title': 'View Profile'})
+        content = row.find('div', attrs={'class': 'post'})
+        return {
+            'poster_info': row.find('td', attrs={'class': 'poster_info'}).text,
+            'profile': profile.parent.get('href') if profile else None,
+            'date': date,
+            'html_content': str(content),
+            'raw_content': content.get_text(separator='\n')
+        }
+
+    @staticmethod
+    def parse_content(html):
+        content = bs(html, 'html.parser').find('div', attrs={'class': 'post'})
+        return str(content), content.get_text(separator='\n')
+
+
+class LxmlParser:
+    # Fast backend: only the <head> (title, link) and the quickModForm (posts) are parsed, with lxml
+    # Text and html of the posts are rebuilt the way bs4 outputs them, so both backends give the same records
+    name = 'lxml'
+    FORM = re.compile(r'<form[^>]*\bid="quickModForm"', re.IGNORECASE)
+    VOID_TAGS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'keygen', 'link', 'menuitem', 'meta', 'param', 'source',
+                 'track', 'wbr', 'basefont', 'bgsound', 'command', 'frame', 'image', 'isindex', 'nextid', 'spacer'}
+    RAW_TEXT_TAGS = {'script', 'style'}
+    # bs4 replaces whitespace-only strings with a single '\n' (or ' '), except in these tags
+    PRESERVE_WHITESPACE_TAGS = {'pre', 'textarea'}
+    ASCII_SPACES = '\x20\x0a\x09\x0c\x0d'
+    # Attributes bs4 splits into lists (and joins with single spaces when the html is output)
+    LIST_ATTRIBUTES = {'class', 'accesskey', 'dropzone'}
+    TAG_LIST_ATTRIBUTES = {'a': {'rel', 'rev'}, 'link': {'rel', 'rev'}, 'td': {'headers'}, 'th': {'headers'}, 'form': {'accept-charset'},
+                           'object': {'archive'}, 'area': {'rel'}, 'icon': {'sizes'}, 'iframe': {'sandbox'}, 'output': {'for'}}
+
+    def __init__(self):
+        if lxml is None:
+            raise Exception("The 'lxml' parser backend needs the lxml package (pip install lxml)")
+
+    def parse_page(self, html, infos=False):
+        head_end = html.find('</head>')
+        head = lxml.html.document_fromstring(html[:head_end] + '</head><body></body></html>' if head_end != -1 else html)
+        match = self.FORM.search(html)
+        if match:
+            end = html.find('</form>', match.start())
+            form = lxml.html.fragment_fromstring(html[match.start():end + len('</form>') if end != -1 else len(html)])
+        else:
+            form = lxml.html.document_fromstring(html).get_element_by_id('quickModForm')
+        rows = list(self._find(form, 'table').iter('tr'))
+        return {
+            'title': self._text(head.find('.//title')),
+            'link': self._find(head, 'link', rel='prev').get('href').replace(';prev_next=prev', ''),
+            'infos': self._get_infos(form, rows) if infos else None,
+            'posts': [self._get_post(row) for row in rows if self._is_post(row)]
+        }
+
+    def _get_infos(self, form, rows):
+        posts = [self._find(row, 'td') for row in rows if self._nb_children(self._find(row, 'td')) == 5]
+        try:
+            date = self._text(self._find(form, 'span', **{'class': 'edited'}))
+        except Exception:
+            date = self._text(self._find_all(self._find_all(form, 'td', valign='middle')[1], 'div')[1])
+        try:
+            started_by = {'name': self._text(self._find(posts[0], 'a')), 'profile': self._find(posts[0], 'a').get('href')}
+        except Exception:
+            started_by = {'name': self._text(self._find(posts[0], 'b')), 'profile': 'noprofile'}
+        return {'started_by': started_by, 'date': date}
+
+    def _is_post(self, row):
+        return self._find(row, 'div', **{'class': 'post'}) is not None and self._nb_children(row) == 5 and len(row.getparent().attrib) == 4
+
+    def _get_post(self, row):
+        table = self._find(row, 'table')
+        try:
+            date = self._text(self._find(table, 'span', **{'class': 'edited'}))
+        except Exception:
+            date = self._text(self._find_all(self._find_all(table, 'td', valign='middle')[1], 'div')[1])
+        profile = self._find(row, 'img', title='View Profile')
+        content = self._find(row, 'div', **{'class': 'post'})
+        return {
+            'poster_info': self._text(self._find(row, 'td', **{'class': 'poster_info'})),
+            'profile': profile.getparent().get('href') if profile is not None else None,
+            'date': date,
+            'html_content': self._html(content),
+            'raw_content': '\n'.join(self._strings(content))
+        }
+
+    def parse_content(self, html):
+        content = lxml.html.fragment_fromstring(html)
+        return self._html(content), '\n'.join(self._strings(content))
+
+    ## bs4-like helpers: find / find_all (descendants only, class matched as a word), text, number of children ##
+    @staticmethod
+    def _xpath(tag, **attrs):
+        conditions = ''
+        for attr, value in attrs.items():
+            # Multi-valued attributes match one of their words, like in bs4
+            if attr in ('class', 'rel'):
+                conditions += f'[contains(concat(" ", normalize-space(@{attr}), " "), " {value} ")]'
+            else:
+                conditions += f'[@{attr}="{value}"]'
+        return f'.//{tag}{conditions}'
+
+    def _find(self, element, tag, **attrs):
+        if element is None:
+            raise AttributeError(f'No <{tag}> in a missing element')
+        found = element.xpath(self._xpath(tag, **attrs))
+        return found[0] if found else None
+
+    def _find_all(self, element, tag, **attrs):
+        return element.xpath(self._xpath(tag, **attrs))
+
+    @staticmethod
+    def _is_tag(node):
+        return not isinstance(node, (_Comment, _ProcessingInstruction))
+
+    def _preserve(self, element, preserve=None):
+        # Is the whitespace of the element's strings kept as it is
+        if preserve is None:
+            preserve = any(ancestor.tag in self.PRESERVE_WHITESPACE_TAGS for ancestor in element.iterancestors())
+        return preserve or element.tag in self.PRESERVE_WHITESPACE_TAGS
+
+    def _string(self, text, preserve):
+        if preserve or text.strip(self.ASCII_SPACES):
+            return text
+        return '\n' if '\n' in text else ' '
+
+    def _strings(self, element, preserve=None):
+        # Text nodes in document order, like bs4's _all_strings (no comments, no script / style content)
+        preserve = self._preserve(element, preserve)
+        if element.text and self._is_tag(element) and element.tag not in self.RAW_TEXT_TAGS:
+            yield self._string(element.text, preserve)
+        for child in element:
+            if self._is_tag(child):
+                yield from self._strings(child, preserve)
+            if child.tail:
+                yield self._string(child.tail, preserve)
+
+    def _text(self, element):
+        if element is None:
+            raise AttributeError('Missing element')
+        return ''.join(self._strings(element))
+
+    def _nb_children(self, element):
+        # len() of a bs4 tag: its children, text nodes included
+        if element is None:
+            raise TypeError('Missing element')
+        return (1 if element.text else 0) + sum(1 + (1 if child.tail else 0) for child in element)
+
+    @staticmethod
+    def _escape(text):
+        return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+    def _attribute(self, tag, name, value):
+        if name in self.LIST_ATTRIBUTES or name in self.TAG_LIST_ATTRIBUTES.get(tag, ()):
+            value = ' '.join(value.split())
+        value = self._escape(value)
+        quote = '"'
+        if '"' in value:
+            if "'" in value:
+                value = value.replace('"', '&quot;')
+            else:
+                quote = "'"
+        return f'{name}={quote}{value}{quote}'
+
+    def _html(self, element, preserve=None):
+        # Same output as str() of a bs4 tag ('minimal' formatter)
+        if isinstance(element, _Comment):
+            return f'<!--{element.text}-->'
+        if isinstance(element, _ProcessingInstruction):
+            return f'<?{element.target} {element.text}>'
+        tag = element.tag
+        # bs4 outputs attributes sorted by name
+        attrs = ''.join(f' {self._attribute(tag, name, value)}' for name, value in sorted(element.attrib.items()))
+        if tag in self.VOID_TAGS and not element.text and len(element) == 0:
+            return f'<{tag}{attrs}/>'
+        preserve = self._preserve(element, preserve)
+        escape = (lambda text: text) if tag in self.RAW_TEXT_TAGS else self._escape
+        parts = [f'<{tag}{attrs}>']
+        if element.text:
+            parts.append(escape(self._string(element.text, preserve)))
+        for child in element:
+            parts.append(self._html(child, preserve))
+            if child.tail:
+                parts.append(escape(self._string(child.tail, preserve)))
+        parts.append(f'</{tag}>')
+        return ''.join(parts)
+
+
+## Post bodies in the bytes of a stored page: the n-th range is the content of the n-th parsed post ##
+POST_FORM = re.compile(rb'<form[^>]*\bid="quickModForm"', re.IGNORECASE)
+POST_DIV = re.compile(rb'<div class="post">')
+DIV_TAG = re.compile(rb'<(/?)div\b', re.IGNORECASE)
+
+
+def locate_posts(data):
+    # [(start, end), ...] byte offsets of each <div class="post"> and its matching </div> (nested divs of quotes are counted)
+    form = POST_FORM.search(data)
+    position = form.start() if form else 0
+    ranges = []
+    while True:
+        match = POST_DIV.search(data, position)
+        if not match:
+            return ranges
+        depth = 0
+        for tag in DIV_TAG.finditer(data, match.start()):
+            depth += -1 if tag.group(1) else 1
+            if depth == 0:
+                break
+        else:
+            # Unbalanced div: the rest of the page can't be located
+            return ranges
+        end = data.find(b'>', tag.end())
+        if end == -1:
+            return ranges
+        position = end + 1
+        ranges.append((match.start(), position))
+
+
+PARSERS = {
+    BS4Parser.name: BS4Parser,
+    LxmlParser.name: LxmlParser
+}
+
+
+def get_parser(name=None):
+    # Default: the fast backend when lxml is installed
+    name = name or (LxmlParser.name if lxml is not None else BS4Parser.name)
+    if name not in PARSERS:
+        raise Exception(f"Unknown parser backend '{name}' (available: {', '.join(PARSERS)})")
+    return PARSERS[name]()
+
+
+def check_parity(path='BitcoinTalk-Forum', reference='bs4', candidate='lxml', limit=None):
+    ## Parse every stored page with both backends and compare the results field by field, return the nb of differences ##
+    reference, candidate = get_parser(reference), get_parser(candidate)
+    storage = open_storage(path)
+    pages, differences = 0, 0
+    # Pages in the order of the mirror, up to `limit` of them
+    stored = ((board, topic_id, page_nb) for board in storage.boards() for topic_id in storage.topics(board) for page_nb in storage.pages(board, topic_id))
+    for board, topic_id, page_nb in islice(stored, limit or None):
+        html = storage.read_page(board, topic_id, page_nb)
+        expected, result = reference.parse_page(html, infos=page_nb == 1), candidate.parse_page(html, infos=page_nb == 1)
+        pages += 1
+        for field in ('title', 'link', 'infos'):
+            if expected[field] != result[field]:
+                differences += 1
+                print(f'{board}/{topic_id}/{page_nb}: `{field}` differs\n\t{reference.name}: {expected[field]!r}\n\t{candidate.name}: {result[field]!r}')
+        if len(expected['posts']) != len(result['posts']):
+            differences += 1
+            print(f"{board}/{topic_id}/{page_nb}: {len(expected['posts'])} posts with {reference.name}, {len(result['posts'])} with {candidate.name}")
+            continue
+        for nb, (expected_post, post) in enumerate(zip(expected['posts'], result['posts'])):
+            for field in expected_post:
+                if expected_post[field] != post[field]:
+                    differences += 1
+                    print(f'{board}/{topic_id}/{page_nb}: post {nb} `{field}` differs\n\t{reference.name}: {expected_post[field]!r}\n\t{candidate.name}: {post[field]!r}')
+    storage.close()
+    print(f"{pages} page{'s' if pages > 1 else ''} compared, {differences} difference{'s' if differences > 1 else ''}")
+    return differences
+
+
+if __name__ == '__main__':
+    # python -m Scraper.Parsers [mirror path] [max nb of pages]
+    exit(1 if check_parity(sys.argv[1] if len(sys.argv) > 1 else 'BitcoinTalk-Forum', limit=int(sys.argv[2]) if len(sys.argv) > 2 else None) else 0)
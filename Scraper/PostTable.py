@@ -0,0 +1,188 @@
+from Scraper.Records import author_id
+from array import array
+import numpy as np
+import json
+import sys
+import os
+
+
+## Columnar output of the scraper: one row per post, every column is a numpy array of a .npz file ##
+## Post columns: board, topic, page, post (position in its page), author, last_edit
+## Text columns (utf-8): <name> (bytes of all posts) + <name>_offsets (start of each post, and end of the last one): raw_content, html_content
+## Small tables (boards, topics, author ids) are a json document in the 'meta' column, rows point to them by index
+
+TEXT_COLUMNS = ('raw_content', 'html_content')
+
+
+class PostTableWriter:
+    def __init__(self, path):
+        # Same interface as JsonLinesWriter, the file is written (atomically) when the writer is closed
+        self.path = path
+        self.posts = 0
+        self._boards = {}
+        self._topics = {}
+        self._authors = {}
+        self._columns = {
+            'board': array('i'),
+            'topic': array('i'),
+            'page': array('i'),
+            'post': array('i'),
+            'author': array('i'),
+            'last_edit': array('d')
+        }
+        self._texts = {name: bytearray() for name in TEXT_COLUMNS}
+        self._offsets = {name: array('q', [0]) for name in TEXT_COLUMNS}
+
+    @staticmethod
+    def _index(table, key, record):
+        if key not in table:
+            table[key] = (len(table), record)
+        return table[key][0]
+
+    def write_page(self, board, topic_id, title, topic, page_nb, link, posts):
+        board_index = self._index(self._boards, board, board)
+        topic_index = self._index(self._topics, (board, str(topic_id)), {
+            'board': board_index,
+            'topic_id': topic_id,
+            'title': title,
+            'started_by': topic['started_by'],
+            'started_at': topic['started_at'],
+            'total_pages': topic['total_pages'],
+            'link': link
+        })
+        # Link of the topic is the link of its last page (as in the json output)
+        self._topics[(board, str(topic_id))][1]['link'] = link
+        for post_nb, post in enumerate(posts):
+            self._columns['board'].append(board_index)
+            self._columns['topic'].append(topic_index)
+            self._columns['page'].append(page_nb)
+            self._columns['post'].append(post_nb)
+            self._columns['author'].append(self._index(self._authors, author_id(post['author']), author_id(post['author'])))
+            self._columns['last_edit'].append(post['last_edit'])
+            for name in TEXT_COLUMNS:
+                self._texts[name] += post[name].encode('utf-8')
+                self._offsets[name].append(len(self._texts[name]))
+        self.posts += len(posts)
+
+    def close(self):
+        if self._columns is None:
+            return
+        meta = {
+            'boards': [record for _, record in self._boards.values()],
+            'topics': [record for _, record in self._topics.values()],
+            'authors': [record for _, record in self._authors.values()]
+        }
+        columns = {name: np.frombuffer(values, dtype=values.typecode) for name, values in self._columns.items()}
+        for name in TEXT_COLUMNS:
+            columns[name] = np.frombuffer(self._texts[name], dtype=np.uint8)
+            columns[f'{name}_offsets'] = np.frombuffer(self._offsets[name], dtype=np.int64)
+        columns['meta'] = np.frombuffer(json.dumps(meta).encode('utf-8'), dtype=np.uint8)
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'wb') as file:
+            np.savez(file, **columns)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, self.path)
+        self._columns = None
+
+
+class PostTable:
+    def __init__(self, path):
+        # Columns are read from the file the first time they are used
+        self.path = path
+        self._npz = np.load(path)
+        self._columns = {}
+        meta = json.loads(self._npz['meta'].tobytes())
+        self.boards = meta['boards']
+        self.topics = meta['topics']
+        self.authors = meta['authors']
+
+    def __getitem__(self, name):
+        if name not in self._columns:
+            self._columns[name] = self._npz[name]
+        return self._columns[name]
+
+    def __len__(self):
+        return len(self['last_edit'])
+
+    def text(self, name, row):
+        offsets = self[f'{name}_offsets']
+        return self[name][offsets[row]:offsets[row + 1]].tobytes().decode('utf-8')
+
+    def texts(self, name, rows):
+        return [self.text(name, row) for row in rows]
+
+    def post(self, row):
+        # Same record as a post of the json output
+        return {
+            'author': self.authors[self['author'][row]],
+            'html_content': self.text('html_content', row),
+            'raw_content': self.text('raw_content', row),
+            'last_edit': float(self['last_edit'][row])
+        }
+
+    def select(self, board=None, start=None, end=None):
+        ## Rows of the posts of a board (all boards: None) edited between two timestamps (included) ##
+        mask = np.ones(len(self), dtype=bool)
+        if board is not None:
+            mask &= self['board'] == (self.boards.index(board) if board in self.boards else -1)
+        if start is not None:
+            mask &= self['last_edit'] >= start
+        if end is not None:
+            mask &= self['last_edit'] <= end
+        return np.flatnonzero(mask)
+
+    def board_topics(self, board):
+        board_index = self.boards.index(board)
+        return [index for index, topic in enumerate(self.topics) if topic['board'] == board_index]
+
+    def find_topic(self, board, title):
+        # A title used twice in a board is the last topic (as in the json output)
+        matches = [index for index in self.board_topics(board) if self.topics[index]['title'] == title] if board in self.boards else []
+        if not matches:
+            raise Exception(f'No topic `{title}` in board `{board}`')
+        return matches[-1]
+
+    def topic_rows(self, topic):
+        # Rows are written topic after topic, in the order of their pages and posts
+        topics = self['topic']
+        return np.arange(np.searchsorted(topics, topic, side='left'), np.searchsorted(topics, topic, side='right'))
+
+    def to_tree(self):
+        ## Rebuild the structure of the json output (board -> topic title -> {infos, link, 'page nb': {'posts': [...]}}) ##
+        data = {board: {} for board in self.boards}
+        for index, topic in enumerate(self.topics):
+            record = {
+                'started_by': topic['started_by'],
+                'started_at': topic['started_at'],
+                'total_pages': topic['total_pages'],
+                'link': topic['link'],
+                **{str(page_nb): {'posts': []} for page_nb in range(1, topic['total_pages'] + 1)}
+            }
+            pages = self['page']
+            for row in self.topic_rows(index):
+                record.setdefault(str(pages[row]), {'posts': []})['posts'].append(self.post(row))
+            data[self.boards[topic['board']]][topic['title']] = record
+        return {'available_boards': len(data), **data}
+
+
+def write_table(data, path):
+    ## Convert a dataset with the structure of the json output ##
+    writer = PostTableWriter(path)
+    for board, topics in data.items():
+        if type(topics) != dict:
+            continue
+        for title, topic in topics.items():
+            for page_nb in range(1, topic['total_pages'] + 1):
+                writer.write_page(board, topic.get('topic_id', title), title, topic, page_nb, topic['link'], topic.get(str(page_nb), {'posts': []})['posts'])
+    writer.close()
+    return writer.posts
+
+
+if __name__ == '__main__':
+    # python -m Scraper.PostTable raw_BitcoinTalk-data.json raw_BitcoinTalk-data.npz
+    if len(sys.argv) != 3:
+        raise Exception('Usage: python -m Scraper.PostTable <json file> <npz file>')
+    with open(sys.argv[1], 'r', encoding='utf-8') as file:
+        posts = write_table(json.load(file), sys.argv[2])
+    print(f'{posts} posts saved in `{sys.argv[2]}`')
@@ -0,0 +1,123 @@
+from utils import atomic_write
+from storage import open_storage
+from Scraper.Parsers import get_parser
+from functools import lru_cache
+import json
+import re
+import os
+
+
+## Compact records of the scraper: posts are objects with fixed attributes, their author is an id in a table of authors ##
+
+class Post:
+    # Lazy posts (scraper --lazy) have no content, only a reference to it: [board, topic id, page nb, start, end] (byte offsets in the stored page)
+    __slots__ = ('author', 'html_content', 'raw_content', 'last_edit', 'content_ref')
+
+    def __init__(self, author, html_content, raw_content, last_edit, content_ref=None):
+        self.author = author
+        self.html_content = html_content
+        self.raw_content = raw_content
+        self.last_edit = last_edit
+        self.content_ref = content_ref
+
+    def __getitem__(self, key):
+        # Read like the post dicts of the json output (post['raw_content'] ...)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def to_json(self):
+        if self.content_ref:
+            return {
+                'author': self.author,
+                'content_ref': self.content_ref,
+                'last_edit': self.last_edit
+            }
+        return {
+            'author': self.author,
+            'html_content': self.html_content,
+            'raw_content': self.raw_content,
+            'last_edit': self.last_edit
+        }
+
+    def __getstate__(self):
+        return (self.author, self.html_content, self.raw_content, self.last_edit, self.content_ref)
+
+    def __setstate__(self, state):
+        self.author, self.html_content, self.raw_content, self.last_edit, self.content_ref = state
+
+
+class ContentReader:
+    def __init__(self, path='BitcoinTalk-Forum', parser=None, cache_size=1024):
+        # Contents of lazy posts are parsed again from their page of the mirror (opened at the first lazy post)
+        self._path = path
+        self._parser_name = parser
+        self._cache_size = cache_size
+        self._storage = None
+
+    def get(self, post, name='raw_content'):
+        # Content of a post record (dict of an output, or Post), whether it is stored in the record or referenced
+        ref = post.get('content_ref')
+        if ref is None:
+            return post[name]
+        if self._storage is None:
+            self._storage = open_storage(self._path)
+            self._parser = get_parser(self._parser_name)
+            # Recently used pages (mapped files, decompressed packed pages) and contents
+            self._page = lru_cache(maxsize=16)(self._storage.map_page)
+            self._content = lru_cache(maxsize=self._cache_size)(self._read)
+        return self._content(*ref)[name]
+
+    def _read(self, board, topic_id, page_nb, start, end):
+        html_content, raw_content = self._parser.parse_content(self._storage.decode_slice(self._page(board, topic_id, page_nb)[start:end]))
+        return {'html_content': html_content, 'raw_content': raw_content.replace(u'\\u00a0', ' ')}
+
+
+def author_id(author):
+    # Members: their profile id (u=123), guests: 'guest:<name>'. Ids are returned as they are (outputs written with the table of authors)
+    if not isinstance(author, dict):
+        return author
+    match = re.search(r'[;?&]u=(\d+)', author['profile'] or '')
+    return match.group(1) if match else f"guest:{author['name']}"
+
+
+def authors_path(output):
+    # raw_BitcoinTalk-data.json(l)(.gz) / .npz -> raw_BitcoinTalk-data-authors.json
+    for extension in ('.jsonl.gz', '.jsonl', '.json', '.npz'):
+        if output.endswith(extension):
+            return f'{output[:-len(extension)]}-authors.json'
+    return f'{output}-authors.json'
+
+
+def load_authors(output):
+    ## Table of authors saved with a scraper output ({} if there is none) ##
+    path = authors_path(output)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+
+class AuthorTable:
+    def __init__(self):
+        # id -> author record ({'name', 'profile', 'status', 'rank', 'activity', 'merit', 'sentence'}), from the most recent post of the author
+        self.records = {}
+        self._last_edit = {}
+
+    def __len__(self):
+        return len(self.records)
+
+    def add(self, author, last_edit):
+        key = author_id(author)
+        if key not in self.records or last_edit >= self._last_edit[key]:
+            self.records[key] = author
+            self._last_edit[key] = last_edit
+        return key
+
+    def merge(self, other):
+        for key, author in other.records.items():
+            self.add(author, other._last_edit[key])
+
+    def save(self, path):
+        atomic_write(path, json.dumps(self.records, indent=2))
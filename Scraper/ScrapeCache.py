@@ -0,0 +1,45 @@
+import sqlite3
+import json
+import zlib
+
+
+class ScrapeCache:
+    # Bump when the parsed page format changes, the cache is then rebuilt
+    VERSION = 1
+
+    def __init__(self, path, readonly=False):
+        # Parsed pages (output of the parser backend), keyed by page and by the storage stamp of the page (mtime / pack offset)
+        # Pool workers only read it, new entries are written by the parent process
+        self._conn = sqlite3.connect(path)
+        if readonly:
+            return
+        if self._conn.execute('PRAGMA user_version').fetchone()[0] != self.VERSION:
+            self._conn.execute('DROP TABLE IF EXISTS pages')
+            self._conn.execute(f'PRAGMA user_version = {self.VERSION}')
+        self._conn.executescript('''
+            PRAGMA journal_mode = WAL;
+            PRAGMA synchronous = NORMAL;
+            CREATE TABLE IF NOT EXISTS pages (
+                board TEXT NOT NULL,
+                topic TEXT NOT NULL,
+                page INTEGER NOT NULL,
+                stamp TEXT NOT NULL,
+                data BLOB NOT NULL,
+                PRIMARY KEY (board, topic, page)
+            );
+        ''')
+
+    def get(self, board, topic_id, page_nb, stamp):
+        row = self._conn.execute('SELECT data FROM pages WHERE board = ? AND topic = ? AND page = ? AND stamp = ?',
+                                 (board, str(topic_id), page_nb, stamp)).fetchone()
+        return json.loads(zlib.decompress(row[0])) if row else None
+
+    def put(self, entries):
+        # entries: [(board, topic id, page nb, stamp, parsed page), ...]
+        self._conn.executemany('INSERT OR REPLACE INTO pages (board, topic, page, stamp, data) VALUES (?, ?, ?, ?, ?)',
+                               [(board, str(topic_id), page_nb, stamp, zlib.compress(json.dumps(page).encode('utf-8')))
+                                for board, topic_id, page_nb, stamp, page in entries])
+        self._conn.commit()
+
+    def close(self):
+        self._conn.close()
@@ -1,19 +1,56 @@
 from bs4 import BeautifulSoup as bs
 from datetime import datetime, timedelta
-from signal import signal, SIGINT
+from concurrent.futures import ProcessPoolExecutor
+from signal import signal, SIGINT, SIG_IGN
+from itertools import repeat
+from utils import get_timestamp
+from storage import open_storage
+from Scraper.Parsers import get_parser, locate_posts
+from Scraper.JsonLines import JsonLinesWriter
+from Scraper.PostTable import PostTableWriter
+from Scraper.ScrapeCache import ScrapeCache
+from Scraper.Records import Post, AuthorTable, authors_path
 from time import sleep
-import calendar
 import cursor
 import json
+import sys
 import os
 
 
 class BitcoinTalkScraper:
-    def __init__(self):
+    def __init__(self, parser=None, workers=1, interactive=True, output='raw_BitcoinTalk-data.json', cache=True, lazy=False):
         self._boards = []
         self._data = {}
-        self._save_file = 'raw_BitcoinTalk-data.json'
-        cursor.hide()
+        ## Authors are stored once (saved next to the output), posts reference them by id ##
+        self._authors = AuthorTable()
+        ## Lazy posts: the contents are not saved, only their location in the stored page (read with Scraper.Records.ContentReader) ##
+        if lazy and output.endswith('.npz'):
+            raise Exception('The post table already reads the contents only when they are used, --lazy is for json / jsonl outputs')
+        self._lazy = lazy
+        self._save_file = output
+        ## .jsonl / .jsonl.gz output: posts are streamed to the file as pages are scraped, instead of one json dump at the end ##
+        ## .npz output: columnar post table (one numpy array per column) ##
+        self._writer = None
+        if interactive and (output.endswith('.jsonl') or output.endswith('.jsonl.gz')):
+            self._writer = JsonLinesWriter(output)
+        elif interactive and output.endswith('.npz'):
+            self._writer = PostTableWriter(output)
+        self._storage = None
+        ## Html parser backend of topic pages: 'lxml' (default when installed) or 'bs4' ##
+        self._parser_name = parser
+        self._parser = get_parser(parser)
+        ## Nb of processes scraping topics (1: everything is done in this process) ##
+        self._workers = workers
+        self._pool = None
+        ## Scrape cache: pages that didn't change since the last run are not parsed again ##
+        self._use_cache = cache
+        self._cache = None
+        self._new_pages = []
+        self._cached_pages = 0
+        self._parsed_pages = 0
+        ## Pool workers don't touch the terminal ##
+        if interactive:
+            cursor.hide()
 
     @staticmethod
     def _display_infos(board):
@@ -27,14 +64,7 @@ class BitcoinTalkScraper:
         print('#-------------------------------------------------------------------------------------#\n')
 
     def _get_timestamp(self, date_str):
-        if 'on ' in date_str:
-            date_str = date_str.replace('on ', '')
-        if 'Today at' in date_str:
-            today = datetime.today()
-            date_str = date_str.replace('Today at', f'{calendar.month_name[today.month]} {str(today.day).zfill(2)}, {today.year},')
-        datetime_obj = datetime.strptime(date_str, '%B %d, %Y, %I:%M:%S %p')
-        timestamp = datetime.timestamp(datetime_obj)
-        return timestamp
+        return get_timestamp(date_str)
 
     def _get_TDL(self, td):
         link = td.find('a').get('href')
@@ -66,12 +96,12 @@ class BitcoinTalkScraper:
         }
 
     @staticmethod
-    def _get_author(text, anchor=None):
-        if anchor:
+    def _get_author(text, profile=None):
+        if profile:
             name, rank, status, activity, merit, *sentence = [info.strip() for info in text.split('\n') if len(info) > 0]
             return {
                 'name': name,
-                'profile': anchor.get('href'),
+                'profile': profile,
                 'status': status,
                 'rank': rank,
                 'activity': activity,
@@ -99,8 +129,11 @@ class BitcoinTalkScraper:
 
     def _get_childboards(self, path='BitcoinTalk-Forum'):
         self._path = path
-        with open(f'{path}/Mining.html', 'r') as file:
-            html = file.read()
+        ## Pages are read through the storage backend of the mirror (loose html files, or compressed packs) ##
+        self._storage = open_storage(path)
+        if self._use_cache:
+            self._cache = ScrapeCache(os.path.join(path, 'scrape_cache.sqlite'))
+        html = self._storage.read_forum_page()
         ## Parse html ##
         soup = bs(html, 'html.parser')
         ## Getting array of child boards ##
@@ -113,7 +146,7 @@ class BitcoinTalkScraper:
                 continue
             title, description, link, moderator, posts, topics, lastpost = self._extract_board_infos(infos)
             ## Board is missing ##
-            if not os.path.exists(f'{path}/{title}/'):
+            if not self._storage.has_board(title):
                 available = False
             ## Appending a board object containing all informations ##
             self._boards.append({
@@ -131,9 +164,23 @@ class BitcoinTalkScraper:
     def save_data(self, signum=None, frame=None):
         if signum:
             print('\n\nCtrl+C detected, saving data ...')
-        with open(self._save_file, 'w', encoding='utf-8') as file:
-            json.dump(self._data, file, indent=2)
-        print(f'\nData saved in `{self._save_file}`')
+        if self._writer:
+            self._writer.close()
+            print(f'\n{self._writer.posts} posts saved in `{self._save_file}`')
+        else:
+            with open(self._save_file, 'w', encoding='utf-8') as file:
+                json.dump(self._data, file, indent=2, default=Post.to_json)
+            print(f'\nData saved in `{self._save_file}`')
+        self._authors.save(authors_path(self._save_file))
+        print(f'{len(self._authors)} authors saved in `{authors_path(self._save_file)}`')
+        if self._storage:
+            self._storage.close()
+        if self._cache:
+            self._save_cache()
+            self._cache.close()
+            self._cache = None
+        if self._pool:
+            self._pool.shutdown(wait=False, cancel_futures=True)
         print('Exiting with code 0 ...')
         cursor.show()
         exit(0)
@@ -142,6 +189,19 @@ class BitcoinTalkScraper:
         signal(SIGINT, self.save_data)
         self._get_childboards()
         self._data['available_boards'] = len([board for board in self._boards if board['available']])
+        if self._workers > 1:
+            self._pool = ProcessPoolExecutor(max_workers=self._workers, initializer=_init_worker, initargs=(self._path, self._parser_name, self._cache is not None, self._lazy))
+        try:
+            self._extract_boards()
+        finally:
+            if self._pool:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+        print(f"{self._cached_pages} page{'s' if self._cached_pages > 1 else ''} from the scrape cache, {self._parsed_pages} page{'s' if self._parsed_pages > 1 else ''} parsed")
+        print('DONE')
+        return self._data
+
+    def _extract_boards(self):
         for board in self._boards:
             self._display_infos(board)
             self._data[board['title']] = {}
@@ -149,63 +209,105 @@ class BitcoinTalkScraper:
                 print(f"Skipping `{board['title']}` board\n")
                 self._data[board['title']] = {'error': 'not_available'}
                 continue
-            board_path = f"{self._path}/{board['title']}"
-            with open(f"{board_path}/{board['title']}.html", 'r', encoding='utf-8') as file:
-                soup = bs(file.read(), 'html.parser')
+            soup = bs(self._storage.read_board_page(board['title']), 'html.parser')
             page_tags = soup.find('td', attrs={'class': 'middletext', 'id': 'toppages'}).findAll('a', attrs={'class': 'navPages'})
             self._data[board['title']]['total_pages'] = int(page_tags[-2].text) if len(page_tags) > 1 else 1
-            self._skim_topics(board=board, path=board_path)
+            self._skim_topics(board=board)
             print()
-        print('DONE')
-        return self._data
 
-    def _skim_topics(self, board, path):
+    def _skim_topics(self, board):
         self._data[board['title']] = {}
-        topic_hashes = [name for name in os.listdir(path) if os.path.isdir(os.path.join(path, name))]
-        ## Scrape topic infos in this loop ##
-        for th in topic_hashes:
-            ## List of all topic's html pages ##
-            topic_pages = [name for name in os.listdir(f'{path}/{th}/') if name.endswith('.html')]
-            infos = self._get_topic_infos(path=f'{path}/{th}/1.html')
-            self._data[board['title']][infos['title']] = {
-                'started_by': infos['started_by'],
-                'started_at': infos['started_at'],
-                'total_pages': len(topic_pages)
-            }
-            topic_pages = sorted(topic_pages, key=lambda x: int(x[:x.index('.')]))
-            ## Scrape topic posts in this loop ##
-            for tp in topic_pages:
-                filename = f'{path}/{th}/{tp}'
+        topics = self._storage.topics(board['title'])
+        ## Serial mode: pages are added as soon as they are scraped, so Ctrl+C saves the pages already scraped ##
+        if self._workers <= 1:
+            for th in topics:
+                title, topic, pages = self._start_topic(board['title'], th)
+                self._add_topic(board['title'], th, title, topic)
+                for page_nb, link, posts in self._scrape_pages(board['title'], th, pages):
+                    self._add_page(board['title'], th, title, topic, page_nb, link, posts)
+                self._save_cache()
+            return
+        ## Process pool: topics are scraped by the workers, records are merged in the order of the topics (same output as a serial run) ##
+        for th, (title, topic, pages, new_pages, parsed, authors) in zip(topics, self._pool.map(_scrape_topic, repeat(board['title']), topics)):
+            self._authors.merge(authors)
+            self._cached_pages += len(pages) - parsed
+            self._parsed_pages += parsed
+            self._new_pages += new_pages
+            self._save_cache()
+            self._add_topic(board['title'], th, title, topic)
+            for page_nb, link, posts in pages:
+                self._add_page(board['title'], th, title, topic, page_nb, link, posts)
+            posts = sum(len(page[2]) for page in pages)
+            print(f"{datetime.now()}\t{board['title']}/{th}: `{title}` ({topic['total_pages']} page{'s' if topic['total_pages'] > 1 else ''}, {posts} post{'s' if posts > 1 else ''})")
+
+    def _add_topic(self, board_title, th, title, topic):
+        ## Streaming output: topics are not kept in memory, their infos are written with each post ##
+        if not self._writer:
+            self._data[board_title][title] = topic
+
+    def _add_page(self, board_title, th, title, topic, page_nb, link, posts):
+        if self._writer:
+            self._writer.write_page(board_title, th, title, topic, page_nb, link, posts)
+        else:
+            topic['link'] = link
+            topic[str(page_nb)] = {'posts': posts}
+
+    def _parse_page(self, board_title, th, page_nb, infos=False):
+        ## Pages with the same storage stamp as in the last run come from the scrape cache, the others are parsed ##
+        stamp = self._storage.stamp(board_title, th, page_nb) if self._cache else None
+        page = self._cache.get(board_title, th, page_nb, stamp) if self._cache else None
+        if page is not None and (page['infos'] or not infos) and ('offsets' in page or not self._lazy):
+            self._cached_pages += 1
+            return page
+        page = self._parser.parse_page(self._storage.read_page(board_title, th, page_nb), infos=infos)
+        if self._lazy:
+            offsets = locate_posts(self._storage.map_page(board_title, th, page_nb))
+            # Posts that can't be located in the page keep their contents
+            page['offsets'] = offsets if len(offsets) == len(page['posts']) else None
+        self._parsed_pages += 1
+        if self._cache:
+            self._new_pages.append((board_title, th, page_nb, stamp, page))
+        return page
+
+    def _save_cache(self):
+        if self._cache and self._new_pages:
+            self._cache.put(self._new_pages)
+        self._new_pages = []
+
+    def _start_topic(self, board_title, th):
+        ## List of all topic's pages, sorted by number ##
+        topic_pages = self._storage.pages(board_title, th)
+        ## Every page is parsed once: the first page gives the topic infos and its posts ##
+        first_page = self._parse_page(board_title, th, 1, infos=True)
+        infos = self._get_topic_infos(first_page)
+        topic = {
+            'started_by': infos['started_by'],
+            'started_at': infos['started_at'],
+            'total_pages': len(topic_pages)
+        }
+        return infos['title'], topic, {'numbers': topic_pages, 1: first_page}
+
+    def _scrape_pages(self, board_title, th, pages, verbose=True):
+        ## Scrape topic posts in this loop, yield (page nb, link, posts) page by page ##
+        for page_nb in pages['numbers']:
+            tp = f'{page_nb}.html'
+            if verbose:
                 print(f'\n{datetime.now()}')
                 print(f"└── {self._path}")
-                print(f"    └── {board['title']}")
+                print(f"    └── {board_title}")
                 print(f'        └── {th}')
-                print(f"            └── {tp} ({int(tp[:tp.index('.')])}/{len(topic_pages)})")
-                with open(filename, 'r', encoding='utf-8') as file:
-                    soup = bs(file.read(), 'html.parser')
-                link = soup.find('link', attrs={'rel': 'prev'}).get('href').replace(';prev_next=prev', '')
-                self._data[board['title']][infos['title']]['link'] = link
-                self._data[board['title']][infos['title']][tp.replace('.html', '')] = {'posts': []}
-                self._extract_posts(soup, board, infos, tp)
-
-    def _get_topic_infos(self, path):
-        with open(path, 'r', encoding='utf-8') as file:
-            soup = bs(file.read(), 'html.parser')
-        title = soup.title.text
-        form = soup.find('form', attrs={'id': 'quickModForm'})
-        posts = [post.find('td') for post in form.find('table').find_all('tr') if len(post.find('td')) == 5]
-        try:
-            date = form.find('span', attrs={'class': 'edited'}).text
-        except Exception:
-            date = form.find_all('td', attrs={'valign': 'middle'})[1].find_all('div')[1].text
-        try:
-            started_by = {'name': posts[0].find('a').text, 'profile': posts[0].find('a').get('href')}
-        except Exception:
-            started_by = {'name': posts[0].find('b').text, 'profile': 'noprofile'}
+                print(f"            └── {tp} ({page_nb}/{len(pages['numbers'])})")
+            page = pages[1] if page_nb == 1 else self._parse_page(board_title, th, page_nb)
+            posts = []
+            refs = [[board_title, th, page_nb, start, end] for start, end in page['offsets']] if self._lazy and page['offsets'] else None
+            self._extract_posts(page['posts'], posts, verbose, refs)
+            yield page_nb, page['link'], posts
+
+    def _get_topic_infos(self, page):
         return {
-            'title': title,
-            'started_by': started_by,
-            'started_at': self._get_timestamp(date)
+            'title': page['title'],
+            'started_by': page['infos']['started_by'],
+            'started_at': self._get_timestamp(page['infos']['date'])
         }
 
     @staticmethod
@@ -215,47 +317,77 @@ class BitcoinTalkScraper:
             for cur in cursors:
                 yield cur
 
-    def _extract_posts(self, soup, board, infos, tp):
+    def _extract_posts(self, posts, records, verbose=True, refs=None):
         delay = 0.005
         scraped_posts = 0
         start = datetime.now()
         one_second = timedelta(seconds=1)
-        form = soup.find('form', attrs={'id': 'quickModForm'})
-        posts = form.find('table').find_all('tr')
-        for post, cur in zip(posts, self.spinner()):
-            # Might be an add or something we don't care about
-            if not post.find('div', attrs={'class': 'post'}) or len(post) != 5 or len(post.parent.attrs) != 4:
-                continue
-            print(u'\u2588', end='', flush=True)
-            try:
-                date = post.find('table').find('span', attrs={'class': 'edited'}).text
-            except Exception:
-                date = post.find('table').find_all('td', attrs={'valign': 'middle'})[1].find_all('div')[1].text
+        ## Rows that aren't posts (adds, ...) were already filtered out by the parser ##
+        for nb, (post, cur) in enumerate(zip(posts, self.spinner())):
+            if verbose:
+                print(u'\u2588', end='', flush=True)
             try:
-                author = self._get_author(post.find('td', attrs={'class': 'poster_info'}).text, post.find('img', attrs={'title': 'View Profile'}).parent)
+                author = self._get_author(post['poster_info'], post['profile'])
             except Exception:
-                author = self._get_author(post.find('td', attrs={'class': 'poster_info'}).text)
-            content = post.find('div', attrs={'class': 'post'})
-            self._data[board['title']][infos['title']][tp.replace('.html', '')]['posts'].append({
-                'author': author,
-                'html_content': str(content),
-                'raw_content': content.get_text(separator='\n').replace(u'\\u00a0', ' '),
-                'last_edit': self._get_timestamp(date),
-            })
+                author = self._get_author(post['poster_info'])
+            last_edit = self._get_timestamp(post['date'])
+            if refs:
+                records.append(Post(self._authors.add(author, last_edit), None, None, last_edit, refs[nb]))
+            else:
+                records.append(Post(self._authors.add(author, last_edit), post['html_content'], post['raw_content'].replace(u'\\u00a0', ' '), last_edit))
             scraped_posts += 1
+            if not verbose:
+                continue
             elapsed = datetime.now() - start
             padding = ' ' * (25 - scraped_posts)
             info_str = f"{padding}{cur}  Scraped {scraped_posts} post{'s' if scraped_posts > 1 else ''} in {elapsed} second{'s' if elapsed > one_second else ''} ({delay} second{'s' if delay > 1 else ''} of delay)"
             print(info_str, end='', flush=True)
             # sleep(delay)
             print('\b' * len(info_str), end='', flush=True)
+        if not verbose:
+            return
         cur = u'\u25B8'
         info_str = f"{padding}{cur}  Scraped {scraped_posts} post{'s' if scraped_posts > 1 else ''} in {elapsed} second{'s' if elapsed > one_second else ''} ({delay} second{'s' if delay > 1 else ''} of delay)"
         print(info_str)
         print()
 
 
+## Process pool workers: one scraper (storage + parser) per process, each call returns a whole topic record ##
+_worker = None
+
+
+def _init_worker(path, parser, cache, lazy):
+    global _worker
+    # Ctrl+C is handled by the parent, which saves the merged data
+    signal(SIGINT, SIG_IGN)
+    _worker = BitcoinTalkScraper(parser, interactive=False, lazy=lazy)
+    _worker._path = path
+    _worker._storage = open_storage(path)
+    # Workers only read the scrape cache, pages they parse are sent back to the parent
+    if cache:
+        _worker._cache = ScrapeCache(os.path.join(path, 'scrape_cache.sqlite'), readonly=True)
+
+
+def _scrape_topic(board_title, th):
+    title, topic, pages = _worker._start_topic(board_title, th)
+    pages = list(_worker._scrape_pages(board_title, th, pages, verbose=False))
+    new_pages, _worker._new_pages = _worker._new_pages, []
+    # Pages parsed by the worker (new_pages is empty without the scrape cache)
+    parsed, _worker._parsed_pages = _worker._parsed_pages, 0
+    # Authors of the topic, merged in the table of the parent
+    authors, _worker._authors = _worker._authors, AuthorTable()
+    return title, topic, pages, new_pages, parsed, authors
+
+
 if __name__ == '__main__':
-    bts = BitcoinTalkScraper()
+    # --parser=lxml (default when installed) | --parser=bs4
+    # --workers=N: scrape topics with N processes
+    # --output=raw_BitcoinTalk-data.jsonl(.gz): stream one record per post
+    # --output=raw_BitcoinTalk-data.npz: columnar post table
+    # --no-cache: parse every page again, without reading / updating the scrape cache
+    # --lazy: posts reference their content in the stored pages instead of containing it
+    options = dict(arg[2:].split('=', 1) for arg in sys.argv[1:] if arg.startswith('--') and '=' in arg)
+    bts = BitcoinTalkScraper(options.get('parser'), int(options.get('workers', 1)), output=options.get('output', 'raw_BitcoinTalk-data.json'),
+                             cache='--no-cache' not in sys.argv[1:], lazy='--lazy' in sys.argv[1:])
     bts.extract_data()
     bts.save_data()
\ No newline at end of file
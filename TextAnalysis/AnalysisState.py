@@ -0,0 +1,125 @@
+from TextAnalysis.TermMatrix import TermMatrix
+import sqlite3
+import json
+import zlib
+
+
+class AnalysisState:
+    # Bump when the stored format changes, the state is then rebuilt
+    VERSION = 1
+
+    def __init__(self, path, settings):
+        # Results of the incremental analysis (Analyzer.update): each topic as in analysis_results.json, the metadata of each board,
+        # and the term counts of each analyzed post with the last_edit it had. `settings` (model, rules, ignored words ...): when they
+        # change, the stored results are not valid anymore and the state starts again from scratch
+        self._conn = sqlite3.connect(path)
+        if self._conn.execute('PRAGMA user_version').fetchone()[0] != self.VERSION:
+            self._conn.executescript('DROP TABLE IF EXISTS settings; DROP TABLE IF EXISTS boards; DROP TABLE IF EXISTS topics; DROP TABLE IF EXISTS posts;')
+            self._conn.execute(f'PRAGMA user_version = {self.VERSION}')
+        self._conn.executescript('''
+            PRAGMA journal_mode = WAL;
+            PRAGMA synchronous = NORMAL;
+            CREATE TABLE IF NOT EXISTS settings (value TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS boards (
+                name TEXT PRIMARY KEY,
+                metadata TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS topics (
+                board TEXT NOT NULL,
+                title TEXT NOT NULL,
+                data BLOB NOT NULL,
+                PRIMARY KEY (board, title)
+            );
+            CREATE TABLE IF NOT EXISTS posts (
+                board TEXT NOT NULL,
+                topic TEXT NOT NULL,
+                post_id INTEGER NOT NULL,
+                last_edit REAL NOT NULL,
+                nb_of_words INTEGER NOT NULL,
+                counts TEXT NOT NULL,
+                PRIMARY KEY (board, topic, post_id)
+            );
+        ''')
+        settings = json.dumps(settings, sort_keys=True)
+        row = self._conn.execute('SELECT value FROM settings').fetchone()
+        if row is None or row[0] != settings:
+            if row is not None:
+                print('Analysis settings changed: every post is analyzed again')
+            with self._conn:
+                self._conn.executescript('DELETE FROM settings; DELETE FROM boards; DELETE FROM topics; DELETE FROM posts;')
+                self._conn.execute('INSERT INTO settings (value) VALUES (?)', (settings,))
+
+    def boards(self):
+        return [name for name, in self._conn.execute('SELECT name FROM boards ORDER BY rowid')]
+
+    def remove_board(self, board):
+        with self._conn:
+            for table, column in (('boards', 'name'), ('topics', 'board'), ('posts', 'board')):
+                self._conn.execute(f'DELETE FROM {table} WHERE {column} = ?', (board,))
+
+    def board(self, board):
+        row = self._conn.execute('SELECT metadata FROM boards WHERE name = ?', (board,)).fetchone()
+        return json.loads(row[0]) if row else {'nb_of_words': 0, 'nb_of_documents': 0}
+
+    def topic(self, board, title):
+        row = self._conn.execute('SELECT data FROM topics WHERE board = ? AND title = ?', (board, title)).fetchone()
+        return json.loads(zlib.decompress(row[0])) if row else None
+
+    def seen_posts(self, board):
+        ## {topic: {post id: last_edit}} of the analyzed topics of a board and of their posts ##
+        seen = {title: {} for title, in self._conn.execute('SELECT title FROM topics WHERE board = ?', (board,))}
+        for topic, post_id, last_edit in self._conn.execute('SELECT topic, post_id, last_edit FROM posts WHERE board = ?', (board,)):
+            seen.setdefault(topic, {})[post_id] = last_edit
+        return seen
+
+    def post_counts(self, board, title, post_ids):
+        ## {post id: (nb of words, {term: count})} ##
+        posts = {}
+        for post_id in post_ids:
+            row = self._conn.execute('SELECT nb_of_words, counts FROM posts WHERE board = ? AND topic = ? AND post_id = ?', (board, title, post_id)).fetchone()
+            if row:
+                posts[post_id] = (row[0], json.loads(row[1]))
+        return posts
+
+    def save_topic(self, board, title, topic, posts, removed=()):
+        # posts: [(post id, last_edit, nb of words, {term: count}), ...] analyzed in this run, removed: ids of posts that are not in the topic anymore
+        # The row of a topic keeps its place (upsert): topics are listed in the order they were first analyzed
+        self._conn.execute('INSERT INTO topics (board, title, data) VALUES (?, ?, ?) ON CONFLICT (board, title) DO UPDATE SET data = excluded.data',
+                           (board, title, zlib.compress(json.dumps(topic).encode('utf-8'))))
+        self._conn.executemany('DELETE FROM posts WHERE board = ? AND topic = ? AND post_id = ?', [(board, title, post_id) for post_id in removed])
+        self._conn.executemany('INSERT OR REPLACE INTO posts (board, topic, post_id, last_edit, nb_of_words, counts) VALUES (?, ?, ?, ?, ?, ?)',
+                               [(board, title, post_id, last_edit, nb_of_words, json.dumps(counts)) for post_id, last_edit, nb_of_words, counts in posts])
+
+    def remove_topic(self, board, title):
+        ## Forget a topic that is not in the dataset anymore, returns its (nb of documents, nb of words) to take out of the board metadata ##
+        topic = self.topic(board, title)
+        nb_of_words = self._conn.execute('SELECT COALESCE(SUM(nb_of_words), 0) FROM posts WHERE board = ? AND topic = ?', (board, title)).fetchone()[0]
+        self._conn.execute('DELETE FROM topics WHERE board = ? AND title = ?', (board, title))
+        self._conn.execute('DELETE FROM posts WHERE board = ? AND topic = ?', (board, title))
+        return (topic['metadata']['nb_of_documents'] if topic else 0), nb_of_words
+
+    def save_board(self, board, metadata):
+        # The topics of the board are committed with its metadata
+        self._conn.execute('INSERT INTO boards (name, metadata) VALUES (?, ?) ON CONFLICT (name) DO UPDATE SET metadata = excluded.metadata', (board, json.dumps(metadata)))
+        self._conn.commit()
+
+    def to_tree(self):
+        ## Stored results with the structure of analysis_results.json ##
+        boards = {name: {'metadata': json.loads(metadata)} for name, metadata in self._conn.execute('SELECT name, metadata FROM boards ORDER BY rowid')}
+        for board, title, data in self._conn.execute('SELECT board, title, data FROM topics ORDER BY rowid'):
+            boards[board][title] = json.loads(zlib.decompress(data))
+        return boards
+
+    def term_matrix(self):
+        ## TermMatrix of the stored posts (see Analyzer.full_scan) ##
+        matrix = TermMatrix()
+        for board, title, counts, last_edit, nb_of_words in self._conn.execute('SELECT posts.board, posts.topic, posts.counts, posts.last_edit, posts.nb_of_words FROM posts '
+                                                                                'JOIN topics ON topics.board = posts.board AND topics.title = posts.topic ORDER BY topics.rowid, posts.post_id'):
+            matrix.add_document(board, title, json.loads(counts), last_edit, nb_of_words)
+        boards = {name: json.loads(metadata) for name, metadata in self._conn.execute('SELECT name, metadata FROM boards')}
+        for board, title, data in self._conn.execute('SELECT board, title, data FROM topics ORDER BY rowid'):
+            matrix.set_nb_of_words(board, title, json.loads(zlib.decompress(data))['metadata']['nb_of_words'], boards[board]['nb_of_words'])
+        return matrix
+
+    def close(self):
+        self._conn.close()
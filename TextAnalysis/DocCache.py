@@ -0,0 +1,59 @@
+from spacy.tokens import DocBin
+import hashlib
+import sqlite3
+import spacy
+
+
+class DocCache:
+    # Bump when the serialized doc format changes, the cache is then rebuilt
+    VERSION = 1
+    # Token attributes used by the analysis (is_punct, is_stop, lower ... are attributes of the lexeme of ORTH)
+    ATTRS = ['ORTH', 'LEMMA', 'POS', 'TAG', 'MORPH']
+
+    def __init__(self, path, nlp, readonly=False):
+        # Tagged docs keyed by a hash of their text and of the model (name, version, components): changing WORDS/ignore.json or the
+        # matcher rules doesn't tag the posts again. Pool workers only read it, new docs are written by the parent process
+        self._vocab = nlp.vocab
+        self._model = f"{nlp.meta['lang']}_{nlp.meta['name']}-{nlp.meta['version']}:spacy-{spacy.__version__}:{','.join(nlp.pipe_names)}"
+        self._conn = sqlite3.connect(path)
+        if readonly:
+            return
+        if self._conn.execute('PRAGMA user_version').fetchone()[0] != self.VERSION:
+            self._conn.execute('DROP TABLE IF EXISTS docs')
+            self._conn.execute(f'PRAGMA user_version = {self.VERSION}')
+        self._conn.executescript('''
+            PRAGMA journal_mode = WAL;
+            PRAGMA synchronous = NORMAL;
+            CREATE TABLE IF NOT EXISTS docs (
+                key TEXT PRIMARY KEY,
+                data BLOB NOT NULL
+            );
+        ''')
+
+    def key(self, text):
+        return hashlib.sha1(f'{self._model}\n{text}'.encode('utf-8')).hexdigest()
+
+    def get_many(self, keys):
+        ## {key: doc} of the keys that are in the cache ##
+        docs = {}
+        keys = list(set(keys))
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            rows = self._conn.execute(f"SELECT key, data FROM docs WHERE key IN ({', '.join('?' * len(chunk))})", chunk)
+            for key, data in rows:
+                docs[key] = next(DocBin().from_bytes(data).get_docs(self._vocab))
+        return docs
+
+    def serialize(self, doc):
+        # DocBin bytes are compressed
+        docs = DocBin(attrs=self.ATTRS)
+        docs.add(doc)
+        return docs.to_bytes()
+
+    def put(self, entries):
+        # entries: [(key, serialized doc), ...]
+        self._conn.executemany('INSERT OR REPLACE INTO docs (key, data) VALUES (?, ?)', entries)
+        self._conn.commit()
+
+    def close(self):
+        self._conn.close()
@@ -0,0 +1,132 @@
+from Scraper.JsonLines import iter_posts
+from Scraper.PostTable import PostTable
+from Scraper.Records import author_id, ContentReader
+from datetime import datetime
+import sqlite3
+import json
+import sys
+
+
+## Full-text index of the scraped posts (SQLite FTS5 on raw_content, indexes on last_edit / board / topic) ##
+## Queries use the FTS5 syntax: `pool`, `mining AND pool`, `"mining pool"` (phrase, see `phrase`), `pool*` (prefix) ...
+
+def phrase(text):
+    # Exact phrase query (words of the text in this order), whatever characters the text contains
+    return '"' + text.replace('"', '""') + '"'
+
+
+def _iter_dataset(path, contents):
+    ## (board, topic id, topic title, page nb, post nb, author id, last_edit, raw_content) of each post of a scraper output ##
+    if path.endswith('.npz'):
+        table = PostTable(path)
+        topics, pages, posts, authors, last_edit = table['topic'], table['page'], table['post'], table['author'], table['last_edit']
+        for row in range(len(table)):
+            topic = table.topics[topics[row]]
+            yield table.boards[topic['board']], str(topic['topic_id']), topic['title'], int(pages[row]), int(posts[row]), \
+                table.authors[authors[row]], float(last_edit[row]), table.text('raw_content', row)
+    elif path.endswith('.jsonl') or path.endswith('.jsonl.gz'):
+        for record in iter_posts(path):
+            yield record['board'], str(record['topic_id']), record['topic'], record['page'], record['post'], \
+                author_id(record['author']), record['last_edit'], contents.get(record)
+    else:
+        with open(path, 'r', encoding='utf-8') as file:
+            data = json.load(file)
+        for board, topics in data.items():
+            if type(topics) != dict:
+                continue
+            for title, topic in topics.items():
+                for page_nb in range(1, topic['total_pages'] + 1):
+                    for post_nb, post in enumerate(topic[str(page_nb)]['posts']):
+                        yield board, title, title, page_nb, post_nb, author_id(post['author']), post['last_edit'], contents.get(post)
+
+
+class FullTextIndex:
+    def __init__(self, path='posts_index.sqlite'):
+        self._conn = sqlite3.connect(path)
+        self._conn.executescript('''
+            PRAGMA journal_mode = WAL;
+            CREATE TABLE IF NOT EXISTS posts (
+                id INTEGER PRIMARY KEY,
+                board TEXT NOT NULL,
+                topic_id TEXT NOT NULL,
+                topic TEXT NOT NULL,
+                page INTEGER NOT NULL,
+                post INTEGER NOT NULL,
+                author TEXT,
+                last_edit REAL NOT NULL,
+                raw_content TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS posts_last_edit ON posts (last_edit);
+            CREATE INDEX IF NOT EXISTS posts_board ON posts (board, last_edit);
+            CREATE INDEX IF NOT EXISTS posts_topic ON posts (board, topic, last_edit);
+            CREATE VIRTUAL TABLE IF NOT EXISTS posts_fts USING fts5 (raw_content, content='posts', content_rowid='id', tokenize='unicode61 remove_diacritics 2');
+        ''')
+
+    def build(self, dataset_path, mirror='BitcoinTalk-Forum', batch_size=5000):
+        ## (Re)index every post of a scraper output (.json, .jsonl(.gz) or .npz), contents of lazy posts are read from the mirror ##
+        with self._conn:
+            self._conn.execute('DELETE FROM posts')
+            batch = []
+            for post in _iter_dataset(dataset_path, ContentReader(mirror)):
+                batch.append(post)
+                if len(batch) >= batch_size:
+                    self._insert(batch)
+                    batch = []
+            self._insert(batch)
+            # External content table: the full-text index is built from the posts table in one pass
+            self._conn.execute("INSERT INTO posts_fts (posts_fts) VALUES ('rebuild')")
+        self._conn.execute("INSERT INTO posts_fts (posts_fts) VALUES ('optimize')")
+        self._conn.commit()
+        return self._conn.execute('SELECT COUNT(*) FROM posts').fetchone()[0]
+
+    def _insert(self, batch):
+        self._conn.executemany('INSERT INTO posts (board, topic_id, topic, page, post, author, last_edit, raw_content) VALUES (?, ?, ?, ?, ?, ?, ?, ?)', batch)
+
+    @staticmethod
+    def _where(query, start, end, board, topic):
+        clauses, params = [], []
+        if query is not None:
+            clauses.append('posts.id IN (SELECT rowid FROM posts_fts WHERE posts_fts MATCH ?)')
+            params.append(query)
+        for clause, value in (('posts.last_edit >= ?', start), ('posts.last_edit <= ?', end), ('posts.board = ?', board), ('posts.topic = ?', topic)):
+            if value is not None:
+                clauses.append(clause)
+                params.append(value)
+        return (f"WHERE {' AND '.join(clauses)}" if clauses else ''), params
+
+    def search(self, query, start=None, end=None, board=None, topic=None, limit=None):
+        ## Posts matching a query, edited between two timestamps (included), sorted by date ##
+        where, params = self._where(query, start, end, board, topic)
+        rows = self._conn.execute(f"SELECT board, topic_id, topic, page, post, author, last_edit, raw_content FROM posts {where} ORDER BY last_edit{' LIMIT ?' if limit else ''}",
+                                  params + ([limit] if limit else []))
+        return [dict(zip(('board', 'topic_id', 'topic', 'page', 'post', 'author', 'last_edit', 'raw_content'), row)) for row in rows]
+
+    def count(self, query, start=None, end=None, board=None, topic=None):
+        where, params = self._where(query, start, end, board, topic)
+        return self._conn.execute(f'SELECT COUNT(*) FROM posts {where}', params).fetchone()[0]
+
+    def time_range(self, query=None, start=None, end=None, board=None, topic=None):
+        # (first, last) last_edit of the matching posts
+        where, params = self._where(query, start, end, board, topic)
+        return self._conn.execute(f'SELECT MIN(last_edit), MAX(last_edit) FROM posts {where}', params).fetchone()
+
+    def counts_over_time(self, query, date_format='%Y-%m-%d', start=None, end=None, board=None, topic=None):
+        ## Nb of posts matching a query for each period (local date of last_edit formatted with `date_format`: '%Y-%m-%d' per day, '%Y-%W' per week, '%Y-%m' per month ...) ##
+        where, params = self._where(query, start, end, board, topic)
+        rows = self._conn.execute(f"SELECT strftime(?, posts.last_edit, 'unixepoch', 'localtime') AS period, COUNT(*) FROM posts {where} GROUP BY period ORDER BY MIN(posts.last_edit)",
+                                  [date_format] + params)
+        return dict(rows.fetchall())
+
+    def close(self):
+        self._conn.close()
+
+
+if __name__ == '__main__':
+    # python -m TextAnalysis.FullTextIndex raw_BitcoinTalk-data.json [posts_index.sqlite]
+    if len(sys.argv) not in (2, 3):
+        raise Exception('Usage: python -m TextAnalysis.FullTextIndex <json | jsonl | npz file> [index file]')
+    start = datetime.now()
+    index = FullTextIndex(*sys.argv[2:])
+    posts = index.build(sys.argv[1])
+    index.close()
+    print(f'{posts} posts indexed in {datetime.now() - start}')
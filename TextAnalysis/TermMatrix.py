@@ -0,0 +1,225 @@
+from scipy.sparse import csr_matrix
+from array import array
+import numpy as np
+import json
+import os
+
+
+## Sparse term-document matrix of an analysis: one row per post, one column per term (word or n-gram), values are occurrences ##
+## TF, IDF and TF-IDF are computed with matrix operations, for each post, topic, board or the whole corpus (`level`):
+##    tf = occurrences / nb of words, idf = log(nb of documents / nb of documents containing the term)
+## Nb of words of topics and boards are the ones of the analysis metadata, posts use their own nb of words.
+## Posts have a last_edit: scores can also be computed on the posts of a time window (start / end), groups then use the nb of words of these posts.
+
+LEVELS = ('post', 'topic', 'board', 'corpus')
+
+
+class TermMatrix:
+    def __init__(self):
+        self.terms = []
+        self._vocabulary = {}
+        self.boards = []
+        # {'board': board index, 'title': str, 'nb_of_words': int}
+        self.topics = []
+        self.board_words = []
+        self._topic_index = {}
+        self._doc_topic = array('i')
+        self._indptr = array('q', [0])
+        self._indices = array('i')
+        self._data = array('i')
+        self._last_edit = array('d')
+        self._words = array('q')
+        self._counts = None
+        self._time_order = None
+        self._sorted_times = None
+        self._topic_board = None
+        self._scores = {}
+
+    def __len__(self):
+        return len(self._doc_topic)
+
+    def _term_id(self, term):
+        if term not in self._vocabulary:
+            self._vocabulary[term] = len(self.terms)
+            self.terms.append(term)
+        return self._vocabulary[term]
+
+    def _topic(self, board, title):
+        if (board, title) not in self._topic_index:
+            if board not in self.boards:
+                self.boards.append(board)
+                self.board_words.append(0)
+            self._topic_index[(board, title)] = len(self.topics)
+            self.topics.append({'board': self.boards.index(board), 'title': title, 'nb_of_words': 0})
+        return self._topic_index[(board, title)]
+
+    def add_document(self, board, title, counts, last_edit=float('nan'), nb_of_words=None):
+        # counts: {term: nb of occurrences in the post}, nb_of_words: all the words of the post (default: its counted terms)
+        self._doc_topic.append(self._topic(board, title))
+        for term, count in counts.items():
+            self._indices.append(self._term_id(term))
+            self._data.append(count)
+        self._indptr.append(len(self._indices))
+        self._last_edit.append(last_edit)
+        self._words.append(sum(counts.values()) if nb_of_words is None else nb_of_words)
+        self._counts = None
+        self._time_order = None
+        self._sorted_times = None
+        self._topic_board = None
+        self._scores = {}
+
+    def set_nb_of_words(self, board, title, topic_words, board_words):
+        self.topics[self._topic(board, title)]['nb_of_words'] = topic_words
+        self.board_words[self.boards.index(board)] = board_words
+        self._scores = {}
+
+    def counts(self):
+        if self._counts is None:
+            self._counts = csr_matrix((np.array(self._data, dtype=np.int32), np.array(self._indices, dtype=np.int32), np.array(self._indptr, dtype=np.int64)),
+                                      shape=(len(self), len(self.terms)))
+        return self._counts
+
+    def _groups(self, level):
+        ## Group of each post at a level, and nb of words of each group ##
+        doc_topic = np.frombuffer(self._doc_topic, dtype=np.int32)
+        topic_board = np.array([topic['board'] for topic in self.topics], dtype=np.int32)
+        if level == 'post':
+            return np.arange(len(self)), np.frombuffer(self._words, dtype=np.int64).astype(np.float64)
+        if level == 'topic':
+            return doc_topic, np.array([topic['nb_of_words'] for topic in self.topics], dtype=np.float64)
+        if level == 'board':
+            return topic_board[doc_topic], np.array(self.board_words, dtype=np.float64)
+        if level == 'corpus':
+            return np.zeros(len(self), dtype=np.int64), np.array([sum(self.board_words)], dtype=np.float64)
+        raise Exception(f"Unknown level '{level}' (available: {', '.join(LEVELS)})")
+
+    def time_order(self):
+        # Posts sorted by last_edit (saved with the matrix)
+        if self._time_order is None:
+            self._time_order = np.argsort(np.frombuffer(self._last_edit, dtype=np.float64), kind='stable')
+        return self._time_order
+
+    def sorted_times(self):
+        # last_edit in the time order, built once: windows are then found by binary search only
+        if self._sorted_times is None:
+            self._sorted_times = np.frombuffer(self._last_edit, dtype=np.float64)[self.time_order()]
+            # Posts without last_edit (nan) are sorted last, they are in no window
+            self._nb_of_timed = int(np.count_nonzero(~np.isnan(self._sorted_times)))
+        return self._sorted_times
+
+    def rows_between(self, start=None, end=None, closed=True, board=None):
+        ## Posts edited between two timestamps (start included, end included if closed), found by binary search in the time order ##
+        order, times = self.time_order(), self.sorted_times()
+        first = 0 if start is None else np.searchsorted(times[:self._nb_of_timed], start, side='left')
+        last = self._nb_of_timed if end is None else np.searchsorted(times[:self._nb_of_timed], end, side='right' if closed else 'left')
+        rows = np.sort(order[first:last])
+        # Only the posts of the window are filtered by board
+        if board is not None:
+            if self._topic_board is None:
+                self._topic_board = np.array([topic['board'] for topic in self.topics], dtype=np.int32)
+            rows = rows[self._topic_board[np.frombuffer(self._doc_topic, dtype=np.int32)[rows]] == self.boards.index(board)]
+        return rows
+
+    def windows(self, width, step=None, start=None, end=None):
+        ## [(start, end), ...] of rolling windows of `width` seconds every `step` seconds (default: width), from the first to the last last_edit ##
+        rows = self.rows_between()
+        if not len(rows):
+            return []
+        times = np.frombuffer(self._last_edit, dtype=np.float64)[rows]
+        start = times.min() if start is None else start
+        end = times.max() if end is None else end
+        return [(float(window), float(window + width)) for window in np.arange(start, end + 1e-9, step or width)]
+
+    def posts(self, rows):
+        # (board, topic title, post id, last_edit) of posts: the posts of a topic are consecutive rows, the post id is the position in the topic
+        doc_topic = np.frombuffer(self._doc_topic, dtype=np.int32)
+        first_rows = np.zeros(len(self.topics), dtype=np.int64)
+        topics, first = np.unique(doc_topic, return_index=True)
+        first_rows[topics] = first
+        return [(self.boards[self.topics[doc_topic[row]]['board']], self.topics[doc_topic[row]]['title'], int(row - first_rows[doc_topic[row]]), self._last_edit[row]) for row in rows]
+
+    def scores(self, level='topic', start=None, end=None, closed=True):
+        ## {'occurrences', 'in_docs', 'tf', 'idf', 'tf-idf'}: (groups x terms) csr matrices, all with the same structure ##
+        # start / end: only the posts of this time window (see rows_between)
+        if start is not None or end is not None:
+            return self._compute_scores(level, self.rows_between(start, end, closed))
+        if level not in self._scores:
+            self._scores[level] = self._compute_scores(level)
+        return self._scores[level]
+
+    def _compute_scores(self, level, rows=None):
+        group, nb_of_words = self._groups(level)
+        counts = self.counts()
+        if rows is not None:
+            counts, group = counts[rows], group[rows]
+            nb_of_words = np.bincount(group, weights=np.frombuffer(self._words, dtype=np.int64)[rows], minlength=len(nb_of_words))
+        members = csr_matrix((np.ones(len(group), dtype=np.int32), (group, np.arange(len(group)))), shape=(len(nb_of_words), len(group)))
+        occurrences = (members @ counts).tocsr()
+        in_docs = (members @ (counts > 0).astype(np.int32)).tocsr()
+        occurrences.sort_indices()
+        in_docs.sort_indices()
+        nb_of_documents = np.bincount(group, minlength=len(nb_of_words))
+        rows = np.repeat(np.arange(len(nb_of_words)), np.diff(occurrences.indptr))
+        tf = occurrences.data / nb_of_words[rows]
+        idf = np.log(nb_of_documents[rows] / in_docs.data)
+        structure = (occurrences.indices, occurrences.indptr)
+        return {
+            'occurrences': occurrences,
+            'in_docs': in_docs,
+            'tf': csr_matrix((tf, *structure), shape=occurrences.shape),
+            'idf': csr_matrix((idf, *structure), shape=occurrences.shape),
+            'tf-idf': csr_matrix((tf * idf, *structure), shape=occurrences.shape)
+        }
+
+    def group(self, level, name=None):
+        # Row of a board (name), topic ((board, title)) or post (index) in the scores of its level
+        if level == 'board':
+            return self.boards.index(name)
+        if level == 'topic':
+            return self._topic_index[tuple(name)]
+        return name or 0
+
+    def best_terms(self, level, name, key='tf-idf', n=100, exclude=(), only=None, start=None, end=None, closed=True):
+        ## [(term, {'occurrences', 'in_docs', 'tf', 'idf', 'tf-idf'}), ...] of a group, best `key` first ##
+        scores = self.scores(level, start, end, closed)
+        row = self.group(level, name)
+        start, end = scores['occurrences'].indptr[row], scores['occurrences'].indptr[row + 1]
+        term_ids = scores['occurrences'].indices[start:end]
+        exclude, only = set(exclude), (None if only is None else set(only))
+        keep = np.array([self.terms[term] not in exclude and (only is None or self.terms[term] in only) for term in term_ids], dtype=bool)
+        values = {field: matrix.data[start:end][keep] for field, matrix in scores.items()}
+        term_ids = term_ids[keep]
+        best = np.argsort(-values[key], kind='stable')[:n]
+        return [(self.terms[term_ids[i]], {field: values[field][i].item() for field in values}) for i in best]
+
+    def save(self, path='analysis_matrix.npz'):
+        counts = self.counts()
+        meta = {'terms': self.terms, 'boards': self.boards, 'topics': self.topics, 'board_words': self.board_words}
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'wb') as file:
+            np.savez_compressed(file, data=counts.data, indices=counts.indices, indptr=counts.indptr, doc_topic=np.frombuffer(self._doc_topic, dtype=np.int32),
+                                last_edit=np.frombuffer(self._last_edit, dtype=np.float64), words=np.frombuffer(self._words, dtype=np.int64), time_order=self.time_order(),
+                                meta=np.frombuffer(json.dumps(meta).encode('utf-8'), dtype=np.uint8))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path='analysis_matrix.npz'):
+        matrix = cls()
+        with np.load(path) as npz:
+            meta = json.loads(npz['meta'].tobytes())
+            matrix.terms, matrix.boards, matrix.topics, matrix.board_words = meta['terms'], meta['boards'], meta['topics'], meta['board_words']
+            matrix._vocabulary = {term: term_id for term_id, term in enumerate(matrix.terms)}
+            matrix._topic_index = {(matrix.boards[topic['board']], topic['title']): index for index, topic in enumerate(matrix.topics)}
+            matrix._doc_topic = array('i', npz['doc_topic'].astype(np.int32).tobytes())
+            matrix._indptr = array('q', npz['indptr'].astype(np.int64).tobytes())
+            matrix._indices = array('i', npz['indices'].astype(np.int32).tobytes())
+            matrix._data = array('i', npz['data'].astype(np.int32).tobytes())
+            # Matrices saved before the time index: posts have no last_edit, and their counted terms as nb of words
+            if 'last_edit' in npz.files:
+                matrix._last_edit = array('d', npz['last_edit'].astype(np.float64).tobytes())
+                matrix._words = array('q', npz['words'].astype(np.int64).tobytes())
+                matrix._time_order = npz['time_order']
+            else:
+                matrix._last_edit = array('d', np.full(len(matrix._doc_topic), np.nan).tobytes())
+                matrix._words = array('q', np.asarray(matrix.counts().sum(axis=1)).ravel().astype(np.int64).tobytes())
+        return matrix
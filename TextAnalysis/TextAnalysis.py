@@ -1,17 +1,45 @@
-from signal import signal, SIGINT
+from signal import signal, SIGINT, SIG_IGN
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
 from spacy.matcher import Matcher
+from Scraper.JsonLines import load_tree
+from Scraper.PostTable import PostTable
+from Scraper.Records import ContentReader
+from TextAnalysis.TermMatrix import TermMatrix
+from TextAnalysis.DocCache import DocCache
+from TextAnalysis.AnalysisState import AnalysisState
+from itertools import islice
+import bisect
+import numpy as np
 import cursor
 import spacy
 import json
-import math
 import os
 
 
 class Analyzer:
-    def __init__(self, model='en_core_web_sm'):
-        cursor.hide()
+    def __init__(self, model='en_core_web_sm', single_pass=False, batch_size=256, interactive=True, doc_cache='doc_cache.sqlite'):
+        ## Pool workers don't touch the terminal ##
+        self._interactive = interactive
+        if interactive:
+            cursor.hide()
+        self._model = model
+        self._pool = None
+        ## Single pass: n-grams are matched on the lemmas of the piped docs, instead of running the pipeline again on the lemmatized text of each post ##
+        ## Faster, but not the same results: POS tags come from the original text, not from the lemmatized one, so some n-grams differ (off by default) ##
+        self._single_pass = single_pass
+        self._batch_size = batch_size
+        ## Doc cache: posts tagged by a previous run (same text, same model) are read back instead of going through the pipeline (None: no cache) ##
+        self._doc_cache = doc_cache
+        self._docs = None
+        self._new_docs = []
+        self._cached_docs = 0
+        self._tagged_docs = 0
         self._data = None
+        self._table = None
+        self._terms = None
+        self._contents = ContentReader()
         self._rules = [
             # bi-grams
             [{'LOWER': 'the'}, {'POS': 'NOUN'}],
@@ -33,15 +61,17 @@ class Analyzer:
         ]
         with open('WORDS/ignore.json', 'r') as file:
             self._ignore = json.load(file)['ignore']
+        # Only the tagger / lemmatizer are used (POS and lemmas): the dependency parser and the named entity recognizer are not loaded
         try:
-            self._nlp = spacy.load(model)
+            self._nlp = spacy.load(model, disable=['parser', 'ner'])
         except Exception:
             try:
                 os.system(f'python -m spacy download {model}')
-                self._nlp = spacy.load(model)
+                self._nlp = spacy.load(model, disable=['parser', 'ner'])
             except Exception:
                 raise Exception('Spacy error: try to install requirements.txt\nSee https://github.com/BobyCow/BitcoinTalk for more instructions')
-        print()
+        if interactive:
+            print()
 
     @staticmethod
     def exit(sig=None, frame=None):
@@ -70,105 +100,426 @@ class Analyzer:
         except:
             return False
 
-    def load_data(self, json_path='raw_BitcoinTalk-data.json'):
+    def load_data(self, json_path='raw_BitcoinTalk-data.json', mirror='BitcoinTalk-Forum'):
         self._message(f'Loading data from {json_path}...')
         start = datetime.now()
-        with open(json_path, 'r', encoding='utf-8', buffering=2000) as file:
-            self._data = json.load(file)
+        # Contents of lazy posts are read from the pages of the mirror
+        self._contents = ContentReader(mirror)
+        # Columnar post table: columns are read when they are used
+        if json_path.endswith('.npz'):
+            self._table = PostTable(json_path)
+        # Streaming output of the scraper (one record per post)
+        elif json_path.endswith('.jsonl') or json_path.endswith('.jsonl.gz'):
+            self._data = load_tree(json_path)
+        else:
+            with open(json_path, 'r', encoding='utf-8', buffering=2000) as file:
+                self._data = json.load(file)
         self._message(f'Data extracted in {datetime.now() - start}\n')
 
-    def _is_token_valid(self, token):
+    def _is_token_valid(self, token, text=None):
+        # `text`: what the token reads as (its lemma in a single pass, where the tokens of the lemmatized text are not built)
+        text = token.text if text is None else text
         if not token.is_punct \
            and not token.is_stop \
            and not token.pos_ == 'SPACE' \
            and not token.pos_ == 'X' \
            and not self._is_num(token.lemma_) \
-           and (len(token.text) > 1 and token.pos_ != 'SYM') \
-           and (token.text not in self._ignore and token.lemma_ not in self._ignore):
+           and (len(text) > 1 and token.pos_ != 'SYM') \
+           and (text not in self._ignore and token.lemma_ not in self._ignore):
            # and token.lemma_ in self._nlp.vocab: # If you only want words that are in the english NLP vocabulary
             return True
         return False
 
-    def full_scan(self):
-        if not self._data:
+    def _board_names(self):
+        if self._table is not None:
+            return list(self._table.boards)
+        return [key for key in self._data.keys() if type(self._data[key]) == dict]
+
+    def _topic_names(self, boardname):
+        ## Titles of all the topics of a board, without reading their posts ##
+        if self._table is not None:
+            return {self._table.topics[index]['title'] for index in self._table.board_topics(boardname)}
+        return set(self._data[boardname].keys())
+
+    def _topic_posts(self, boardname):
+        ## (topic name, nb of pages, last_edit of its posts, function reading the contents of some of its posts (by post id)) of each topic of a board ##
+        if self._table is not None:
+            for index in self._table.board_topics(boardname):
+                topic = self._table.topics[index]
+                rows = self._table.topic_rows(index)
+                yield topic['title'], topic['total_pages'], self._table['last_edit'][rows].tolist(), lambda post_ids, rows=rows: self._table.texts('raw_content', rows[post_ids])
+            return
+        for topicname, topic in self._data[boardname].items():
+            posts = [post for page in range(1, topic['total_pages'] + 1) for post in topic[str(page)]['posts']]
+            yield topicname, topic['total_pages'], [post['last_edit'] for post in posts], lambda post_ids, posts=posts: [self._contents.get(posts[post_id]) for post_id in post_ids]
+
+    def _init_matcher(self):
+        self._matcher = Matcher(self._nlp.vocab)
+        self._matcher.add('rules', self._lemma_rules(self._rules) if self._single_pass else self._rules)
+
+    def full_scan(self, workers=1, max_topics=400, json_output=True):
+        # workers > 1: topics are analyzed by a pool of processes (one model per process), results are merged in the order of the topics
+        # max_topics: nb of topics analyzed per board (None: all of them)
+        # The term counts of every post are saved in analysis_matrix.npz (see TermMatrix), json_output=False only saves this file
+        if not self._data and self._table is None:
             raise Exception('self._data is None')
-        self.boards = {key: {} for key in self._data.keys() if type(self._data[key]) == dict}
+        self.boards = {key: {} for key in self._board_names()}
         self._message(f'Boards: {self.boards}\n')
         self.topicnames = {}
-        self._matcher = Matcher(self._nlp.vocab)
-        self._matcher.add('rules', self._rules)
-        for boardname in self.boards.keys():
-            print(f'------------------ {boardname} ------------------'.center(200))
-            self.boards[boardname]['metadata'] = {'nb_of_words': 0, 'nb_of_documents': 0}
-            self.topicnames[boardname] = [topicname for topicname in self._data[boardname].keys()]
-            for topicname in self.topicnames[boardname][:400]: # add [:100] if you want this function to full_scan only the first 100 topics
-                pages = self._data[boardname][topicname]['total_pages']
-                self._message(f"|{boardname}|{topicname.center(100)} ({pages} page{'' if pages == 1 else 's'})")
-                texts = [post['raw_content'].lower() for page in range(1, pages + 1) for post in self._data[boardname][topicname][str(page)]['posts']]
-                self.boards[boardname][topicname] = {'words': {}, 'metadata': {'nb_of_words': 0, 'nb_of_documents': len(texts)}}
-                self.boards[boardname]['metadata']['nb_of_documents'] += len(texts)
-                for doc, post_id in zip(self._nlp.pipe(texts), range(0, len(texts))):
-                    self._process_analysis(boardname, topicname, doc, post_id)
+        self._terms = TermMatrix()
+        self._init_matcher()
+        self._cached_docs, self._tagged_docs = 0, 0
+        if self._doc_cache:
+            self._docs = DocCache(self._doc_cache, self._nlp)
+        if workers > 1:
+            self._pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(self._model, self._single_pass, self._batch_size, self._doc_cache))
+        try:
+            for boardname in self.boards.keys():
+                print(f'------------------ {boardname} ------------------'.center(200))
+                self.boards[boardname]['metadata'] = {'nb_of_words': 0, 'nb_of_documents': 0}
+                self.topicnames[boardname] = []
+                if self._pool:
+                    self._scan_board_pool(boardname, workers, max_topics)
+                else:
+                    self._scan_board(boardname, max_topics)
+                print()
+        finally:
+            if self._pool:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+            if self._docs:
+                self._save_docs()
+                self._docs.close()
+                self._docs = None
+                print(f"{self._cached_docs} post{'s' if self._cached_docs > 1 else ''} from the doc cache, {self._tagged_docs} tagged")
+        for boardname, topicnames in self.topicnames.items():
+            for topicname in topicnames:
+                self._terms.set_nb_of_words(boardname, topicname, self.boards[boardname][topicname]['metadata']['nb_of_words'], self.boards[boardname]['metadata']['nb_of_words'])
+        self._terms.save('analysis_matrix.npz')
+        if json_output:
+            self._save_json(self.boards, 'analysis_results.json')
+            self._save_json(self.boards, 'raw_analysis_results.json', indent=None)
+
+    def update(self, state_path='analysis_state.sqlite', max_topics=None, json_output=False, matrix_output=False):
+        ## Incremental analysis: only the posts that are new, or edited since the last update (other last_edit), are analyzed ##
+        # Results are kept in `state_path` (see AnalysisState), self.boards only contains the topics updated by this run
+        # json_output / matrix_output: also write analysis_results.json / analysis_matrix.npz with all the stored results
+        if not self._data and self._table is None:
+            raise Exception('self._data is None')
+        start = datetime.now()
+        state = AnalysisState(state_path, {'model': self._model, 'version': self._nlp.meta.get('version'), 'single_pass': self._single_pass, 'rules': self._rules, 'ignore': self._ignore})
+        self.boards = {}
+        self.topicnames = {}
+        self._terms = None
+        self._init_matcher()
+        self._cached_docs, self._tagged_docs = 0, 0
+        if self._doc_cache:
+            self._docs = DocCache(self._doc_cache, self._nlp)
+        analyzed = 0
+        try:
+            for boardname in self._board_names():
+                print(f'------------------ {boardname} ------------------'.center(200))
+                analyzed += self._update_board(state, boardname, max_topics)
+                print()
+            for boardname in set(state.boards()) - set(self._board_names()):
+                state.remove_board(boardname)
+                self._message(f'|{boardname}| (removed)')
+            if json_output:
+                boards = state.to_tree()
+                self._save_json(boards, 'analysis_results.json')
+                self._save_json(boards, 'raw_analysis_results.json', indent=None)
+            if matrix_output:
+                self._terms = state.term_matrix()
+                self._terms.save('analysis_matrix.npz')
+        finally:
+            state.close()
+            if self._docs:
+                self._save_docs()
+                self._docs.close()
+                self._docs = None
+        self._message(f"{analyzed} post{'s' if analyzed > 1 else ''} analyzed in {datetime.now() - start}")
+
+    def _update_board(self, state, boardname, max_topics):
+        process = self._process_lemmas if self._single_pass else self._process_analysis
+        self.boards[boardname] = {'metadata': state.board(boardname)}
+        self.topicnames[boardname] = []
+        metadata = self.boards[boardname]['metadata']
+        seen = state.seen_posts(boardname)
+        analyzed = 0
+        for topicname, pages, last_edits, read in islice(self._topic_posts(boardname), max_topics):
+            known = seen.get(topicname, {})
+            changed = [post_id for post_id, last_edit in enumerate(last_edits) if known.get(post_id) != last_edit]
+            removed = [post_id for post_id in known if post_id >= len(last_edits)]
+            if topicname in seen and not changed and not removed:
+                continue
+            self.topicnames[boardname].append(topicname)
+            self._message(f"|{boardname}|{topicname.center(100)} ({len(changed)} post{'' if len(changed) == 1 else 's'} to analyze)")
+            topic = state.topic(boardname, topicname) or {'words': {}, 'metadata': {'nb_of_words': 0, 'nb_of_documents': 0}}
+            self.boards[boardname][topicname] = topic
+            # Counts of the previous version of edited posts (and of removed posts) are taken out of the results
+            for post_id, (nb_of_words, counts) in state.post_counts(boardname, topicname, [post_id for post_id in changed if post_id in known] + removed).items():
+                self._remove_words(boardname, topicname, counts, post_id)
+                metadata['nb_of_words'] -= nb_of_words
+            metadata['nb_of_documents'] += len(last_edits) - topic['metadata']['nb_of_documents']
+            topic['metadata']['nb_of_documents'] = len(last_edits)
+            # As in a full scan, the nb of words of a topic is the one set by its last post
+            topic_words = topic['metadata']['nb_of_words']
+            posts = []
+            for doc, post_id in self._tag(zip((text.lower() for text in read(changed)), changed)):
+                counts, nb_of_words = self._process_post(process, boardname, topicname, doc, post_id)
+                posts.append((post_id, last_edits[post_id], nb_of_words, counts))
+            if len(last_edits) - 1 not in changed:
+                topic['metadata']['nb_of_words'] = topic_words
+            self._compute_tfidf(boardname, topicname)
+            state.save_topic(boardname, topicname, topic, posts, removed)
+            analyzed += len(posts)
+            if len(self._new_docs) >= 1000:
+                self._save_docs()
+        # Topics that are not in the dataset anymore (deleted, or renamed: the new title is a new topic) are removed, as they are not in a full scan
+        # Topics beyond max_topics are still in the dataset: they are kept
+        for topicname in seen.keys() - self._topic_names(boardname):
+            nb_of_documents, nb_of_words = state.remove_topic(boardname, topicname)
+            metadata['nb_of_documents'] -= nb_of_documents
+            metadata['nb_of_words'] -= nb_of_words
+            self._message(f'|{boardname}|{topicname.center(100)} (removed)')
+        state.save_board(boardname, metadata)
+        return analyzed
+
+    def _start_topic(self, boardname, topicname, pages, nb_of_documents):
+        self.topicnames[boardname].append(topicname)
+        self._message(f"|{boardname}|{topicname.center(100)} ({pages} page{'' if pages == 1 else 's'})")
+        self.boards[boardname][topicname] = {'words': {}, 'metadata': {'nb_of_words': 0, 'nb_of_documents': nb_of_documents}}
+        self.boards[boardname]['metadata']['nb_of_documents'] += nb_of_documents
+
+    def _scan_board(self, boardname, max_topics):
+        ## Posts of all the topics of the board go through one batched pipe, a topic is complete when the docs of the next one start ##
+        process = self._process_lemmas if self._single_pass else self._process_analysis
+        topicname = None
+        for doc, (name, post_id, last_edit) in self._tag(self._board_posts(boardname, max_topics)):
+            if topicname is not None and name != topicname:
                 self._compute_tfidf(boardname, topicname)
-            print()
-        self._save_json(self.boards, 'analysis_results.json')
-        self._save_json(self.boards, 'raw_analysis_results.json', indent=None)
+            topicname = name
+            if len(self._new_docs) >= 1000:
+                self._save_docs()
+            counts, nb_of_words = self._process_post(process, boardname, topicname, doc, post_id)
+            self._terms.add_document(boardname, topicname, counts, last_edit, nb_of_words)
+        if topicname is not None:
+            self._compute_tfidf(boardname, topicname)
+
+    def _pipe(self, items):
+        ## (doc, context) of each (text, context), as nlp.pipe(as_tuples=True): only the texts that are not in the doc cache are tagged ##
+        if self._docs is None:
+            yield from self._nlp.pipe(items, as_tuples=True, batch_size=self._batch_size)
+            return
+        items = iter(items)
+        while True:
+            batch = list(islice(items, self._batch_size))
+            if not batch:
+                return
+            keys = [self._docs.key(text) for text, _ in batch]
+            docs = self._docs.get_many(keys)
+            missing = [index for index, key in enumerate(keys) if key not in docs]
+            self._cached_docs += len(batch) - len(missing)
+            self._tagged_docs += len(missing)
+            for index, doc in zip(missing, self._nlp.pipe([batch[index][0] for index in missing], batch_size=self._batch_size)):
+                docs[keys[index]] = doc
+                self._new_docs.append((keys[index], self._docs.serialize(doc)))
+            for key, (_, context) in zip(keys, batch):
+                yield docs[key], context
+
+    def _tag(self, items):
+        ## (doc, context) of each (text, context) given to the processing of the posts: the piped docs in a single pass, and in two passes the
+        ## docs of their lemmatized texts, which go through the pipe again (batched, and read from the doc cache like the posts) ##
+        docs = self._pipe(items)
+        if self._single_pass:
+            return docs
+        return self._pipe((' '.join([token.lemma_ for token in doc]).replace(' / ', '/'), context) for doc, context in docs)
+
+    def _save_docs(self):
+        if self._docs and self._new_docs:
+            self._docs.put(self._new_docs)
+        self._new_docs = []
+
+    def _process_post(self, process, boardname, topicname, doc, post_id):
+        # (term counts, nb of words) of a post
+        board_words = self.boards[boardname]['metadata']['nb_of_words']
+        counts = process(boardname, topicname, doc, post_id)
+        return counts, self.boards[boardname]['metadata']['nb_of_words'] - board_words
+
+    def _board_posts(self, boardname, max_topics):
+        ## (lowercased text, (topic name, post id, last_edit)) of the posts of a board ##
+        for topicname, pages, last_edits, read in islice(self._topic_posts(boardname), max_topics):
+            self._start_topic(boardname, topicname, pages, len(last_edits))
+            for post_id, (text, last_edit) in enumerate(zip(read(range(len(last_edits))), last_edits)):
+                yield text.lower(), (topicname, post_id, last_edit)
+
+    def _scan_board_pool(self, boardname, workers, max_topics):
+        ## Topics are sent to the workers as they are read, at most 4 per worker are waiting (their texts are in memory until then) ##
+        pending = deque()
+        for topicname, pages, last_edits, read in islice(self._topic_posts(boardname), max_topics):
+            pending.append((topicname, pages, last_edits, self._pool.submit(_analyze_topic, boardname, topicname, read(range(len(last_edits))))))
+            if len(pending) >= workers * 4:
+                self._merge_topic(boardname, *pending.popleft())
+        while pending:
+            self._merge_topic(boardname, *pending.popleft())
+
+    def _merge_topic(self, boardname, topicname, pages, last_edits, future):
+        topic, nb_of_words, posts, new_docs = future.result()
+        nb_of_documents = len(last_edits)
+        # Docs tagged by the worker are written by the parent
+        if self._docs:
+            self._cached_docs += nb_of_documents - len(new_docs)
+            self._tagged_docs += len(new_docs)
+            self._new_docs += new_docs
+            if len(self._new_docs) >= 1000:
+                self._save_docs()
+        self._start_topic(boardname, topicname, pages, nb_of_documents)
+        self.boards[boardname][topicname] = topic
+        for (counts, post_words), last_edit in zip(posts, last_edits):
+            self._terms.add_document(boardname, topicname, counts, last_edit, post_words)
+        self.boards[boardname]['metadata']['nb_of_words'] += nb_of_words
 
-    def _process_analysis(self, boardname, topicname, doc, post_id):
-        lemmatized_doc = self._nlp(' '.join([token.lemma_ for token in doc]).replace(' / ', '/'))
+    @staticmethod
+    def _lemma_rules(rules):
+        # The two-pass rules match the text of the lemmatized doc: in a single pass, the same patterns match the lemmas of the doc
+        return [[{'LEMMA' if attr in ('LOWER', 'TEXT') else attr: value for attr, value in token.items()} for token in rule] for rule in rules]
+
+    @staticmethod
+    def _count(counts, word):
+        counts[word] = counts.get(word, 0) + 1
+
+    def _add_words(self, boardname, topicname, counts, post_id):
+        ## Words of a post are counted before being added: the post is appended once to in_docs, without searching the list ##
+        words = self.boards[boardname][topicname]['words']
+        for word, count in counts.items():
+            if word not in words:
+                words[word] = {'occurrences': count, 'in_docs': [post_id]}
+            else:
+                words[word]['occurrences'] += count
+                # Posts are added in order, except edited posts of an incremental update
+                if words[word]['in_docs'][-1] < post_id:
+                    words[word]['in_docs'].append(post_id)
+                else:
+                    bisect.insort(words[word]['in_docs'], post_id)
+        return counts
+
+    def _remove_words(self, boardname, topicname, counts, post_id):
+        words = self.boards[boardname][topicname]['words']
+        for word, count in counts.items():
+            words[word]['occurrences'] -= count
+            words[word]['in_docs'].remove(post_id)
+            if not words[word]['in_docs']:
+                del words[word]
+
+    def _process_lemmas(self, boardname, topicname, doc, post_id):
+        ## Same counts as _process_analysis, the lemmatized text is only rebuilt as strings ##
+        lemmas = [token.lemma_ for token in doc]
+        ngrams = [' '.join(lemmas[start:end]).replace(' / ', '/') for _, start, end in self._matcher(doc)]
+        nb_of_words = len(' '.join(lemmas).replace(' / ', '/').split(' '))
+        self.boards[boardname]['metadata']['nb_of_words'] += nb_of_words
+        self.boards[boardname][topicname]['metadata']['nb_of_words'] = nb_of_words
+        counts = {}
+        for ngram in ngrams:
+            self._count(counts, ngram)
+        for token, lemma in zip(doc, lemmas):
+            self.boards[boardname]['metadata']['nb_of_words'] += 1
+            self.boards[boardname][topicname]['metadata']['nb_of_words'] += 1
+            if self._is_token_valid(token, lemma):
+                self._count(counts, lemma)
+        return self._add_words(boardname, topicname, counts, post_id)
+
+    def _process_analysis(self, boardname, topicname, lemmatized_doc, post_id):
+        # lemmatized_doc: the lemmatized text of the post, tagged by the second pass of _tag
         matches = self._matcher(lemmatized_doc)
         ngrams = [lemmatized_doc[start:end].text for _, start, end in matches]
         nb_of_words = len(lemmatized_doc.text.split(' '))
         self.boards[boardname]['metadata']['nb_of_words'] += nb_of_words
         self.boards[boardname][topicname]['metadata']['nb_of_words'] = nb_of_words
+        counts = {}
         for ngram in ngrams:
-            if ngram not in self.boards[boardname][topicname]['words']:
-                self.boards[boardname][topicname]['words'][ngram] = {'occurrences': 1, 'in_docs': [post_id]}
-            else:
-                self.boards[boardname][topicname]['words'][ngram]['occurrences'] += 1
-                if post_id not in self.boards[boardname][topicname]['words'][ngram]['in_docs']:
-                    self.boards[boardname][topicname]['words'][ngram]['in_docs'].append(post_id)
+            self._count(counts, ngram)
         for token in lemmatized_doc:
             self.boards[boardname]['metadata']['nb_of_words'] += 1
             self.boards[boardname][topicname]['metadata']['nb_of_words'] += 1
             if self._is_token_valid(token):
-                if token.lemma_ not in self.boards[boardname][topicname]['words']:
-                    self.boards[boardname][topicname]['words'][token.lemma_] = {'occurrences': 1, 'in_docs': [post_id]}
-                else:
-                    self.boards[boardname][topicname]['words'][token.lemma_]['occurrences'] += 1
-                    if post_id not in self.boards[boardname][topicname]['words'][token.lemma_]['in_docs']:
-                        self.boards[boardname][topicname]['words'][token.lemma_]['in_docs'].append(post_id)
+                self._count(counts, token.lemma_)
+        return self._add_words(boardname, topicname, counts, post_id)
 
     def _compute_tfidf(self, boardname, topicname):
-        for word in self.boards[boardname][topicname]['words'].keys():
-            tf = self.boards[boardname][topicname]['words'][word]['occurrences'] / self.boards[boardname][topicname]['metadata']['nb_of_words']
-            idf = math.log(self.boards[boardname][topicname]['metadata']['nb_of_documents'] / len(self.boards[boardname][topicname]['words'][word]['in_docs']))
-            tf_idf = tf * idf
-            self.boards[boardname][topicname]['words'][word]['tf'] = tf
-            self.boards[boardname][topicname]['words'][word]['idf'] = idf
-            self.boards[boardname][topicname]['words'][word]['tf-idf'] = tf_idf
+        ## tf / idf of all the words of the topic as arrays ##
+        words = self.boards[boardname][topicname]['words']
+        metadata = self.boards[boardname][topicname]['metadata']
+        occurrences = np.fromiter((word['occurrences'] for word in words.values()), dtype=np.float64, count=len(words))
+        in_docs = np.fromiter((len(word['in_docs']) for word in words.values()), dtype=np.float64, count=len(words))
+        tf = occurrences / metadata['nb_of_words']
+        idf = np.log(metadata['nb_of_documents'] / in_docs)
+        for word, values in zip(words.values(), zip(tf.tolist(), idf.tolist(), (tf * idf).tolist())):
+            word['tf'], word['idf'], word['tf-idf'] = values
         self.boards[boardname][topicname]['words'] = dict(sorted(self.boards[boardname][topicname]['words'].items(), key=lambda x: x[1]['occurrences'], reverse=True))
 
-    def temporal_scan(self, timestamp1, timestamp2, list_of_words=None, board_to_process='all'):
-        posts_to_scan = []
-        list_of_boards = [key for key in self._data.keys() if key != 'available_boards']
-        boardnames = [board_to_process] if board_to_process in list_of_boards else list_of_boards
-        for boardname in boardnames:
-            for topicname in self._data[boardname].keys():
-                pages = [self._data[boardname][topicname][str(page_nb)] for page_nb in range(1, self._data[boardname][topicname]['total_pages'] + 1)]
-                for page in pages:
-                    for post in page['posts']:
-                        if timestamp1 <= post['last_edit'] <= timestamp2:
-                            posts_to_scan.append({
-                                'board': boardname,
-                                'topic': topicname,
-                                'post': post
-                            })
+    def load_matrix(self, matrix_path='analysis_matrix.npz'):
+        # Term counts of every post, saved by full_scan / update(matrix_output=True)
+        if not os.path.exists(matrix_path):
+            raise Exception(f'No {matrix_path}: run full_scan() or update(matrix_output=True) first')
+        self._terms = TermMatrix.load(matrix_path)
+
+    def _window(self, start, end, list_of_words, board_to_process, nb_to_show, key, closed=True):
+        level, name = ('board', board_to_process) if board_to_process in self._terms.boards else ('corpus', None)
+        return {
+            'start': start,
+            'end': end,
+            'posts': len(self._terms.rows_between(start, end, closed, name if level == 'board' else None)),
+            'words': self._terms.best_terms(level, name, key, nb_to_show, only=list_of_words, start=start, end=end, closed=closed)
+        }
+
+    def temporal_scan(self, timestamp1, timestamp2, list_of_words=None, board_to_process='all', nb_to_show=100, key='tf-idf'):
+        ## Occurrences / tf / idf / tf-idf of the words of the posts edited between two timestamps (included) ##
+        # Posts are found in the time index of the term matrix and their term counts are reused: nothing is analyzed again
+        # board_to_process: 'all' (or an unknown board) for every board, words are sorted by `key` (only list_of_words if given)
+        if self._terms is None:
+            self.load_matrix()
+        return self._window(timestamp1, timestamp2, list_of_words, board_to_process, nb_to_show, key)
+
+    def rolling_scan(self, width, step=None, start=None, end=None, list_of_words=None, board_to_process='all', nb_to_show=100, key='tf-idf'):
+        ## temporal_scan of windows of `width` seconds every `step` seconds (default: consecutive windows), from start to end (default: first and last posts) ##
+        if self._terms is None:
+            self.load_matrix()
+        return [self._window(window_start, window_end, list_of_words, board_to_process, nb_to_show, key, closed=False)
+                for window_start, window_end in self._terms.windows(width, step, start, end)]
+
+
+## Process pool workers: one Analyzer (spaCy model + matcher) per process, each call returns the analysis of a whole topic ##
+_worker = None
+
+
+def _init_worker(model, single_pass, batch_size, doc_cache):
+    global _worker
+    # Ctrl+C is handled by the parent
+    signal(SIGINT, SIG_IGN)
+    _worker = Analyzer(model, single_pass, batch_size, interactive=False, doc_cache=None)
+    _worker._init_matcher()
+    # Workers only read the doc cache, docs they tag are sent back to the parent
+    if doc_cache:
+        _worker._docs = DocCache(doc_cache, _worker._nlp, readonly=True)
+
+
+def _analyze_topic(boardname, topicname, texts):
+    # Same processing as a serial scan, on a board that only contains this topic
+    _worker.boards = {boardname: {'metadata': {'nb_of_words': 0, 'nb_of_documents': len(texts)}, topicname: {'words': {}, 'metadata': {'nb_of_words': 0, 'nb_of_documents': len(texts)}}}}
+    process = _worker._process_lemmas if _worker._single_pass else _worker._process_analysis
+    posts = [_worker._process_post(process, boardname, topicname, doc, post_id) for doc, post_id in _worker._tag((text.lower(), post_id) for post_id, text in enumerate(texts))]
+    _worker._compute_tfidf(boardname, topicname)
+    new_docs, _worker._new_docs = _worker._new_docs, []
+    return _worker.boards[boardname][topicname], _worker.boards[boardname]['metadata']['nb_of_words'], posts, new_docs
 
 
 if __name__ == '__main__':
     a = Analyzer()
     signal(SIGINT, a.exit)
     a.load_data()
-    a.temporal_scan(1315539975.0, 1367165741.0)
+    a.update(json_output=True, matrix_output=True)
+    window = a.temporal_scan(1315539975.0, 1367165741.0, nb_to_show=20)
+    print(f"{window['posts']} posts between {datetime.fromtimestamp(window['start'])} and {datetime.fromtimestamp(window['end'])}")
+    for word, scores in window['words']:
+        print(f"{word.ljust(30)} {scores['occurrences']:>8} {scores['tf-idf']:.6f}")
     a.exit()
\ No newline at end of file
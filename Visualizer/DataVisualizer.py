@@ -1,5 +1,9 @@
 import matplotlib.pyplot as plt
 from datetime import datetime, timedelta
+from Scraper.PostTable import PostTable
+from Scraper.Records import ContentReader
+from TextAnalysis.FullTextIndex import FullTextIndex, phrase
+from TextAnalysis.TermMatrix import TermMatrix
 import numpy as np
 import mplcursors
 import random
@@ -12,18 +16,37 @@ class DataViz:
     def __init__(self):
         with open('WORDS/ignore.json', 'r') as file:
             self._ignore = json.load(file)['ignore']
+        self._table = None
+        self._index = None
+        self._matrix = None
+        self._contents = ContentReader()
 
     @staticmethod
     def _message(msg):
         print(f'[{datetime.now()}] {msg}')
 
-    def load_data(self, json_path='raw_analysis_results.json'):
+    def load_data(self, json_path='raw_analysis_results.json', mirror='BitcoinTalk-Forum'):
         self._message(f'Loading data from {json_path}...')
         start = datetime.now()
-        with open(json_path, 'r', encoding='utf-8', buffering=2000) as file:
-            self.boards = json.load(file)
+        # Contents of lazy posts are read from the pages of the mirror
+        self._contents = ContentReader(mirror)
+        # Columnar post table of the scraper: posts are read from its columns instead of self.boards
+        if json_path.endswith('.npz'):
+            self._table = PostTable(json_path)
+            self.boards = None
+        else:
+            with open(json_path, 'r', encoding='utf-8', buffering=2000) as file:
+                self.boards = json.load(file)
         self._message(f'Data extracted in {datetime.now() - start}\n')
 
+    def load_index(self, index_path='posts_index.sqlite'):
+        # Full-text index of the posts (python -m TextAnalysis.FullTextIndex): words are counted with SQL queries instead of scanning every post
+        self._index = FullTextIndex(index_path)
+
+    def load_matrix(self, matrix_path='analysis_matrix.npz'):
+        # Term counts saved by Analyzer.full_scan: scores of the boards are computed with sparse matrix operations
+        self._matrix = TermMatrix.load(matrix_path)
+
     def show_histogram_for_topic(self, board, topic, main_val='occurrences'):
         print(f'Histogram of: {board} / {topic}')
         nb_to_show = 50
@@ -93,6 +116,12 @@ class DataViz:
 
     def compute_word_list_from_board(self, boardname, word_list=None):
         nb_to_show = 100
+        if self._matrix is not None:
+            best_occurrences = self._matrix.best_terms('board', boardname, 'occurrences', nb_to_show, exclude=self._ignore, only=word_list)
+            best_tfidf = self._matrix.best_terms('board', boardname, 'tf-idf', nb_to_show, exclude=self._ignore, only=word_list)
+            self.show_histogram_from_list(word_list=best_occurrences, title=f'{boardname} (best occurrences)', xlegend=[word[0] for word in best_occurrences])
+            self.show_histogram_from_list(word_list=best_tfidf, title=f'{boardname} (best tf-idf)', xlegend=[word[0] for word in best_tfidf], metric='tf-idf')
+            return
         words = {}
         for topicname in [key for key in self.boards[boardname].keys() if key != 'metadata']:
             for k, v in self.boards[boardname][topicname]['words'].items():
@@ -128,8 +157,20 @@ class DataViz:
         posts = sorted(posts, key=lambda x: x['last_edit'])
         return posts
 
+    def _get_timestamps(self, board_to_process):
+        ## Sorted last_edit of the posts of a board (all boards if it doesn't exist) ##
+        if self._table is not None:
+            rows = self._table.select(board=board_to_process if board_to_process in self._table.boards else None)
+            return np.sort(self._table['last_edit'][rows])
+        return np.array([post['last_edit'] for post in self._get_posts(board_to_process)])
+
+    def _get_topic_posts(self, boardname, topicname):
+        if self._table is not None:
+            return [self._table.post(row) for row in self._table.topic_rows(self._table.find_topic(boardname, topicname))]
+        pages = [self.boards[boardname][topicname][str(page_nb)] for page_nb in range(1, self.boards[boardname][topicname]['total_pages'] + 1)]
+        return [post for page in pages for post in page['posts']]
+
     def show_posts_occurrences(self, board_to_process='all', step='month'):
-        posts = self._get_posts(board_to_process)
         date_list = {}
         date_format = '%d/%m/%Y'
         day = timedelta(days=1)
@@ -144,20 +185,21 @@ class DataViz:
             step = month
         if step == 'year':
             step = year
-        timestamp_list = [post['last_edit'] for post in posts]
+        timestamp_list = self._get_timestamps(board_to_process)
         d1 = datetime.strptime(datetime.fromtimestamp(timestamp_list[0]).strftime(date_format), date_format)
         d2 = datetime.strptime(datetime.fromtimestamp(timestamp_list[-1]).strftime(date_format), date_format)
         d = d1
         while d < d2:
             date_list[d.strftime(date_format)] = 0
             d += step
-        for t in timestamp_list:
-            for d in date_list.keys():
-                if datetime.strptime(d, date_format).timestamp() <= t < (datetime.strptime(d, date_format) + week).timestamp():
-                    date_list[d] += 1
-                    break
+        ## Each post is counted in the first date d with d <= last_edit < d + week (vectorized: dates and their ends are sorted) ##
+        starts = np.array([datetime.strptime(d, date_format).timestamp() for d in date_list.keys()])
+        ends = np.array([(datetime.strptime(d, date_format) + week).timestamp() for d in date_list.keys()])
+        first = np.searchsorted(ends, timestamp_list, side='right')
+        counted = first < len(starts)
+        counted[counted] = starts[first[counted]] <= timestamp_list[counted]
         x = [*date_list.keys()]
-        y = [*date_list.values()]
+        y = np.bincount(first[counted], minlength=len(starts)).tolist()
         plt.xticks(rotation=90)
         plt.plot(x, y)
         plt.show()
@@ -171,9 +213,11 @@ class DataViz:
         date_list = {}
         date_format = '%d/%m/%Y'
         one_week = timedelta(days=1)
-        pages = [self.boards[boardname][topicname][str(page_nb)] for page_nb in range(1, self.boards[boardname][topicname]['total_pages'] + 1)]
-        posts = sorted([post for page in pages for post in page['posts']], key=lambda x: x['last_edit'])
-        timestamp_list = [post['last_edit'] for post in posts]
+        if self._index is not None:
+            timestamp_list = self._index.time_range(board=boardname, topic=topicname)
+        else:
+            posts = sorted(self._get_topic_posts(boardname, topicname), key=lambda x: x['last_edit'])
+            timestamp_list = [post['last_edit'] for post in posts]
         d1 = datetime.strptime(datetime.fromtimestamp(timestamp_list[0]).strftime(date_format), date_format)
         d2 = datetime.strptime(datetime.fromtimestamp(timestamp_list[-1]).strftime(date_format), date_format)
         d = d1
@@ -182,13 +226,20 @@ class DataViz:
             for word in word_list:
                 date_list[d.strftime(date_format)][word] = 0
             d += one_week
-        for post in posts:
+        ## Indexed posts: one aggregate per word (posts containing the word, grouped by day) ##
+        if self._index is not None:
             for w in word_list:
-                if w in post['raw_content']:
-                    for date in date_list.keys():
-                        if datetime.strptime(date, date_format).timestamp() <= post['last_edit'] < (datetime.strptime(date, date_format) + one_week).timestamp():
-                            date_list[date][w] += 1
-                            break
+                for date, count in self._index.counts_over_time(phrase(w), date_format, board=boardname, topic=topicname).items():
+                    if date in date_list:
+                        date_list[date][w] += count
+        else:
+            for post in posts:
+                for w in word_list:
+                    if w in self._contents.get(post):
+                        for date in date_list.keys():
+                            if datetime.strptime(date, date_format).timestamp() <= post['last_edit'] < (datetime.strptime(date, date_format) + one_week).timestamp():
+                                date_list[date][w] += 1
+                                break
         with open('data.csv', 'w') as file:
             writer = csv.writer(file, dialect='excel')
             x = [*date_list.keys()]
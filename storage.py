@@ -0,0 +1,228 @@
+from utils import atomic_write
+import threading
+import mmap
+import json
+import zlib
+import os
+
+
+## Pages are stored as the raw bytes of the response (ISO-8859-1), and read back as text decoded in latin1 ##
+def decode_page(raw):
+    return raw.decode('latin1')
+
+
+class FileStorage:
+    # One html file per page: <base_path>/<board>/<topic id>/<page>.html
+    name = 'files'
+
+    def __init__(self, base_path):
+        self._base_path = base_path
+
+    def boards(self):
+        return sorted(name for name in os.listdir(self._base_path) if os.path.isdir(os.path.join(self._base_path, name)))
+
+    def has_board(self, board):
+        return os.path.isdir(os.path.join(self._base_path, board))
+
+    ## Forum page (Mining.html) and first page of each board are always loose files ##
+    def write_forum_page(self, raw):
+        atomic_write(os.path.join(self._base_path, 'Mining.html'), decode_page(raw))
+
+    def read_forum_page(self):
+        with open(os.path.join(self._base_path, 'Mining.html'), 'r', encoding='utf-8') as file:
+            return file.read()
+
+    def write_board_page(self, board, raw):
+        os.makedirs(os.path.join(self._base_path, board), exist_ok=True)
+        atomic_write(os.path.join(self._base_path, board, f'{board}.html'), decode_page(raw))
+
+    def read_board_page(self, board):
+        with open(os.path.join(self._base_path, board, f'{board}.html'), 'r', encoding='utf-8') as file:
+            return file.read()
+
+    def has_board_page(self, board):
+        return os.path.exists(os.path.join(self._base_path, board, f'{board}.html'))
+
+    ## Topic pages ##
+    def _page_path(self, board, topic_id, page_nb):
+        return os.path.join(self._base_path, board, str(topic_id), f'{page_nb}.html')
+
+    def write_page(self, board, topic_id, page_nb, raw):
+        os.makedirs(os.path.join(self._base_path, board, str(topic_id)), exist_ok=True)
+        atomic_write(self._page_path(board, topic_id, page_nb), decode_page(raw))
+
+    def read_page(self, board, topic_id, page_nb):
+        with open(self._page_path(board, topic_id, page_nb), 'r', encoding='utf-8') as file:
+            return file.read()
+
+    def read_raw_page(self, board, topic_id, page_nb):
+        # Bytes of the response: the file holds its latin1 text, read as it is (no newline translation)
+        with open(self._page_path(board, topic_id, page_nb), 'rb') as file:
+            return file.read().decode('utf-8').encode('latin1')
+
+    def has_page(self, board, topic_id, page_nb):
+        return os.path.exists(self._page_path(board, topic_id, page_nb))
+
+    def map_page(self, board, topic_id, page_nb):
+        # Bytes of the page as stored, memory-mapped: only the parts that are sliced are read
+        with open(self._page_path(board, topic_id, page_nb), 'rb') as file:
+            return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @staticmethod
+    def decode_slice(data):
+        # Html files are utf-8, and read_page translates their newlines
+        return data.decode('utf-8').replace('\r\n', '\n').replace('\r', '\n')
+
+    def stamp(self, board, topic_id, page_nb):
+        # Changes whenever the page is written again (pages are replaced atomically, so the mtime always moves)
+        stat = os.stat(self._page_path(board, topic_id, page_nb))
+        return f'{stat.st_mtime_ns}:{stat.st_size}'
+
+    def topics(self, board):
+        board_path = os.path.join(self._base_path, board)
+        names = sorted([name for name in os.listdir(board_path) if os.path.isdir(os.path.join(board_path, name))], key=self._sort_key)
+        return [int(name) if name.isdigit() else name for name in names]
+
+    def pages(self, board, topic_id):
+        topic_path = os.path.join(self._base_path, board, str(topic_id))
+        return sorted(int(name[:-len('.html')]) for name in os.listdir(topic_path) if name.endswith('.html'))
+
+    @staticmethod
+    def _sort_key(name):
+        # Topic ids are sorted numerically (directories of old mirrors, named with a sha1, are sorted after them)
+        return (0, int(name), '') if name.isdigit() else (1, 0, name)
+
+    def close(self):
+        pass
+
+
+class ArchiveStorage(FileStorage):
+    # Topic pages of a board are appended to a single compressed pack: <base_path>/<board>/pages.pack,
+    # and <base_path>/<board>/pages.idx gives the offset of each page in the pack (the last entry of a page wins)
+    name = 'archive'
+
+    def __init__(self, base_path, level=6, sync_every=50):
+        super().__init__(base_path)
+        self._level = level
+        self._sync_every = sync_every
+        self._indexes = {}
+        self._writers = {}
+        self._readers = {}
+        self._lock = threading.RLock()
+
+    def _index(self, board):
+        with self._lock:
+            if board not in self._indexes:
+                index = {}
+                idx_path = os.path.join(self._base_path, board, 'pages.idx')
+                if os.path.exists(idx_path):
+                    with open(idx_path, 'r', encoding='utf-8') as file:
+                        for line in file:
+                            try:
+                                topic_id, page_nb, offset, length = [int(value) for value in line.split()]
+                            except ValueError:
+                                # Last line can be truncated if the program was killed while writing it
+                                continue
+                            index[(topic_id, page_nb)] = (offset, length)
+                self._indexes[board] = index
+            return self._indexes[board]
+
+    def write_page(self, board, topic_id, page_nb, raw):
+        data = zlib.compress(raw, self._level)
+        with self._lock:
+            index = self._index(board)
+            if board not in self._writers:
+                os.makedirs(os.path.join(self._base_path, board), exist_ok=True)
+                self._writers[board] = {
+                    'pack': open(os.path.join(self._base_path, board, 'pages.pack'), 'ab'),
+                    'idx': open(os.path.join(self._base_path, board, 'pages.idx'), 'a', encoding='utf-8'),
+                    'unsynced': 0
+                }
+            writer = self._writers[board]
+            offset = writer['pack'].seek(0, os.SEEK_END)
+            # The page is written before its index entry: an interruption can leave unused bytes in the pack, never a broken entry
+            writer['pack'].write(data)
+            writer['pack'].flush()
+            writer['idx'].write(f'{int(topic_id)} {page_nb} {offset} {len(data)}\n')
+            writer['idx'].flush()
+            index[(int(topic_id), page_nb)] = (offset, len(data))
+            writer['unsynced'] += 1
+            if writer['unsynced'] >= self._sync_every:
+                self._sync(writer)
+
+    def read_raw_page(self, board, topic_id, page_nb):
+        with self._lock:
+            offset, length = self._index(board)[(int(topic_id), page_nb)]
+            if board not in self._readers:
+                self._readers[board] = open(os.path.join(self._base_path, board, 'pages.pack'), 'rb')
+            reader = self._readers[board]
+            reader.seek(offset)
+            data = reader.read(length)
+        return zlib.decompress(data)
+
+    def read_page(self, board, topic_id, page_nb):
+        return decode_page(self.read_raw_page(board, topic_id, page_nb))
+
+    def has_page(self, board, topic_id, page_nb):
+        return (int(topic_id), page_nb) in self._index(board)
+
+    def map_page(self, board, topic_id, page_nb):
+        # Packed pages are compressed as a whole
+        return self.read_raw_page(board, topic_id, page_nb)
+
+    @staticmethod
+    def decode_slice(data):
+        return decode_page(data)
+
+    def stamp(self, board, topic_id, page_nb):
+        # A new version of a page is appended to the pack, at a new offset
+        offset, length = self._index(board)[(int(topic_id), page_nb)]
+        return f'{offset}:{length}'
+
+    def topics(self, board):
+        return sorted({topic_id for topic_id, _ in self._index(board)})
+
+    def pages(self, board, topic_id):
+        return sorted(page_nb for tid, page_nb in self._index(board) if tid == int(topic_id))
+
+    @staticmethod
+    def _sync(writer):
+        for file in (writer['pack'], writer['idx']):
+            file.flush()
+            os.fsync(file.fileno())
+        writer['unsynced'] = 0
+
+    def close(self):
+        with self._lock:
+            for writer in self._writers.values():
+                self._sync(writer)
+                writer['pack'].close()
+                writer['idx'].close()
+            for reader in self._readers.values():
+                reader.close()
+            self._writers, self._readers = {}, {}
+
+
+BACKENDS = {
+    FileStorage.name: FileStorage,
+    ArchiveStorage.name: ArchiveStorage
+}
+
+
+def open_storage(base_path, backend=None, convert=False):
+    # The backend of a mirror is saved in <base_path>/storage.json, mirrors without it are made of loose html files
+    # `convert` switches an existing mirror to another backend (its pages have to be moved, see the 'pack' mode of the downloader)
+    config_path = os.path.join(base_path, 'storage.json')
+    current = None
+    if os.path.exists(config_path) and not convert:
+        with open(config_path, 'r', encoding='utf-8') as file:
+            current = json.load(file)['backend']
+    if backend and current and backend != current:
+        raise Exception(f"`{base_path}` already uses the '{current}' storage backend")
+    backend = backend or current or FileStorage.name
+    if backend not in BACKENDS:
+        raise Exception(f"Unknown storage backend '{backend}' (available: {', '.join(BACKENDS)})")
+    if not current and os.path.isdir(base_path):
+        with open(config_path, 'w', encoding='utf-8') as file:
+            json.dump({'backend': backend}, file)
+    return BACKENDS[backend](base_path)
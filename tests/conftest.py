@@ -0,0 +1,27 @@
+import pytest
+import shutil
+import json
+import sys
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Modules are imported from the root of the repository (`from DownloadHTML.Manifest import ...`), as when the programs are run
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture
+def analyzer(tmp_path, monkeypatch):
+    ## analyzer(data, **options): Analyzer (with the fake spaCy of tests/fake_spacy.py) that loaded `data`, run in tmp_path ##
+    from tests.fake_spacy import install
+    module = install(monkeypatch)
+    shutil.copytree(os.path.join(ROOT, 'WORDS'), tmp_path / 'WORDS')
+    monkeypatch.chdir(tmp_path)
+
+    def make(data, **options):
+        with open('dataset.json', 'w', encoding='utf-8') as file:
+            json.dump(data, file)
+        options.setdefault('doc_cache', None)
+        a = module.Analyzer(interactive=False, **options)
+        a.load_data('dataset.json')
+        return a
+    return make
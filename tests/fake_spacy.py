@@ -0,0 +1,94 @@
+import importlib
+import types
+import json
+import sys
+
+## Stand-in for spaCy in the tests: words are tokens, their lemma drops a final 's', 'the' / 'a' are stop words, words ending with 'ing' are
+## VERBs and the others NOUNs. The matcher finds the bi-grams 'the' + NOUN. Results of the analysis only depend on these rules, not on a trained model.
+
+STOP_WORDS = ('the', 'a')
+
+
+class Token:
+    def __init__(self, text):
+        self.text = text
+        self.lemma_ = text[:-1] if text.endswith('s') and len(text) > 2 else text
+        self.is_punct = not text.isalnum()
+        self.is_stop = text in STOP_WORDS
+        self.pos_ = 'VERB' if text.endswith('ing') else 'NOUN'
+
+
+class Doc(list):
+    def __getitem__(self, index):
+        # Slices are spans, with a text
+        return Doc(list.__getitem__(self, index)) if isinstance(index, slice) else list.__getitem__(self, index)
+
+    @property
+    def text(self):
+        return ' '.join(token.text for token in self)
+
+
+class Language:
+    # Nb of texts tagged by every pipeline, reset by install
+    calls = 0
+    vocab = None
+    meta = {'lang': 'en', 'name': 'fake', 'version': '0.0.0'}
+    pipe_names = ['tagger', 'lemmatizer']
+
+    def __call__(self, text):
+        Language.calls += 1
+        return Doc(Token(word) for word in text.split())
+
+    def pipe(self, items, as_tuples=False, batch_size=1):
+        for item in items:
+            Language.calls += 1
+            if as_tuples:
+                yield self(item[0]), item[1]
+            else:
+                yield self(item)
+
+
+class Matcher:
+    def __init__(self, vocab):
+        self.rules = []
+
+    def add(self, name, rules):
+        self.rules = rules
+
+    def __call__(self, doc):
+        return [(0, index, index + 2) for index in range(len(doc) - 1) if doc[index].lemma_ == 'the' and doc[index + 1].pos_ == 'NOUN']
+
+
+class DocBin:
+    def __init__(self, attrs=None):
+        self.docs = []
+
+    def add(self, doc):
+        self.docs.append([token.text for token in doc])
+
+    def to_bytes(self):
+        return json.dumps(self.docs).encode('utf-8')
+
+    def from_bytes(self, data):
+        self.docs = json.loads(data)
+        return self
+
+    def get_docs(self, vocab):
+        return (Doc(Token(word) for word in doc) for doc in self.docs)
+
+
+def install(monkeypatch):
+    ## Import TextAnalysis.TextAnalysis with the fake spaCy ##
+    Language.calls = 0
+    spacy = types.ModuleType('spacy')
+    spacy.__version__ = '0.0.0'
+    spacy.load = lambda model, disable=(): Language()
+    matcher = types.ModuleType('spacy.matcher')
+    matcher.Matcher = Matcher
+    tokens = types.ModuleType('spacy.tokens')
+    tokens.DocBin = DocBin
+    for name, module in (('spacy', spacy), ('spacy.matcher', matcher), ('spacy.tokens', tokens)):
+        monkeypatch.setitem(sys.modules, name, module)
+    for name in ('TextAnalysis.TextAnalysis', 'TextAnalysis.DocCache'):
+        monkeypatch.delitem(sys.modules, name, raising=False)
+    return importlib.import_module('TextAnalysis.TextAnalysis')
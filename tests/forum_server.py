@@ -0,0 +1,74 @@
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from time import monotonic
+import threading
+import hashlib
+import os
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'forum')
+# Links of the recorded pages point to the forum, they are served with the address of the stub server
+RECORDED_BASE = b'https://bitcointalk.org/index.php'
+
+
+class ForumServer:
+    ## Local http server answering `index.php?<query>` with the recorded page tests/fixtures/forum/<query>.html (ETag / If-None-Match supported) ##
+    def __init__(self, fixtures=FIXTURES):
+        self._fixtures = fixtures
+        # Pages changed by a test: {query: html bytes}
+        self.pages = {}
+        # (monotonic time, query) of every request
+        self.requests = []
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.base_uri = f'http://127.0.0.1:{self._server.server_address[1]}/index.php'
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def page(self, query):
+        if query in self.pages:
+            return self.pages[query]
+        path = os.path.join(self._fixtures, f'{query}.html')
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as file:
+            return file.read().replace(RECORDED_BASE, self.base_uri.encode('latin1'))
+
+    def hits(self, query=None):
+        with self._lock:
+            return [time for time, requested in self.requests if query is None or requested == query]
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                query = self.path.split('?', 1)[1] if '?' in self.path else ''
+                with server._lock:
+                    server.requests.append((monotonic(), query))
+                data = server.page(query)
+                if data is None:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                etag = f'"{hashlib.md5(data).hexdigest()}"'
+                if self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('ETag', etag)
+                self.send_header('Content-Type', 'text/html; charset=ISO-8859-1')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+        return Handler
@@ -0,0 +1,16 @@
+from tests.test_incremental_analysis import dataset
+import pytest
+import json
+
+
+@pytest.mark.parametrize('single_pass', [False, True])
+def test_analysis_workers_give_the_serial_results(analyzer, single_pass):
+    data = dataset()
+    a = analyzer(data, single_pass=single_pass)
+    a.full_scan(max_topics=None, json_output=False)
+    # Same results, in the same order (topics, words of the topics)
+    serial, serial_matrix = json.dumps(a.boards), a._terms
+    a = analyzer(data, single_pass=single_pass)
+    a.full_scan(workers=2, max_topics=None, json_output=False)
+    assert json.dumps(a.boards) == serial
+    assert (a._terms.counts() != serial_matrix.counts()).nnz == 0 and a._terms.terms == serial_matrix.terms
@@ -0,0 +1,29 @@
+from tests.fake_spacy import Language
+from tests.test_incremental_analysis import dataset, results_of
+import pytest
+import json
+
+
+@pytest.mark.parametrize('single_pass', [False, True])
+def test_second_run_tags_nothing(analyzer, single_pass):
+    data = dataset()
+    a = analyzer(data, single_pass=single_pass, doc_cache='doc_cache.sqlite')
+    a.full_scan(max_topics=None, json_output=False)
+    expected = results_of(a.boards)
+    assert Language.calls > 0
+    # Changing the ignored words doesn't tag the posts again (in two passes, neither their lemmatized texts)
+    with open('WORDS/ignore.json', 'r') as file:
+        ignore = json.load(file)
+    ignore['ignore'].append('payout')
+    with open('WORDS/ignore.json', 'w') as file:
+        json.dump(ignore, file)
+    Language.calls = 0
+    a = analyzer(data, single_pass=single_pass, doc_cache='doc_cache.sqlite')
+    a.full_scan(max_topics=None, json_output=False)
+    assert Language.calls == 0
+    assert a._tagged_docs == 0 and a._cached_docs > 0
+    # Same results as without the cache
+    results = results_of(a.boards)
+    a = analyzer(data, single_pass=single_pass)
+    a.full_scan(max_topics=None, json_output=False)
+    assert results == results_of(a.boards) and results != expected
@@ -0,0 +1,110 @@
+from DownloadHTML.DownloadHTML import BTC_Downloader
+from DownloadHTML.Manifest import Manifest
+from tests.forum_server import ForumServer
+import pytest
+import os
+
+# Recorded forum: {board: {topic id: nb of pages}}
+TOPICS = {
+    'Pools': {41000: 3, 41001: 1, 41010: 1, 41011: 2},
+    'Hardware': {76000: 2, 76001: 3}
+}
+
+
+@pytest.fixture
+def forum(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with ForumServer() as server:
+        yield server
+
+
+def run(forum, flag='standard', rate=20, max_workers=4):
+    ## One run of the downloader on the stub forum, returns whether there was something to download ##
+    bts = BTC_Downloader(f'{forum.base_uri}?board=14.0', base_path='BitcoinTalk-Forum', rate=rate, max_workers=max_workers, quiet=True)
+    if not bts.are_pages_missing(flag):
+        bts._storage.close()
+        bts._manifest.close()
+        return False
+    # The logs are displayed at the end of the download, and the program exits
+    with pytest.raises(SystemExit):
+        bts.start_downloading()
+    bts._manifest.close()
+    return True
+
+
+def stored_pages():
+    pages = set()
+    for root, _, files in os.walk('BitcoinTalk-Forum'):
+        pages |= {os.path.relpath(os.path.join(root, name), 'BitcoinTalk-Forum') for name in files if name.endswith('.html')}
+    return pages
+
+
+def test_download_layout(forum):
+    assert run(forum)
+    expected = {'Mining.html'} | {f'{board}/{board}.html' for board in TOPICS}
+    expected |= {f'{board}/{topic_id}/{page_nb}.html' for board, topics in TOPICS.items() for topic_id, pages in topics.items() for page_nb in range(1, pages + 1)}
+    assert stored_pages() == expected
+    # Pages are stored as they were served
+    with open(os.path.join('BitcoinTalk-Forum', 'Pools', '41000', '2.html'), 'r', encoding='utf-8') as file:
+        assert file.read() == forum.page('topic=41000.20').decode('latin1')
+    # Every topic page is downloaded once
+    assert all(len(forum.hits(f'topic={topic_id}.{(page_nb - 1) * 20}')) == 1
+               for topics in TOPICS.values() for topic_id, pages in topics.items() for page_nb in range(1, pages + 1))
+    assert os.path.exists(os.path.join('BitcoinTalk-Forum', 'manifest.sqlite')) and not os.path.exists(os.path.join('logs', 'journal.jsonl'))
+
+
+def test_second_run_is_in_sync(forum):
+    assert run(forum)
+    requests = len(forum.requests)
+    assert not run(forum)
+    # Only the forum page and the listings are checked
+    assert not [query for _, query in forum.requests[requests:] if query.startswith('topic=')]
+
+
+@pytest.mark.parametrize('rate', [5, 10])
+def test_rate_cap(forum, rate):
+    # Concurrent threads share the token bucket: any span of requests holds the rate (+ the burst of the bucket, + 1 for timing jitter)
+    assert run(forum, rate=rate, max_workers=8)
+    times = sorted(forum.hits())
+    assert len(times) > rate
+    for first in range(len(times)):
+        for last in range(first + 1, len(times)):
+            assert last - first + 1 <= max(1, rate) + rate * (times[last] - times[first]) + 1
+
+
+def test_board_pages_are_saved_by_the_discovery(forum):
+    assert run(forum)
+    # The first page of each board is downloaded once per run
+    assert len(forum.hits('board=41.0')) == 1 and len(forum.hits('board=76.0')) == 1
+    # A board page that changed is saved again, even when none of its topics changed
+    forum.pages['board=76.0'] = forum.page('board=76.0').replace(b'Subject', b'Subject (sorted)')
+    run(forum)
+    assert len(forum.hits('board=76.0')) == 2
+    with open(os.path.join('BitcoinTalk-Forum', 'Hardware', 'Hardware.html'), 'r', encoding='utf-8') as file:
+        assert file.read() == forum.pages['board=76.0'].decode('latin1')
+
+
+def test_validators_are_kept_with_the_stored_page(forum, monkeypatch):
+    assert run(forum)
+    # The page changed online, and the program is interrupted before it is written
+    forum.pages['topic=41001.0'] = forum.page('topic=41001.0').replace(b'</body>', b'<!-- edited --></body>')
+    bts = BTC_Downloader(f'{forum.base_uri}?board=14.0', base_path='BitcoinTalk-Forum', quiet=True)
+    link = f'{forum.base_uri}?topic=41001.0'
+    job = {'board': 'Pools', 'topic_id': Manifest.topic_id(link), 'boardpage': 1, 'boardpages': 2, 'title': 'Topic 41001', 'page': 1, 'pages': 1,
+           'uri': link, 'path': 'Pools/41001/1.html'}
+
+    def interrupted(*args):
+        raise KeyboardInterrupt
+    monkeypatch.setattr(bts._storage, 'write_page', interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        bts._download_page(job)
+    bts._validators.save()
+    bts._storage.close()
+    bts._manifest.close()
+    # The stored page is still the old one: it is downloaded again
+    bts = BTC_Downloader(f'{forum.base_uri}?board=14.0', base_path='BitcoinTalk-Forum', quiet=True)
+    bts._download_page(job)
+    with open(os.path.join('BitcoinTalk-Forum', 'Pools', '41001', '1.html'), 'r', encoding='utf-8') as file:
+        assert file.read() == forum.pages['topic=41001.0'].decode('latin1')
+    bts._storage.close()
+    bts._manifest.close()
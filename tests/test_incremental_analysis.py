@@ -0,0 +1,83 @@
+import random
+import copy
+import json
+
+
+def dataset(seed=1):
+    random.seed(seed)
+    words = 'the pools pool mining miners hash blocks a fee rate asic solo payout reward difficulty'.split()
+    data = {'available_boards': 2}
+    for board in ('A', 'B'):
+        data[board] = {}
+        for topic in range(6):
+            posts = [{'author': {'name': 'x', 'profile': None}, 'html_content': '', 'last_edit': 1.4e9 + random.random() * 1e8,
+                      'raw_content': ' '.join(random.choice(words) for _ in range(random.randint(1, 25)))} for _ in range(random.randint(1, 30))]
+            data[board][f'topic {topic}'] = {'started_by': {}, 'started_at': 0, 'total_pages': 1, 'link': '', '1': {'posts': posts}}
+    return data
+
+
+def results_of(boards):
+    # Words of a topic are sorted by occurrences, the order of equal ones depends on the order their posts were analyzed
+    return json.loads(json.dumps({board: {title: ({**topic, 'words': dict(sorted(topic['words'].items()))} if title != 'metadata' else topic)
+                                          for title, topic in topics.items()} for board, topics in boards.items()}))
+
+
+def full_scan(analyzer, data):
+    a = analyzer(data)
+    a.full_scan(max_topics=None, json_output=False)
+    return results_of(a.boards)
+
+
+def update(analyzer, data):
+    a = analyzer(data)
+    a.update(json_output=True)
+    with open('analysis_results.json', 'r', encoding='utf-8') as file:
+        return results_of(json.load(file))
+
+
+def test_update_is_a_full_scan(analyzer):
+    data = dataset()
+    assert update(analyzer, data) == full_scan(analyzer, data)
+
+
+def test_update_with_new_and_edited_posts(analyzer):
+    data = dataset()
+    update(analyzer, data)
+    data = copy.deepcopy(data)
+    data['A']['topic 1']['1']['posts'].append({'author': {'name': 'y', 'profile': None}, 'html_content': '', 'raw_content': 'the solo miners', 'last_edit': 1.6e9})
+    data['B']['topic 2']['1']['posts'][0].update(raw_content='the asic fee', last_edit=1.6e9)
+    assert update(analyzer, data) == full_scan(analyzer, data)
+
+
+def test_update_after_a_topic_is_removed(analyzer):
+    data = dataset()
+    update(analyzer, data)
+    data = copy.deepcopy(data)
+    del data['A']['topic 3']
+    assert update(analyzer, data) == full_scan(analyzer, data)
+
+
+def test_update_after_a_topic_is_renamed(analyzer):
+    data = dataset()
+    update(analyzer, data)
+    data = copy.deepcopy(data)
+    data['B']['topic 4 (renamed)'] = data['B'].pop('topic 4')
+    assert update(analyzer, data) == full_scan(analyzer, data)
+
+
+def test_update_after_a_board_is_removed(analyzer):
+    data = dataset()
+    update(analyzer, data)
+    data = copy.deepcopy(data)
+    del data['B']
+    data['available_boards'] = 1
+    assert update(analyzer, data) == full_scan(analyzer, data)
+
+
+def test_update_with_max_topics_keeps_the_other_topics(analyzer):
+    data = dataset()
+    results = update(analyzer, data)
+    a = analyzer(data)
+    a.update(max_topics=2, json_output=True)
+    with open('analysis_results.json', 'r', encoding='utf-8') as file:
+        assert results_of(json.load(file)) == results
@@ -0,0 +1,39 @@
+from DownloadHTML.DownloadHTML import BTC_Downloader
+from datetime import datetime
+import pytest
+import os
+
+
+def job(topic_id, page_nb):
+    return {'board': 'Mining', 'topic_id': topic_id, 'boardpage': 1, 'boardpages': 1, 'title': f'Topic {topic_id}', 'page': page_nb, 'pages': 2,
+            'uri': f'https://bitcointalk.org/index.php?topic={topic_id}.{(page_nb - 1) * 20}', 'path': f'Mining/{topic_id}/{page_nb}.html'}
+
+
+@pytest.fixture
+def downloader(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('logs')
+    bts = BTC_Downloader('https://bitcointalk.org/index.php?board=14.0', base_path=str(tmp_path / 'BitcoinTalk-Forum'), quiet=True)
+    bts._start = bts._check_start = bts._check_end = datetime.now()
+    bts.downloaded = []
+    monkeypatch.setattr(bts, '_retrieve_html', lambda uri, **kwargs: bts.downloaded.append(uri) or f'<html>{uri}</html>'.encode('latin1'))
+    monkeypatch.setattr(bts, 'display_logs', lambda *args: None)
+    yield bts
+    bts._manifest.close()
+    bts._storage.close()
+
+
+def test_pending_jobs_are_merged_into_a_new_download(downloader):
+    # Interrupted download: page 2 of topic 1 was never downloaded
+    downloader._journal.start([job(1, 1), job(1, 2)])
+    downloader._journal.done(job(1, 1))
+    downloader._journal.close()
+    downloader.start_downloading([job(2, 1), job(1, 2)])
+    assert sorted(downloader.downloaded) == sorted([job(2, 1)['uri'], job(1, 2)['uri']])
+    downloader.downloaded.clear()
+    downloader._journal.start([job(1, 1), job(1, 2)])
+    downloader._journal.close()
+    downloader.start_downloading([job(2, 1)])
+    assert sorted(downloader.downloaded) == sorted([job(2, 1)['uri'], job(1, 1)['uri'], job(1, 2)['uri']])
+    # The download went to its end
+    assert not downloader._journal.exists() and downloader._journal.pending() == []
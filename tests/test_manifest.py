@@ -0,0 +1,72 @@
+from DownloadHTML.Manifest import Manifest
+from DownloadHTML.DownloadHTML import BTC_Downloader
+import pytest
+
+LINK = 'https://bitcointalk.org/index.php?topic=5447390.0'
+
+
+def online(pages, replies):
+    return {'Mining': {'first_page': 1, 'pages': 1, 'links': ['https://bitcointalk.org/index.php?board=14.0'], 'topics': [
+        {'title': 'Pool', 'first_page_link': LINK, 'pages': pages, 'replies': replies, 'boardpage': 1}
+    ]}}
+
+
+@pytest.fixture
+def downloader(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    bts = BTC_Downloader('https://bitcointalk.org/index.php?board=14.0', base_path=str(tmp_path / 'BitcoinTalk-Forum'))
+    # Every page is answered by the server
+    monkeypatch.setattr(bts, '_retrieve_html', lambda uri, **kwargs: f'<html>{uri}</html>'.encode('latin1'))
+    yield bts
+    bts._manifest.close()
+    bts._storage.close()
+
+
+def download(bts, download_list, pages=None):
+    ## Jobs of a diff, only the topic pages in `pages` are downloaded (None: all of them, as a complete run) ##
+    bts._download_list = download_list
+    jobs = bts._build_jobs()
+    bts._count_pages(jobs)
+    for job in jobs:
+        if job['title'] and (pages is None or job['page'] in pages):
+            bts._download_page(job)
+
+
+def test_grown_topic_fetches_last_known_and_new_pages(downloader):
+    download(downloader, downloader._manifest.diff(online(3, 50)))
+    assert downloader._manifest.diff(online(3, 50)) == {}
+    assert downloader._manifest.diff(online(4, 70))['Mining']['topics'][0]['fetch_pages'] == [3, 4]
+
+
+def test_interrupted_delta_sync_fetches_the_page_again(downloader):
+    download(downloader, downloader._manifest.diff(online(3, 50)))
+    # Interrupted after page 4: page 3 (which has the new replies) was not downloaded
+    download(downloader, downloader._manifest.diff(online(4, 70)), pages={4})
+    assert downloader._manifest.diff(online(4, 70))['Mining']['topics'][0]['fetch_pages'] == [3, 4]
+    # Once it is, the topic is in sync
+    download(downloader, downloader._manifest.diff(online(4, 70)))
+    assert downloader._manifest.diff(online(4, 70)) == {}
+
+
+def test_interrupted_new_topic(downloader):
+    download(downloader, downloader._manifest.diff(online(3, 50)), pages={1})
+    assert downloader._manifest.diff(online(3, 50))['Mining']['topics'][0]['fetch_pages'] == [1, 2, 3]
+
+
+def test_manifest_counts_are_pending_until_commit(tmp_path):
+    manifest = Manifest(str(tmp_path / 'manifest.sqlite'))
+    topic = online(2, 30)['Mining']['topics'][0]
+    manifest.record_topic('Mining', topic)
+    for page_nb in (1, 2):
+        manifest.record_page(Manifest.topic_id(LINK), page_nb, b'page')
+    assert manifest.diff(online(2, 30)) != {}
+    manifest.commit_topic(Manifest.topic_id(LINK))
+    assert manifest.diff(online(2, 30)) == {}
+    manifest.close()
+
+
+def test_imported_topics_are_compared_by_nb_of_pages(downloader):
+    # Topics of a mirror downloaded before the manifest have no reply count
+    downloader._manifest.import_local_boards({'Mining': {'topics': [{'first_page_link': LINK, 'title': 'Pool', 'pages': 3, 'page_list': [1, 2, 3]}]}})
+    assert downloader._manifest.diff(online(3, 50)) == {}
+    assert downloader._manifest.diff(online(4, 70))['Mining']['topics'][0]['fetch_pages'] == [3, 4]
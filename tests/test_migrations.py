@@ -0,0 +1,61 @@
+from DownloadHTML.DownloadHTML import BTC_Downloader
+from tests.forum_server import FIXTURES
+import pytest
+import os
+
+
+def recorded(query):
+    with open(os.path.join(FIXTURES, f'{query}.html'), 'rb') as file:
+        return file.read().decode('latin1')
+
+
+def write(path, text, mtime):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write(text)
+    os.utime(path, (mtime, mtime))
+
+
+@pytest.fixture
+def downloader(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    bts = BTC_Downloader('https://bitcointalk.org/index.php?board=14.0', base_path='BitcoinTalk-Forum', quiet=True)
+    yield bts
+    bts._manifest.close()
+    bts._storage.close()
+
+
+def test_migrate_merges_the_sha1_directories_of_a_topic(downloader):
+    # Topic 41000 was downloaded under two titles: page 1 is in both directories (the second download is the most recent), page 3 only in the first one
+    old, new = os.path.join('BitcoinTalk-Forum', 'Pools', 'a' * 40), os.path.join('BitcoinTalk-Forum', 'Pools', 'b' * 40)
+    write(os.path.join(old, '1.html'), recorded('topic=41000.0') + '<!-- old -->', 1000)
+    write(os.path.join(old, '3.html'), recorded('topic=41000.40'), 1000)
+    write(os.path.join(new, '1.html'), recorded('topic=41000.0'), 2000)
+    write(os.path.join(new, '2.html'), recorded('topic=41000.20'), 2000)
+    # Leftovers of interrupted writes
+    write(os.path.join(new, '2.html.tmp'), 'truncated', 2000)
+    write(os.path.join('BitcoinTalk-Forum', 'Pools', '41000', '4.html.tmp'), 'truncated', 2000)
+    downloader.migrate_sha1_dirs()
+    topic_path = os.path.join('BitcoinTalk-Forum', 'Pools', '41000')
+    assert sorted(os.listdir(os.path.join('BitcoinTalk-Forum', 'Pools'))) == ['41000']
+    assert sorted(os.listdir(topic_path)) == ['1.html', '2.html', '3.html', '4.html.tmp']
+    for page_nb, query in ((1, 'topic=41000.0'), (2, 'topic=41000.20'), (3, 'topic=41000.40')):
+        with open(os.path.join(topic_path, f'{page_nb}.html'), 'r', encoding='utf-8') as file:
+            assert file.read() == recorded(query)
+    # The manifest knows the pages of the topic, and only them
+    conn = downloader._manifest._conn
+    assert conn.execute('SELECT board, title, pages FROM topics WHERE topic_id = 41000').fetchall() == [('Pools', 'Topic 41000 é', 3)]
+    assert sorted(page for page, in conn.execute('SELECT page FROM pages WHERE topic_id = 41000')) == [1, 2, 3]
+
+
+def test_pack_keeps_the_downloaded_bytes(downloader, capsys):
+    raw = recorded('topic=41000.0').replace('\n', '\r\n').encode('latin1')
+    downloader._storage.write_page('Pools', 41000, 1, raw)
+    downloader._storage.write_page('Pools', 41000, 2, recorded('topic=41000.20').encode('latin1'))
+    write(os.path.join('BitcoinTalk-Forum', 'Pools', 'a' * 40, '1.html'), recorded('topic=41001.0'), 1000)
+    downloader.pack_loose_pages()
+    assert f"Pools/{'a' * 40} is not packed" in capsys.readouterr().out
+    assert downloader._storage.read_raw_page('Pools', 41000, 1) == raw
+    assert downloader._storage.read_raw_page('Pools', 41000, 2) == recorded('topic=41000.20').encode('latin1')
+    # Packed topics are removed, the sha1 directory is left as it is
+    assert sorted(os.listdir(os.path.join('BitcoinTalk-Forum', 'Pools'))) == ['a' * 40, 'pages.idx', 'pages.pack']
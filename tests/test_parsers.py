@@ -0,0 +1,101 @@
+from Scraper.Parsers import BS4Parser, LxmlParser, locate_posts, check_parity
+from Scraper.Records import ContentReader
+from storage import open_storage, FileStorage
+import pytest
+import os
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+# Recorded topic pages, as the downloader receives them (ISO-8859-1): [(topic id, page nb), ...]
+PAGES = [(5012345, 1), (5012345, 2)]
+
+
+def raw_page(topic_id, page_nb):
+    with open(os.path.join(FIXTURES, f'topic_{topic_id}_{page_nb}.html'), 'rb') as file:
+        return file.read()
+
+
+@pytest.mark.parametrize('topic_id, page_nb', PAGES)
+def test_backends_give_the_same_page(topic_id, page_nb):
+    html = raw_page(topic_id, page_nb).decode('latin1')
+    expected, result = BS4Parser().parse_page(html, infos=True), LxmlParser().parse_page(html, infos=True)
+    for field in ('title', 'link', 'infos'):
+        assert result[field] == expected[field], field
+    assert len(result['posts']) == len(expected['posts'])
+    for expected_post, post in zip(expected['posts'], result['posts']):
+        for field in expected_post:
+            assert post[field] == expected_post[field], field
+
+
+def test_parsed_page():
+    page = BS4Parser().parse_page(raw_page(5012345, 1).decode('latin1'), infos=True)
+    assert page['title'] == 'Pool payouts & fees'
+    assert page['link'] == 'https://bitcointalk.org/index.php?topic=5012345.0'
+    # The first poster is a guest, the date of the topic is the first date of the page (here the edit of the second post)
+    assert page['infos'] == {'started_by': {'name': 'satoshi_fan', 'profile': 'noprofile'}, 'date': 'Last edit: March 04, 2014, 01:00:02 AM by kano'}
+    # The ad row is not a post
+    assert [post['profile'] for post in page['posts']] == [None, 'https://bitcointalk.org/index.php?action=profile;u=36044',
+                                                           'https://bitcointalk.org/index.php?action=profile;u=123456']
+    assert page['posts'][0]['raw_content'] == 'Which pool has the lowest fee?\nI mine with an \nS9\n & pay 2%.\nCafé <tip> \xa0thanks'
+
+
+@pytest.mark.parametrize('parser', [BS4Parser, LxmlParser])
+@pytest.mark.parametrize('topic_id, page_nb', PAGES)
+def test_located_posts(parser, topic_id, page_nb):
+    # Each located range is the body of a parsed post (quotes nest divs in the post body)
+    data = raw_page(topic_id, page_nb)
+    posts = BS4Parser().parse_page(data.decode('latin1'))['posts']
+    ranges = locate_posts(data)
+    assert len(ranges) == len(posts)
+    for (start, end), post in zip(ranges, posts):
+        assert data[start:end].startswith(b'<div class="post">') and data[start:end].endswith(b'</div>')
+        assert parser().parse_content(data[start:end].decode('latin1')) == (post['html_content'], post['raw_content'])
+
+
+def test_unbalanced_post_is_not_located():
+    data = raw_page(5012345, 2)
+    last = data.rfind(b'<div class="post">')
+    assert len(locate_posts(data[:last] + data[last:].replace(b'</div>', b'', 1))) == 1
+
+
+@pytest.mark.parametrize('backend', ['files', 'archive'])
+def test_content_reader_round_trip(tmp_path, backend):
+    # Contents of lazy posts (scraper --lazy) are read back from their byte offsets in the stored page
+    path = str(tmp_path / 'mirror')
+    os.makedirs(path)
+    storage = open_storage(path, backend)
+    for topic_id, page_nb in PAGES:
+        storage.write_page('Pools', topic_id, page_nb, raw_page(topic_id, page_nb))
+    storage.close()
+    storage = open_storage(path)
+    expected, refs = [], []
+    for topic_id, page_nb in PAGES:
+        posts = BS4Parser().parse_page(storage.read_page('Pools', topic_id, page_nb))['posts']
+        ranges = locate_posts(storage.map_page('Pools', topic_id, page_nb))
+        assert len(ranges) == len(posts)
+        expected += posts
+        refs += [['Pools', topic_id, page_nb, start, end] for start, end in ranges]
+    storage.close()
+    reader = ContentReader(path, parser='lxml')
+    for post, ref in zip(expected, refs):
+        lazy = {'author': 1, 'content_ref': ref, 'last_edit': 0}
+        assert reader.get(lazy, 'html_content') == post['html_content']
+        assert reader.get(lazy, 'raw_content') == post['raw_content']
+    # Posts with their contents are read as they are
+    assert reader.get({'raw_content': 'text'}) == 'text'
+
+
+def test_check_parity_stops_at_the_limit(tmp_path, monkeypatch, capsys):
+    path = str(tmp_path / 'mirror')
+    os.makedirs(path)
+    storage = open_storage(path)
+    for board in ('Hardware', 'Pools'):
+        for topic_id, page_nb in PAGES:
+            storage.write_page(board, topic_id, page_nb, raw_page(topic_id, page_nb))
+    storage.close()
+    assert check_parity(path) == 0 and '4 pages compared' in capsys.readouterr().out
+    listed = []
+    pages = FileStorage.pages
+    monkeypatch.setattr(FileStorage, 'pages', lambda self, board, topic_id: listed.append(board) or pages(self, board, topic_id))
+    assert check_parity(path, limit=1) == 0 and '1 page compared' in capsys.readouterr().out
+    # The pages of the other boards are not even listed
+    assert listed == ['Hardware']
@@ -0,0 +1,52 @@
+from Scraper.Scraper import BitcoinTalkScraper
+from Scraper.Records import authors_path
+from tests.forum_server import FIXTURES
+from storage import open_storage
+import pytest
+import os
+
+# Recorded forum (see tests/forum_server.py): {board: {topic id: nb of pages}}
+TOPICS = {
+    'Pools': {41000: 3, 41001: 1, 41010: 1, 41011: 2},
+    'Hardware': {76000: 2, 76001: 3}
+}
+BOARD_IDS = {'Pools': 41, 'Hardware': 76}
+
+
+def recorded(query):
+    with open(os.path.join(FIXTURES, f'{query}.html'), 'rb') as file:
+        return file.read()
+
+
+@pytest.fixture
+def mirror(tmp_path, monkeypatch):
+    ## Mirror of the recorded forum, as the downloader stores it ##
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('BitcoinTalk-Forum')
+    storage = open_storage('BitcoinTalk-Forum')
+    storage.write_forum_page(recorded('board=14.0'))
+    for board, topics in TOPICS.items():
+        storage.write_board_page(board, recorded(f'board={BOARD_IDS[board]}.0'))
+        for topic_id, pages in topics.items():
+            for page_nb in range(1, pages + 1):
+                storage.write_page(board, topic_id, page_nb, recorded(f'topic={topic_id}.{(page_nb - 1) * 20}'))
+    storage.close()
+
+
+def scrape(output, **options):
+    ## (output file, authors file, nb of parsed pages) of a scrape of the mirror ##
+    scraper = BitcoinTalkScraper(output=output, cache=False, **options)
+    scraper.extract_data()
+    # Data is saved when the scraper exits
+    with pytest.raises(SystemExit):
+        scraper.save_data()
+    with open(output, 'rb') as file, open(authors_path(output), 'rb') as authors:
+        return file.read(), authors.read(), scraper._parsed_pages
+
+
+@pytest.mark.parametrize('output, lazy', [('data.json', False), ('data.json', True), ('data.jsonl', False)])
+def test_scraper_workers_give_the_serial_output(mirror, output, lazy):
+    serial = scrape(f'serial-{output}', lazy=lazy)
+    assert b'Topic 41011' in serial[0] and serial[2] == sum(pages for topics in TOPICS.values() for pages in topics.values())
+    # Same bytes, for the records and for the table of authors
+    assert scrape(f'workers-{output}', workers=2, lazy=lazy) == serial
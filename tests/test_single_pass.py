@@ -0,0 +1,29 @@
+import json
+
+
+def dataset(texts):
+    posts = [{'author': {'name': 'x', 'profile': None}, 'html_content': '', 'raw_content': text, 'last_edit': 1.5e9 + index} for index, text in enumerate(texts)]
+    return {'available_boards': 1, 'Mining': {'Pools': {'started_by': {}, 'started_at': 0, 'total_pages': 1, 'link': '', '1': {'posts': posts}}}}
+
+
+def words(analyzer, data, single_pass):
+    a = analyzer(data, single_pass=single_pass)
+    a.full_scan(max_topics=None, json_output=False)
+    return json.loads(json.dumps(a.boards))['Mining']['Pools']
+
+
+def test_same_ngrams_when_lemmas_keep_their_tags(analyzer):
+    data = dataset(['the pools pay the miners', 'a pool with the fees', 'the blocks the hash rate', 'mining the blocks'])
+    two_passes, single_pass = words(analyzer, data, False), words(analyzer, data, True)
+    assert {'the pool', 'the miner', 'the fee', 'the block'} <= two_passes['words'].keys()
+    assert single_pass == two_passes
+
+
+def test_ngrams_differ_when_lemmas_are_tagged_again(analyzer):
+    # In two passes the lemmatized text is tagged again: 'things' (NOUN) becomes 'thing', tagged as a VERB, and 'the thing' is not matched.
+    # In a single pass the tags of the original text are kept
+    data = dataset(['the things of the pools'])
+    two_passes, single_pass = words(analyzer, data, False), words(analyzer, data, True)
+    assert 'the thing' not in two_passes['words']
+    assert single_pass['words']['the thing']['occurrences'] == 1
+    assert two_passes['words'].keys() | {'the thing'} == single_pass['words'].keys()
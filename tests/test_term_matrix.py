@@ -0,0 +1,53 @@
+from TextAnalysis.TermMatrix import TermMatrix
+import numpy as np
+import random
+
+
+def matrix(nb_of_posts=300, seed=3):
+    random.seed(seed)
+    terms = TermMatrix()
+    for post in range(nb_of_posts):
+        board = random.choice(['Mining', 'Pools', 'Hardware'])
+        # Some posts have no last_edit, some have the same one
+        last_edit = float('nan') if post % 37 == 0 else float(random.choice([random.randint(0, 1000), 500]))
+        terms.add_document(board, f'{board} {random.randint(0, 5)}', {random.choice('abcdef'): random.randint(1, 3)}, last_edit, 10)
+    return terms
+
+
+def brute_force(terms, start, end, closed, board):
+    last_edit = np.array(terms._last_edit)
+    rows = np.arange(len(terms))
+    keep = ~np.isnan(last_edit)
+    if start is not None:
+        keep &= last_edit >= start
+    if end is not None:
+        keep &= (last_edit <= end) if closed else (last_edit < end)
+    if board is not None:
+        keep &= np.array([terms.boards[terms.topics[topic]['board']] == board for topic in terms._doc_topic])
+    return rows[keep]
+
+
+def check(terms):
+    for start, end in [(None, None), (None, 500), (500, None), (100, 500), (500, 500), (2000, 3000), (-10, 0)]:
+        for closed in (True, False):
+            for board in (None, 'Mining', 'Hardware'):
+                assert terms.rows_between(start, end, closed, board).tolist() == brute_force(terms, start, end, closed, board).tolist()
+
+
+def test_rows_between(tmp_path):
+    terms = matrix()
+    check(terms)
+    # New posts are in the next windows
+    terms.add_document('Pools', 'new', {'a': 1}, 100.5, 3)
+    check(terms)
+    path = str(tmp_path / 'matrix.npz')
+    terms.save(path)
+    check(TermMatrix.load(path))
+
+
+def test_windows():
+    terms = matrix()
+    windows = terms.windows(250)
+    assert windows[0][0] == np.nanmin(np.array(terms._last_edit)) and windows[-1][0] <= np.nanmax(np.array(terms._last_edit)) < windows[-1][1]
+    rows = [terms.rows_between(start, end, closed=False) for start, end in windows]
+    assert sum(len(window) for window in rows) == len(terms.rows_between())
@@ -1,17 +1,225 @@
+from email.utils import parsedate_to_datetime
+from collections import deque
+from datetime import datetime
+import threading
+import calendar
 import requests
 import socket
+import os
+import random
+import time
 import json
 
-def make_request(url, verbose=1, prefix=''):
-   ## Making request ##
-   local_addr = socket.gethostbyname(socket.gethostname())
-   headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:80.0) Gecko/20100101 Firefox/80.0'}
-   response = requests.get(url=url, headers=headers, timeout=100)
+HEADERS = {
+   'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:80.0) Gecko/20100101 Firefox/80.0',
+   'Accept-Encoding': 'gzip, deflate',
+   'Connection': 'keep-alive'
+}
+
+## Shared session: connections are pooled and kept alive between requests (no new TCP+TLS handshake for each page) ##
+_session = None
+_session_lock = threading.RLock()
+_local_addr = None
+_stats = {'requests': 0, 'conditional': 0, 'hits': 0, 'misses': 0, 'bytes': 0}
+
+def get_session(pool_size=32):
+   global _session
+   with _session_lock:
+      if _session is None:
+         _session = requests.Session()
+         adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+         _session.mount('http://', adapter)
+         _session.mount('https://', adapter)
+         _session.headers.update(HEADERS)
+   return _session
+
+## Counters of all requests made through make_request (hits: 304 answers to conditional requests, misses: full bodies) ##
+def get_request_stats():
+   with _session_lock:
+      return dict(_stats)
+
+def _get_local_addr():
+   global _local_addr
+   if _local_addr is None:
+      _local_addr = socket.gethostbyname(socket.gethostname())
+   return _local_addr
+
+## On-disk cache of validators (ETag / Last-Modified), used to send conditional requests ##
+class ValidatorCache:
+   def __init__(self, filename='logs/validators.json'):
+      self._filename = filename
+      self._lock = threading.RLock()
+      self._validators = {}
+      ## Validators of answers whose page isn't stored yet: they are only kept (and saved) once the page is written, see commit ##
+      self._pending = {}
+      if os.path.exists(filename):
+         with open(filename, 'r', encoding='utf-8') as file:
+            self._validators = json.load(file)
+
+   def headers(self, url):
+      with self._lock:
+         validators = self._validators.get(url, {})
+      headers = {}
+      if validators.get('etag'):
+         headers['If-None-Match'] = validators['etag']
+      if validators.get('last_modified'):
+         headers['If-Modified-Since'] = validators['last_modified']
+      return headers
+
+   def update(self, url, response):
+      if response.status_code != 200:
+         return
+      etag = response.headers.get('ETag')
+      last_modified = response.headers.get('Last-Modified')
+      with self._lock:
+         self._pending[url] = {'etag': etag, 'last_modified': last_modified} if etag or last_modified else None
+
+   def commit(self, url):
+      ## The page of the last answer of `url` is stored: its validators are the ones to send next time ##
+      with self._lock:
+         if url not in self._pending:
+            return
+         validators = self._pending.pop(url)
+         if validators:
+            self._validators[url] = validators
+         else:
+            self._validators.pop(url, None)
+
+   def save(self):
+      with self._lock:
+         with open(self._filename, 'w', encoding='utf-8') as file:
+            json.dump(self._validators, file)
+
+def make_request(url, verbose=1, prefix='', validators=None, conditional=True):
+   ## Making request (conditional if validators of a previous answer are known), validators of the answer are kept once its page is stored (ValidatorCache.commit) ##
+   headers = validators.headers(url) if validators and conditional else {}
+   response = get_session().get(url=url, headers=headers, timeout=100)
+   if validators:
+      validators.update(url, response)
+   with _session_lock:
+      _stats['requests'] += 1
+      _stats['bytes'] += len(response.content)
+      if headers:
+         _stats['conditional'] += 1
+         _stats['hits' if response.status_code == 304 else 'misses'] += 1
    ## Displaying result ##
    if verbose:
-      print(f'{prefix}[{response.status_code}] <{response.reason}> -- {response.url} FROM {local_addr}')
+      print(f'{prefix}[{response.status_code}] <{response.reason}> -- {response.url} FROM {_get_local_addr()}')
    return response
 
+## Global rate limiter shared by every thread doing requests ##
+class TokenBucket:
+   def __init__(self, rate, capacity=None):
+      ## `rate` tokens are refilled every second, up to `capacity` tokens (size of the allowed burst) ##
+      self.rate = rate
+      self.capacity = capacity if capacity else max(1, rate)
+      self._tokens = self.capacity
+      self._last = time.monotonic()
+      self._lock = threading.Lock()
+
+   def acquire(self):
+      ## Block until a token is available, return the time spent waiting (in seconds) ##
+      waited = 0
+      while True:
+         with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            if self._tokens >= 1:
+               self._tokens -= 1
+               return waited
+            delay = (1 - self._tokens) / self.rate
+         time.sleep(delay)
+         waited += delay
+
+## Adaptive throttling: exponential backoff with jitter, `Retry-After` support, and AIMD adjustment of the global rate ##
+class AdaptiveThrottle:
+   def __init__(self, bucket, window=50, max_error_ratio=0.1, min_rate=0.2, base_delay=1, max_delay=120):
+      self._bucket = bucket
+      self._base_rate = bucket.rate
+      self._min_rate = min(min_rate, bucket.rate)
+      self._max_error_ratio = max_error_ratio
+      self._base_delay = base_delay
+      self._max_delay = max_delay
+      ## Outcomes (True: success, False: error) of the last `window` requests ##
+      self._outcomes = deque(maxlen=window)
+      self._pause_until = 0
+      self._last_decrease = 0
+      self._lock = threading.Lock()
+
+   @property
+   def rate(self):
+      return self._bucket.rate
+
+   def wait(self):
+      ## Block while a `Retry-After` pause is running, then wait for a token. Return the time spent waiting ##
+      waited = 0
+      with self._lock:
+         pause = self._pause_until - time.monotonic()
+      if pause > 0:
+         time.sleep(pause)
+         waited += pause
+      return waited + self._bucket.acquire()
+
+   def record(self, success):
+      with self._lock:
+         self._outcomes.append(success)
+         error_ratio = self._outcomes.count(False) / len(self._outcomes)
+         now = time.monotonic()
+         ## Too many errors: halve the global rate (at most once per second, so a burst of errors doesn't collapse it) ##
+         if not success and error_ratio > self._max_error_ratio and now - self._last_decrease > 1:
+            self._bucket.rate = max(self._min_rate, self._bucket.rate / 2)
+            self._last_decrease = now
+         ## Healthy again: slowly go back to the configured rate ##
+         elif success and error_ratio <= self._max_error_ratio / 2 and self._bucket.rate < self._base_rate:
+            self._bucket.rate = min(self._base_rate, self._bucket.rate + self._base_rate * 0.05)
+
+   def backoff(self, retry, retry_after=None):
+      ## Full jitter: random delay between 0 and base_delay * 2^(retry - 1), capped to max_delay ##
+      delay = random.uniform(0, min(self._max_delay, self._base_delay * 2 ** (retry - 1)))
+      retry_after = parse_retry_after(retry_after)
+      if retry_after is not None:
+         retry_after = min(retry_after, self._max_delay)
+         ## The server asked us to slow down: every thread pauses, not only the one that got the answer ##
+         with self._lock:
+            self._pause_until = max(self._pause_until, time.monotonic() + retry_after)
+         delay = max(delay, retry_after)
+      return delay
+
+## `Retry-After` header is either a number of seconds or an HTTP date ##
+def parse_retry_after(value):
+   if not value:
+      return None
+   try:
+      return max(0, float(value))
+   except ValueError:
+      pass
+   try:
+      date = parsedate_to_datetime(value)
+      return max(0, (date - datetime.now(date.tzinfo)).total_seconds())
+   except (TypeError, ValueError):
+      return None
+
+## Convert a forum date ('October 17, 2020, 05:43:12 PM', 'Today at 05:43:12 PM') to a timestamp ##
+def get_timestamp(date_str):
+   if 'on ' in date_str:
+      date_str = date_str.replace('on ', '')
+   if 'Today at' in date_str:
+      today = datetime.today()
+      date_str = date_str.replace('Today at', f'{calendar.month_name[today.month]} {str(today.day).zfill(2)}, {today.year},')
+   datetime_obj = datetime.strptime(date_str, '%B %d, %Y, %I:%M:%S %p')
+   timestamp = datetime.timestamp(datetime_obj)
+   return timestamp
+
+## Write a file atomically: readers (and crashes) either see the previous file or the complete new one, never a truncated one ##
+def atomic_write(path, content, encoding='utf-8'):
+   tmp_path = f'{path}.tmp'
+   with open(tmp_path, 'w', encoding=encoding) as file:
+      file.write(content)
+      file.flush()
+      os.fsync(file.fileno())
+   os.replace(tmp_path, path)
+
 ## Display all attributes of an object and their values ##
 def dump(obj):
    for attr in dir(obj):